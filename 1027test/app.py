@@ -1,9 +1,8 @@
 # app.py
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from pymongo import MongoClient, ASCENDING, UpdateOne
+from pymongo import ASCENDING, UpdateOne
 from dotenv import load_dotenv
-import os, io
-import pandas as pd
+import os, sys, io, time
 from datetime import datetime, timezone
 
 load_dotenv()
@@ -11,25 +10,73 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev")
 
+# ---- 請求延遲 / DB 時間指標（/metrics）----
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.install_pymongo_listener()  # 要在建立 MongoClient 之前
+metrics.init_app(app)
+from shared import profiler  # noqa: E402
+profiler.init_app(app)  # PROFILE_ENABLED=1 時才會掛上（見 shared/profiler.py）
+from shared import serve  # noqa: E402
+
 # ---- Mongo 連線與資料庫 ----
+# STARTUP_MODE=lazy（預設）：import 時不連線、不建索引、不載入 pandas，
+#   第一次用到 db 才建立 MongoClient，索引在第一個請求或 `flask --app app init-db` 時建立。
+# STARTUP_MODE=eager：舊行為，import 時就建立連線與索引。
 mongo_uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db")
-client = MongoClient(mongo_uri)
-db = client.get_default_database()
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+from shared import mongo  # noqa: E402
+mongo_conn = mongo.LazyMongo(mongo_uri)  # fork 後重建、worker 結束前關閉（見 shared/mongo.py）
+get_client, close_client, db = mongo_conn.get_client, mongo_conn.close, mongo_conn.db
+
+
+def ensure_indexes():
+    # 建立複合唯一索引，避免重複與加速查詢
+    db.vitals.create_index([("patient_id", ASCENDING), ("ts", ASCENDING)], unique=True)
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """部署時執行一次：flask --app app init-db"""
+    ensure_indexes()
+    print("indexes created")
+
+
+_indexes_ok = False
+_indexes_retry_at = 0.0
+
+
+@app.before_request
+def _lazy_init():
+    """第一個請求才建立索引；Mongo 連不上時不擋請求，60 秒後再試。"""
+    global _indexes_ok, _indexes_retry_at
+    if _indexes_ok or time.monotonic() < _indexes_retry_at or os.getenv("AUTO_INDEX", "1") != "1":
+        return
+    try:
+        ensure_indexes()
+        _indexes_ok = True
+    except Exception as e:
+        app.logger.warning("ensure_indexes 失敗，稍後重試：%s", e)
+        _indexes_retry_at = time.monotonic() + 60
+
 
-# 建立複合唯一索引，避免重複與加速查詢
-db.vitals.create_index([("patient_id", ASCENDING), ("ts", ASCENDING)], unique=True)
+if STARTUP_MODE == "eager":
+    import pandas  # noqa: F401
+    ensure_indexes()
+    _indexes_ok = True
 
 # ---- 工具函式 ----
 def to_num(x):
     """把表單字串/CSV NaN 轉成 float 或 None。"""
     try:
-        # pandas NaN
-        if pd.isna(x):
+        if x is None:
             return None
         # 空字串
         if isinstance(x, str) and x.strip() == "":
             return None
-        return float(x)
+        v = float(x)
+        # pandas NaN（NaN 不等於自己）
+        return None if v != v else v
     except Exception:
         return None
 
@@ -95,6 +142,7 @@ def upload():
             flash("請上傳 CSV 檔")
             return redirect(url_for("upload"))
 
+        import pandas as pd
         df = pd.read_csv(io.BytesIO(f.read()))
 
         # 正規化時間欄位
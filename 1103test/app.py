@@ -1,27 +1,154 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from pymongo import MongoClient, ASCENDING, UpdateOne
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
+from pymongo import ASCENDING, DESCENDING
 from dotenv import load_dotenv
-import os, io
-import pandas as pd
-from datetime import datetime, timezone
+import os, sys, io, json, logging, queue, time
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo  # ← 新增
+from vitals_store import VITAL_FIELDS, bulk_upsert, written_docs, doc_hash, HASH_FIELD, record_write, bump_all, get_version, get_version_and_boundary, get_versions_each, rebuild_latest, THRESHOLDS, abnormal_fields
+from pubsub import VitalsBus, start_change_stream
+import index_advisor
+import retention
+import local_time
+import vitals_columns
+import vitals_api
+# pandas / numpy / pyarrow 較重，改在用到的路由內才 import（見 STARTUP_MODE）
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev")
 
+# ---- 請求延遲 / DB 時間指標（/metrics）----
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.install_pymongo_listener()  # 要在建立 MongoClient 之前
+metrics.init_app(app)
+from shared import profiler  # noqa: E402
+profiler.init_app(app)  # PROFILE_ENABLED=1 時才會掛上（見 shared/profiler.py）
+from shared import serve  # noqa: E402
+
 # ---- Mongo 連線與資料庫 ----
+# STARTUP_MODE=lazy（預設）：import 時不連線、不建索引、不載入 pandas，
+#   第一次用到 db 才建立 MongoClient，索引在第一個請求或 `flask --app app init-db` 時建立。
+# STARTUP_MODE=eager：舊行為，import 時就建立連線與索引。
 mongo_uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db")
-client = MongoClient(mongo_uri)
-db = client.get_default_database()
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+from shared import mongo  # noqa: E402
+mongo_conn = mongo.LazyMongo(mongo_uri)  # fork 後重建、worker 結束前關閉（見 shared/mongo.py）
+get_client, close_client, db = mongo_conn.get_client, mongo_conn.close, mongo_conn.db
+
+# 索引定義有變動時把版本 +1，每個部署只會實際建立一次
+SCHEMA_VERSION = 1
+
+
+def ensure_indexes(force=False):
+    """建立 vitals 相關索引；vitals_meta 記錄已套用的版本，已是最新就只花一次查詢。"""
+    if not force:
+        m = db.vitals_meta.find_one({"_id": "__schema__"})
+        if m and m.get("version", 0) >= SCHEMA_VERSION:
+            return False
+    # 建立複合唯一索引，避免重複與加速查詢
+    db.vitals.create_index([("patient_id", ASCENDING), ("ts", ASCENDING)], unique=True)
+    db.vitals.create_index([("ts", DESCENDING)])  # 首頁「最近 50 筆」
+    db.vitals_archive.create_index([("patient_id", ASCENDING), ("month", ASCENDING)])
+    db.vitals_meta.update_one({"_id": "__schema__"}, {"$set": {"version": SCHEMA_VERSION}}, upsert=True)
+    return True
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """部署時執行一次：flask --app app init-db"""
+    created = ensure_indexes(force=True)
+    print("indexes created" if created else "indexes up to date")
+
+
+_indexes_ok = False
+_indexes_retry_at = 0.0
+
+
+@app.before_request
+def _lazy_init():
+    """lazy 模式下第一個請求才確認索引；Mongo 連不上時不擋請求，60 秒後再試。"""
+    global _indexes_ok, _indexes_retry_at
+    if _indexes_ok or time.monotonic() < _indexes_retry_at or os.getenv("AUTO_INDEX", "1") != "1":
+        return
+    try:
+        ensure_indexes()
+        _indexes_ok = True
+    except Exception as e:
+        app.logger.warning("ensure_indexes 失敗，稍後重試：%s", e)
+        _indexes_retry_at = time.monotonic() + 60
+
 
-# 建立複合唯一索引，避免重複與加速查詢
-db.vitals.create_index([("patient_id", ASCENDING), ("ts", ASCENDING)], unique=True)
+if STARTUP_MODE == "eager":
+    import pandas  # noqa: F401
+    import export_vitals  # noqa: F401
+    ensure_indexes()
+    _indexes_ok = True
 
 TAIPEI = ZoneInfo("Asia/Taipei")  # ← 新增：固定用台北時區
 
+# 回傳給前端時不需要的內部欄位
+NO_ID = vitals_api.NO_ID
+
+# ---- 即時推播（SSE）----
+# 單一行程預設由各寫入路徑直接 publish；設 VITALS_CHANGE_STREAM=1 則改聽 Mongo change stream
+# （需 replica set，可收到 import_csv.py 等其他行程的寫入）。
+# VitalsBus 只在行程內：shared/serve.py 開多個 worker 時，訂閱者連到的 worker 收不到其他 worker 的寫入，
+# 所以沒設 VITALS_CHANGE_STREAM 時自動改用 change stream；明確設 0 則照舊並記錯誤。
+bus = VitalsBus()
+_stats_cache = None  # vitals_stats 依賴 numpy，第一次查 /stats 才建立
+_change_stream_env = os.getenv("VITALS_CHANGE_STREAM", "")
+USE_CHANGE_STREAM = _change_stream_env == "1" or (not _change_stream_env and serve.WORKERS > 1)
+if not USE_CHANGE_STREAM and serve.WORKERS > 1:
+    logging.getLogger(__name__).error(
+        "VITALS_CHANGE_STREAM=0 且 workers=%s：SSE 只收得到同一個 worker 的寫入", serve.WORKERS)
+SSE_HEARTBEAT_SEC = float(os.getenv("SSE_HEARTBEAT_SEC", "15"))
+if USE_CHANGE_STREAM and not serve.PRELOADING:
+    start_change_stream(db.vitals, bus)
+
+
+@serve.post_fork
+def _after_fork():
+    # shared/serve.py preload：master 的執行緒不能帶進 worker（MongoClient 由 shared/mongo.py 重建）
+    if USE_CHANGE_STREAM:
+        start_change_stream(db.vitals, bus)
+
+
+def get_stats_cache():
+    global _stats_cache
+    if _stats_cache is None:
+        from vitals_stats import StatsCache
+        _stats_cache = StatsCache(max_patients=int(os.getenv("STATS_CACHE_PATIENTS", "256")))
+    return _stats_cache
+
+
+# 圖表讀取的本機時間序列快取（見 ts_cache.py）：TS_CACHE=1 開啟，
+# 欄位式 / 二進位的 /api/vitals/<id> 與 /api/vitals/multi 改讀 TS_CACHE_DIR 下的 memory-mapped 檔
+TS_CACHE_ENABLED = os.getenv("TS_CACHE") == "1"
+_ts_cache = None
+
+
+def get_ts_cache():
+    """沒開啟回傳 None；ts_cache 依賴 numpy，第一次用到才建立。"""
+    global _ts_cache
+    if not TS_CACHE_ENABLED:
+        return None
+    if _ts_cache is None:
+        from ts_cache import TsCache
+        _ts_cache = TsCache(os.getenv("TS_CACHE_DIR") or os.path.join(app.root_path, "ts_cache"))
+    return _ts_cache
+
+
+def _after_vitals_write(docs):
+    """所有寫入 vitals 的路徑寫完後呼叫（docs 為實際寫入成功的文件）。"""
+    record_write(db, docs)
+    if _stats_cache is not None:
+        _stats_cache.on_write(docs)
+    if not USE_CHANGE_STREAM:
+        bus.publish(docs)
+
 def _q_time_from_local_iso(s: str):
     """表單 datetime-local（本地台北）→ UTC datetime（查詢用）"""
     if not s:
@@ -64,30 +191,16 @@ def _build_query_from_form(form):
 def to_num(x):
     """把表單字串/CSV NaN 轉成 float 或 None。"""
     try:
-        if pd.isna(x):
+        if x is None:
             return None
         if isinstance(x, str) and x.strip() == "":
             return None
-        return float(x)
+        v = float(x)  # pd.NA 等無法轉換的會丟例外
+        return None if v != v else v  # NaN
     except Exception:
         return None
 
 
-def to_local_pair(dt_utc):
-    """
-    UTC -> 台北時間，回傳：
-      (1) 表格顯示用: 'YYYY/MM/DD HH:MM'
-      (2) <input type="datetime-local"> 用: 'YYYY-MM-DDTHH:MM'
-    """
-    if not dt_utc:
-        return "", ""
-    try:
-        local = dt_utc.astimezone(TAIPEI)
-        return local.strftime("%Y/%m/%d %H:%M"), local.strftime("%Y-%m-%dT%H:%M")
-    except Exception:
-        return "", ""
-
-
 def parse_local_iso_to_utc(ts_raw: str):
     """
     解析 <input type="datetime-local"> 的字串 (YYYY-MM-DDTHH:MM) 為 UTC datetime。
@@ -96,9 +209,10 @@ def parse_local_iso_to_utc(ts_raw: str):
     try:
         if not ts_raw:
             return None
-        naive = datetime.fromisoformat(ts_raw)         # 無時區
-        local = naive.replace(tzinfo=TAIPEI)           # 標為台北
-        return local.astimezone(timezone.utc)          # 轉 UTC
+        dt = datetime.fromisoformat(ts_raw)
+        if dt.tzinfo is None:                          # 無時區
+            dt = dt.replace(tzinfo=TAIPEI)             # 標為台北
+        return dt.astimezone(timezone.utc)             # 轉 UTC
     except Exception:
         return None
 
@@ -127,20 +241,21 @@ def quick_add():
         "spo2": to_num(request.form.get("spo2")),
         "temp": to_num(request.form.get("temp")),
     }
+    doc[HASH_FIELD] = doc_hash(doc)
 
     db.vitals.update_one({"patient_id": pid, "ts": ts}, {"$set": doc}, upsert=True)
+    _after_vitals_write([doc])
     flash(f"已寫入：{pid} @ {ts.isoformat()}")
     return redirect(request.referrer or url_for("home"))
 
 
 @app.route("/")
 def home():
-    # 撈最近 50 筆並附上本地時間雙格式
-    rows_raw = list(db.vitals.find({}, {"_id": 0}).sort("ts", -1).limit(50))
+    # 撈最近 50 筆並附上本地時間雙格式（整欄一次轉換）
+    rows_raw = list(db.vitals.find({}, NO_ID).sort("ts", -1).limit(50))
+    shown, iso = local_time.local_pairs([r.get("ts") for r in rows_raw])
     rows = []
-    for r in rows_raw:
-        ts = r.get("ts")
-        ts_local_str, ts_local_iso = to_local_pair(ts)
+    for r, ts_local_str, ts_local_iso in zip(rows_raw, shown, iso):
         rows.append({
             "patient_id": r.get("patient_id", ""),
             "ts_local_str": ts_local_str,  # 表格顯示
@@ -162,6 +277,7 @@ def upload():
             flash("請上傳 CSV 檔")
             return redirect(url_for("upload"))
 
+        import pandas as pd
         df = pd.read_csv(io.BytesIO(f.read()))
 
         # 正規化時間欄位
@@ -172,7 +288,7 @@ def upload():
 
         ts_series = pd.to_datetime(df[ts_col], errors="coerce")
 
-        ops, skipped = [], 0
+        docs, skipped = [], 0
         for i, r in df.iterrows():
             pid_raw = r.get("patient_id")
             if pd.isna(pid_raw) or not str(pid_raw).strip():
@@ -199,49 +315,378 @@ def upload():
                 "spo2": to_num(r.get("spo2")),
                 "temp": to_num(r.get("temp")),
             }
-            ops.append(UpdateOne({"patient_id": pid, "ts": doc["ts"]}, {"$set": doc}, upsert=True))
-
-        if ops:
-            db.vitals.bulk_write(ops, ordered=False)
-
-        flash(f"已匯入 {len(ops)} 筆記錄，跳過 {skipped} 筆（缺欄或時間格式不符）")
+            docs.append(doc)
+
+        # 勾選「只寫入有變動的資料」時，內容與資料庫相同的列不重寫
+        only_changed = request.form.get("only_changed") == "1"
+        res = bulk_upsert(db.vitals, docs, skip_unchanged=only_changed)
+        _after_vitals_write(written_docs(docs, res))
+
+        written = len(docs) - len(res["unchanged"]) - len(res["errors"])
+        msg = f"已匯入 {written} 筆記錄，跳過 {skipped} 筆（缺欄或時間格式不符）"
+        if only_changed:
+            msg += f"，未變動 {len(res['unchanged'])} 筆"
+        if res["errors"]:
+            msg += f"，寫入失敗 {len(res['errors'])} 筆"
+        flash(msg)
         return redirect(url_for("home"))
 
     return render_template("upload.html")
 
 
+# ---- 批次寫入 API（給監測設備等機器用戶端） ----
+BATCH_CHUNK = int(os.getenv("BATCH_CHUNK", "2000"))  # 每次 bulk_write 的筆數
+
+
+def _doc_from_item(item):
+    """
+    JSON 物件 → vitals 文件，規則同 quick_add：
+    patient_id / timestamp(或 ts) 必填；數值欄位用 to_num 轉換。
+    回傳 (doc, None) 或 (None, 錯誤訊息)。
+    """
+    if not isinstance(item, dict):
+        return None, "不是 JSON 物件"
+    pid = str(item.get("patient_id") or "").strip()
+    ts_raw = item.get("timestamp", item.get("ts"))
+    if not pid or not ts_raw:
+        return None, "缺少必要欄位：patient_id / timestamp"
+    ts = parse_local_iso_to_utc(str(ts_raw).strip())
+    if not ts:
+        return None, "時間格式不正確（ISO 8601）"
+    doc = {"patient_id": pid, "ts": ts}
+    for k in VITAL_FIELDS:
+        doc[k] = to_num(item.get(k))
+    return doc, None
+
+
+def _iter_batch_items():
+    """依 Content-Type 逐筆讀出 (原始字串或物件)：NDJSON 邊讀邊處理，JSON 陣列一次解析。"""
+    ctype = (request.mimetype or "").lower()
+    if ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                yield line
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            raise ValueError("body 需為 JSON 陣列或 NDJSON")
+        yield from data
+
+
+def _flush_batch(chunk, results, totals, skip_unchanged=False):
+    """chunk: [(原始索引, doc)]，寫入後把每筆結果填回 results。"""
+    docs = [d for _, d in chunk]
+    res = bulk_upsert(db.vitals, docs, skip_unchanged=skip_unchanged)
+    _after_vitals_write(written_docs(docs, res))
+    totals["matched"] += res["matched"]
+    totals["modified"] += res["modified"]
+    for j, (i, _) in enumerate(chunk):
+        if j in res["errors"]:
+            results.append({"i": i, "status": "error", "error": res["errors"][j]})
+        elif j in res["unchanged"]:
+            results.append({"i": i, "status": "unchanged"})
+        elif j in res["upserted"]:
+            results.append({"i": i, "status": "upserted"})
+        else:
+            results.append({"i": i, "status": "ok"})
+
+
+@app.post("/api/vitals/batch")
+def api_vitals_batch():
+    """
+    批次寫入：body 為 JSON 陣列，或 Content-Type: application/x-ndjson 每行一筆。
+    每筆格式：{"patient_id", "timestamp", "hr", "bp_sys", "bp_dia", "spo2", "temp"}
+    以 (patient_id, ts) upsert，每 BATCH_CHUNK 筆送一次 bulk_write。
+    ?results=errors 只回傳失敗的項目（大量上傳時可縮小回應）。
+    ?skip_unchanged=1 內容與資料庫相同的讀數不重寫（狀態為 unchanged）。
+    """
+    only_errors = request.args.get("results") == "errors"
+    skip_unchanged = request.args.get("skip_unchanged") == "1"
+    results, chunk = [], []
+    totals = {"received": 0, "matched": 0, "modified": 0}
+
+    try:
+        for i, raw in enumerate(_iter_batch_items()):
+            totals["received"] += 1
+            if isinstance(raw, (bytes, str)):
+                try:
+                    raw = json.loads(raw)
+                except ValueError:
+                    results.append({"i": i, "status": "error", "error": "JSON 格式錯誤"})
+                    continue
+            doc, err = _doc_from_item(raw)
+            if err:
+                results.append({"i": i, "status": "error", "error": err})
+                continue
+            chunk.append((i, doc))
+            if len(chunk) >= BATCH_CHUNK:
+                _flush_batch(chunk, results, totals, skip_unchanged)
+                chunk = []
+        if chunk:
+            _flush_batch(chunk, results, totals, skip_unchanged)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    results.sort(key=lambda r: r["i"])
+    failed = sum(1 for r in results if r["status"] == "error")
+    totals["upserted"] = sum(1 for r in results if r["status"] == "upserted")
+    totals["unchanged"] = sum(1 for r in results if r["status"] == "unchanged")
+    totals["failed"] = failed
+    if only_errors:
+        results = [r for r in results if r["status"] == "error"]
+    return jsonify({"ok": failed == 0, **totals, "results": results})
+
+
+_parse_query_time = local_time.parse_query_time
+_ts_ms = vitals_api.ts_ms
+
+
+def _with_archive(patient_id, rows, start, end, since=None):
+    """把 vitals_archive 的舊資料接在前面（同 ts 以熱資料為準）；要不要讀由 VitalsQuery.needs_archive 判斷。"""
+    return retention.merge_with_hot(retention.read_archive(db, patient_id, start, end), rows, since)
+
+
+# ---- 多位病人一次查詢（病房儀表板）----
+MULTI_MAX_IDS = int(os.getenv("MULTI_MAX_IDS", "200"))
+
+
+@app.route("/api/vitals/multi")
+def api_vitals_multi():
+    """
+    ?ids=A001,B015,...&start=...&end=...&bucket=5m
+    一次 $in 查詢（走 (patient_id, ts) 索引）取代 N 次 /api/vitals/<id>，
+    回應依病人分組、邊查邊送：{"A001": {"ts": [...], "hr": [...], ...}, "B015": {...}}
+    沒有資料的病人給空陣列。沒給 start 時預設最近 24 小時；只讀熱資料（不含歸檔）。
+    bucket：依時間桶取平均（30s / 5m / 1h / 1d），點數多時先降採樣。
+    開啟 TS_CACHE 時改讀本機快取，平均在 NumPy 算。
+    有給 start 時，版本沒變就回 304（預設視窗不回 304）。
+    """
+    ids = list(dict.fromkeys(p.strip() for v in request.args.getlist("ids") for p in v.split(",") if p.strip()))
+    if not ids:
+        return jsonify({"ok": False, "error": "需要 ids"}), 400
+    if len(ids) > MULTI_MAX_IDS:
+        return jsonify({"ok": False, "error": f"ids 最多 {MULTI_MAX_IDS} 位"}), 400
+    try:
+        bucket_ms = vitals_columns.parse_bucket(request.args.get("bucket"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    etag, last_mod, versions = get_versions_each(db, ids)
+    # 沒給 start 時視窗跟著現在移動：舊資料滑出視窗不會改變版本號，這時 ETag 相同也不回 304
+    implicit_window = not request.args.get("start")
+    if not implicit_window and vitals_api.not_modified(request, etag, last_mod):
+        resp = Response(status=304)
+    else:
+        s_dt = _parse_query_time(request.args.get("start")) or datetime.now(timezone.utc) - timedelta(days=1)
+        e_dt = _parse_query_time(request.args.get("end"))
+        cache = get_ts_cache()
+        q = {"patient_id": {"$in": ids}, "ts": {"$gte": s_dt}}
+        if e_dt:
+            q["ts"]["$lt"] = e_dt
+        groups = None if cache else db.vitals.aggregate(vitals_columns.multi_pipeline(q, bucket_ms), allowDiskUse=True)
+
+        def gen_cached():
+            import ts_cache
+            yield "{"
+            for i, pid in enumerate(ids):
+                rec = cache.read(db, pid, versions[pid], start_ms=_ts_ms(s_dt), end_ms=_ts_ms(e_dt) if e_dt else None)
+                cols = ts_cache.bucket_means(rec, bucket_ms) if bucket_ms else ts_cache.to_columns(rec)
+                yield ("," if i else "") + json.dumps(pid) + ":" + app.json.dumps(cols)
+            yield "}"
+
+        def gen():
+            sent = set()
+            yield "{"
+            for pid, cols in vitals_columns.iter_patients(groups, bucketed=bool(bucket_ms)):
+                yield ("," if sent else "") + json.dumps(pid) + ":" + app.json.dumps(cols)
+                sent.add(pid)
+            for pid in ids:
+                if pid not in sent:
+                    yield ("," if sent else "") + json.dumps(pid) + ":" + app.json.dumps(vitals_columns.empty_columns())
+                    sent.add(pid)
+            yield "}"
+
+        resp = Response(stream_with_context(gen_cached() if cache else gen()), mimetype="application/json")
+
+    return vitals_api.set_cache_headers(resp, etag, last_mod)
+
+
 @app.route("/api/vitals/<patient_id>")
 def api_vitals(patient_id):
     """
     支援 ?start=YYYY-MM-DDTHH:MM[:SS] / ?end=...
     若無時區，視為台北時間並轉 UTC 查詢。
+    ?since=... 只回傳 ts 比它新的資料（ISO 或 epoch 毫秒），給輪詢做增量更新。
+    範圍早於歸檔邊界（vitals_meta 的 archived_before，retention.py 寫入）時，會一併讀取 vitals_archive 的歸檔資料。
+    ?tz=Asia/Taipei（或其他 IANA 時區）：每筆多一個 ts_local（ISO 8601 含偏移），整批一次轉換。
+    ?format=columnar：{"ts": [epoch ms], "hr": [...], ...}（缺值為 null）；
+    ?format=binary：同內容的 typed array 二進位格式（見 vitals_columns.py）。
+    開啟 TS_CACHE 時欄位式 / 二進位改讀本機快取（見 ts_cache.py）。
+    回應帶 ETag / Last-Modified（來自 vitals_meta），沒變就直接回 304，不查 vitals。
     """
-    start = request.args.get("start")
-    end = request.args.get("end")
-
-    q = {"patient_id": patient_id}
+    try:
+        vq = vitals_api.VitalsQuery(patient_id, request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    etag, last_mod, boundary = get_version_and_boundary(db, patient_id)
+    archived = vq.needs_archive(boundary)
+    if vitals_api.not_modified(request, etag, last_mod):
+        resp = Response(status=304)
+    elif vq.fmt == "rows":
+        rows = list(db.vitals.find(vq.q, NO_ID).sort("ts", ASCENDING))
+        if archived:
+            rows = _with_archive(patient_id, rows, vq.lower, vq.end, vq.since)
+        if vq.tz:
+            vitals_api.add_local_times(rows, vq.tz)
+        resp = jsonify(rows)
+    else:
+        cache = get_ts_cache()
+        if cache:
+            rec = cache.read(db, patient_id, etag, **vq.cache_range())
+            cols = vitals_api.cached_columns(rec, vq.fmt == "columnar" or archived)
+        else:
+            # 欄位式：陣列由 $group 組好，不建每一筆的 dict
+            cols = vitals_columns.merge_groups(db.vitals.aggregate(vitals_columns.columnar_pipeline(vq.q)))
+        if archived:
+            cols = vitals_columns.prepend_rows(_with_archive(patient_id, [], vq.lower, vq.end, vq.since), cols)
+        if vq.fmt == "binary":
+            body, mimetype, headers = vitals_api.binary_body(cols)
+            resp = Response(body, mimetype=mimetype, headers=headers)
+        else:
+            resp = jsonify(cols)
+    return vitals_api.set_cache_headers(resp, etag, last_mod)
+
+
+@app.route("/api/vitals/<patient_id>/stream")
+def api_vitals_stream(patient_id):
+    """
+    Server-Sent Events：推送訂閱之後新寫入的資料。
+    ?since=<epoch ms>：圖表載入的歷史資料最後一筆，先補送 ts 之後的資料，銜接「載入歷史 → 開始訂閱」之間的空檔；
+    斷線重連時瀏覽器會帶 Last-Event-ID（上一筆的 epoch ms），取兩者較新的。
+    先訂閱再補送：補送期間寫入的資料可能重複送一次，接收端依 ts 去重。
+    """
+    q = bus.subscribe(patient_id)
+    since = vitals_api.stream_since(request)
 
-    def _parse_query_time(s: str):
-        if not s:
-            return None
+    def gen():
         try:
-            dt = datetime.fromisoformat(s)
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=TAIPEI)
-            return dt.astimezone(timezone.utc)
-        except Exception:
-            return None
-
-    s_dt = _parse_query_time(start)
-    e_dt = _parse_query_time(end)
-
-    if s_dt or e_dt:
-        q["ts"] = {}
-        if s_dt: q["ts"]["$gte"] = s_dt
-        if e_dt: q["ts"]["$lt"] = e_dt
-
-    cur = db.vitals.find(q, {"_id": 0}).sort("ts", ASCENDING)
-    return jsonify(list(cur))
+            yield "retry: 3000\n\n"
+            if since:
+                for d in db.vitals.find({"patient_id": patient_id, "ts": {"$gt": since}}).sort("ts", ASCENDING):
+                    yield vitals_api.sse_event(d, app.json.dumps)
+            while True:
+                try:
+                    doc = q.get(timeout=SSE_HEARTBEAT_SEC)
+                except queue.Empty:
+                    yield ": ping\n\n"  # 心跳，避免 proxy 斷線
+                    continue
+                yield vitals_api.sse_event(doc, app.json.dumps)
+        finally:
+            bus.unsubscribe(patient_id, q)
+
+    return Response(stream_with_context(gen()), mimetype="text/event-stream", headers=vitals_api.SSE_HEADERS)
+
+
+@app.route("/export/vitals")
+def export_vitals_file():
+    """
+    匯出給分析用：?format=arrow（預設，Arrow IPC stream）或 parquet
+    ?patients=A001,B015（不給則全部）&start=...&end=...（無時區視為台北時間）
+    ?tz=Asia/Taipei：ts 欄改成該時區（預設 UTC）
+    邊查邊寫、邊送出，記憶體只放一個 batch。
+    """
+    fmt = request.args.get("format", "arrow")
+    if fmt not in ("arrow", "parquet"):
+        return jsonify({"ok": False, "error": "format 需為 arrow 或 parquet"}), 400
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return jsonify({"ok": False, "error": "伺服器未安裝 pyarrow"}), 501
+    tz = request.args.get("tz") or "UTC"
+    try:
+        local_time.get_tz(tz)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    # 同 export_vitals.py 的 --start / --end：格式不符時報錯，不要默默匯出全部
+    bounds = {}
+    for name in ("start", "end"):
+        raw = request.args.get(name)
+        bounds[name] = _parse_query_time(raw)
+        if raw and bounds[name] is None:
+            return jsonify({"ok": False, "error": f"{name} 時間格式不符：{raw}"}), 400
+    import export_vitals
+
+    pids = [p.strip() for p in (request.args.get("patients") or "").split(",") if p.strip()]
+    gen = export_vitals.stream_export(
+        db, fmt, tz=tz,
+        patient_ids=pids or None,
+        start=bounds["start"],
+        end=bounds["end"],
+    )
+    if fmt == "parquet":
+        mimetype, ext = "application/vnd.apache.parquet", "parquet"
+    else:
+        mimetype, ext = "application/vnd.apache.arrow.stream", "arrows"
+    return Response(stream_with_context(gen), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=vitals.{ext}"})
+
+
+# ---- 病房總覽：每位病人最新一筆 + 異常標示（門檻見 vitals_store.THRESHOLDS）----
+def _ward_rows():
+    rows = list(db.latest_vitals.find({}, NO_ID).sort("_id", ASCENDING))
+    shown, _ = local_time.local_pairs([d.get("ts") for d in rows])
+    for d, ts_local_str in zip(rows, shown):
+        d["ts_local_str"] = ts_local_str
+        d["abnormal"] = abnormal_fields(d)
+    return rows
+
+
+def _nan_list(a, nd=3):
+    """NumPy 陣列 → JSON 串列（NaN → null）"""
+    return [None if x != x else round(float(x), nd) for x in a.tolist()]
+
+
+@app.route("/api/vitals/<patient_id>/stats")
+def api_vitals_stats(patient_id):
+    """
+    滾動統計與預警：?window=點數（預設 12）&start=&end=
+    回傳欄位陣列：ts(epoch ms)、各 vital 的 value/mean/std/roc_per_h、NEWS2 分數、
+    超出 THRESHOLDS 的位置，以及最後一筆的預警等級。
+    """
+    try:
+        window = max(1, min(int(request.args.get("window", 12)), 10_000))
+    except ValueError:
+        return jsonify({"ok": False, "error": "window 需為整數"}), 400
+    s_dt = _parse_query_time(request.args.get("start"))
+    e_dt = _parse_query_time(request.args.get("end"))
+
+    from vitals_stats import compute_stats
+    series = get_stats_cache().get(db, patient_id)
+    st = compute_stats(series, window, THRESHOLDS,
+                       start_ms=_ts_ms(s_dt) if s_dt else None,
+                       end_ms=_ts_ms(e_dt) if e_dt else None)
+    return jsonify({
+        "patient_id": patient_id,
+        "window": window,
+        "n": len(st["ts"]),
+        "ts": st["ts"].tolist(),
+        "fields": {k: {name: _nan_list(a) for name, a in f.items()} for k, f in st["fields"].items()},
+        "news": st["news"].tolist(),
+        "alerts": {k: idx.tolist() for k, idx in st["alerts"].items()},
+        "latest": st["latest"],
+    })
+
+
+@app.route("/ward")
+def ward():
+    return render_template("ward.html", rows=_ward_rows(), thresholds=THRESHOLDS)
+
+
+@app.route("/api/ward")
+def api_ward():
+    return jsonify(_ward_rows())
 
 
 @app.route("/chart/<patient_id>")
@@ -250,21 +695,72 @@ def chart(patient_id):
 
 
 
+def _apply_demo_update(q, update_doc, session=None):
+    """
+    /demo 的 update_many，連同前後筆數與抽樣只用兩次往返：
+      - 更新前筆數 = update_many 的 matched_count（就是當下符合 q 的筆數）
+      - 更新沒動到查詢條件的欄位 → 更新後筆數必然相同，只需抽樣
+      - 有動到（例如 $inc hr 而 q 有 hr 範圍）→ 一次 $facet 同時算筆數與抽樣
+    """
+    res = db.vitals.update_many(q, update_doc, session=session)
+    touched = set()
+    for part in update_doc.values():
+        touched |= set(part)
+
+    if touched & set(q):
+        facet = next(db.vitals.aggregate([
+            {"$match": q},
+            {"$facet": {
+                "after": [{"$count": "n"}],
+                "sample": [{"$sort": {"ts": 1}}, {"$limit": 20}, {"$project": NO_ID}],
+            }},
+        ], session=session))
+        after = facet["after"][0]["n"] if facet["after"] else 0
+        sample = facet["sample"]
+    else:
+        after = res.matched_count
+        # 抽樣 20 筆看更新後結果
+        sample = list(db.vitals.find(q, NO_ID, session=session).sort("ts", ASCENDING).limit(20))
+
+    update_info = type("U", (), {})()
+    update_info.matched = res.matched_count
+    update_info.modified = res.modified_count
+    update_info.before = res.matched_count
+    update_info.after = after
+    update_info.sample = sample
+    return update_info
+
+
 @app.route("/demo", methods=["GET", "POST"])
 def demo():
     find_results = None
     update_info = None
+    explain_info = None
 
     if request.method == "POST":
         action = request.form.get("action")
 
         if action == "find":
             q = _build_query_from_form(request.form)
-            cur = db.vitals.find(q, {"_id": 0}).sort("ts", ASCENDING).limit(200)
+            index_advisor.record_shape(db, q)
+            cur = db.vitals.find(q, NO_ID).sort("ts", ASCENDING).limit(200)
             find_results = list(cur)
 
+        elif action == "explain":
+            # 不回傳資料，只看執行計畫：掃了幾筆、回了幾筆、用了哪個索引
+            q = _build_query_from_form(request.form)
+            index_advisor.record_shape(db, q)
+            explain_info = index_advisor.explain_find(db, q)
+            explain_info["query"] = q
+
+        elif action == "create_index":
+            name = index_advisor.create_suggested(db, request.form.get("shape", ""))
+            flash(f"已建立索引：{name}" if name else "找不到對應的查詢形狀")
+            return redirect(url_for("demo"))
+
         elif action == "update":
             q = _build_query_from_form(request.form)
+            index_advisor.record_shape(db, q)
 
             # 準備 $set / $inc（僅對有填值的欄位更新）
             set_fields = {
@@ -294,25 +790,33 @@ def demo():
             if not update_doc:
                 flash("沒有可更新的欄位（$set/$inc 都是空）")
                 return redirect(url_for("demo"))
+            # 數值被手動改過，清掉內容雜湊，之後重新匯入原始資料時才會寫回
+            update_doc["$unset"] = {HASH_FIELD: ""}
+
+            # 受影響的病人先記下來（update 不會改 patient_id），之後只重建這些人的最新快照
+            affected = db.vitals.distinct("patient_id", q)
+            use_txn = request.form.get("u_txn") == "1"
+            if use_txn:
+                # 交易內執行：更新前後的筆數與抽樣是同一個快照（需 replica set）
+                with get_client().start_session() as sess:
+                    update_info = sess.with_transaction(
+                        lambda s: _apply_demo_update(q, update_doc, session=s))
+            else:
+                update_info = _apply_demo_update(q, update_doc)
 
-            # 更新前筆數
-            before = db.vitals.count_documents(q)
-            res = db.vitals.update_many(q, update_doc)
-            after = db.vitals.count_documents(q)
-
-            # 抽樣 20 筆看更新後結果
-            sample = list(db.vitals.find(q, {"_id":0}).sort("ts", ASCENDING).limit(20))
-
-            update_info = type("U", (), {})()
-            update_info.matched = res.matched_count
-            update_info.modified = res.modified_count
-            update_info.before = before
-            update_info.after = after
-            update_info.sample = sample
+            if update_info.modified:
+                bump_all(db)
+                if _stats_cache is not None:
+                    _stats_cache.clear()
+                # 數值被改過，重建受影響病人的最新快照
+                if affected:
+                    rebuild_latest(db, affected)
 
     return render_template("demo.html",
                            find_results=find_results,
-                           update_info=update_info)
+                           update_info=update_info,
+                           explain_info=explain_info,
+                           advice=index_advisor.advise(db))
 
 if __name__ == "__main__":
     app.run(debug=True)
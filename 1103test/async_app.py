@@ -0,0 +1,208 @@
+# async_app.py — 讀取量大的 vitals API 的 asyncio 版本（Quart + Motor）
+#
+# 儀表板每幾秒輪詢一次 /api/vitals，同步 Flask 每個等 Mongo 的請求都佔住一條 worker 執行緒；
+# 這裡所有請求共用一個事件迴圈與一個 Motor 連線池，等待 Mongo 時不佔執行緒。
+# 寫入（/upload、/quick_add、/demo…）仍由 app.py 負責，兩者可以同時部署，例如
+#   hypercorn async_app:app --bind 0.0.0.0:8001      # 讀取
+#   flask --app app run                               # 寫入與頁面
+# 再由 proxy 把 /api/vitals* 與 /api/ward 導到 8001。
+# 參數解析與回應組裝和 app.py 共用 vitals_api.py、推播共用 pubsub.py，這裡只有 await 的 Motor 查詢。
+#
+# 提供：
+#   GET /api/vitals/<patient_id>         同 app.py（start / end / since / tz / format、ETag / 304、歸檔資料；
+#                                        TS_CACHE=1 時欄位式 / 二進位讀本機快取，同步在執行緒內做）
+#   GET /api/vitals/<patient_id>/stream  圖表的 SSE 更新：VITALS_CHANGE_STREAM=1 時共用一條 change stream，
+#                                        否則每條連線每 SSE_POLL_SEC 秒以 ts > 上一筆 查一次
+#   GET /api/ward                        每位病人最新一筆 + 異常標示
+#   GET /metrics                         同 app.py（shared/metrics.py）
+#
+# 需要 quart、motor（pip install quart motor hypercorn）。
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+from quart import Quart, Response, jsonify, request
+
+import local_time
+import retention
+import vitals_api
+import vitals_columns
+from pubsub import AsyncVitalsBus, watch_changes
+from vitals_api import NO_ID
+from vitals_store import abnormal_fields, archive_boundary, version_from_metas, version_query
+
+load_dotenv()
+
+app = Quart(__name__)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.install_pymongo_listener()  # 要在建立 Motor client 之前
+metrics.init_app(app)
+
+mongo_uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db")
+POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "100"))
+USE_CHANGE_STREAM = os.getenv("VITALS_CHANGE_STREAM") == "1"
+SSE_HEARTBEAT_SEC = float(os.getenv("SSE_HEARTBEAT_SEC", "15"))
+SSE_POLL_SEC = float(os.getenv("SSE_POLL_SEC", "2"))
+TS_CACHE_ENABLED = os.getenv("TS_CACHE") == "1"
+
+client = None
+db = None
+_bus = None
+_ts_cache = None
+_sync_client = None
+
+
+@app.before_serving
+async def _startup():
+    # Motor 的 client 要在事件迴圈裡建立；整個行程共用一個連線池
+    global client, db, _bus
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(mongo_uri, maxPoolSize=POOL_SIZE)
+    db = client.get_default_database()
+    if USE_CHANGE_STREAM:
+        _bus = AsyncVitalsBus()
+        app.add_background_task(watch_changes, db.vitals, _bus)
+
+
+@app.after_serving
+async def _shutdown():
+    if client is not None:
+        client.close()
+    if _sync_client is not None:
+        _sync_client.close()
+
+
+def _get_ts_cache():
+    """
+    TS_CACHE=1 時回傳 (TsCache, pymongo 的 db)。ts_cache 的同步（補 meta、撈新資料）是阻塞的
+    pymongo 呼叫，由 api_vitals 丟到執行緒執行；快取已是最新時只讀本機檔，不碰 Mongo。
+    """
+    global _ts_cache, _sync_client
+    if not TS_CACHE_ENABLED:
+        return None
+    if _ts_cache is None:
+        from pymongo import MongoClient
+        from ts_cache import TsCache
+        _sync_client = MongoClient(mongo_uri)
+        _ts_cache = TsCache(os.getenv("TS_CACHE_DIR") or os.path.join(app.root_path, "ts_cache"))
+    return _ts_cache, _sync_client.get_default_database()
+
+
+async def _with_archive(patient_id, rows, start, end, since=None):
+    """同 app.py：要不要讀由 VitalsQuery.needs_archive 判斷"""
+    buckets = await db.vitals_archive.find(retention.archive_query(patient_id, start, end)) \
+        .sort("month", 1).to_list(None)
+    return retention.merge_with_hot(retention.rows_from_buckets(buckets, start, end), rows, since)
+
+
+@app.route("/api/vitals/<patient_id>")
+async def api_vitals(patient_id):
+    """與 app.py 的 api_vitals 相同的參數與回應（含 ETag / 304）。"""
+    try:
+        vq = vitals_api.VitalsQuery(patient_id, request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    metas = await db.vitals_meta.find(version_query(patient_id)).to_list(None)
+    etag, last_mod = version_from_metas(patient_id, metas)
+    archived = vq.needs_archive(archive_boundary(metas))
+    if vitals_api.not_modified(request, etag, last_mod):
+        resp = Response("", status=304)
+    elif vq.fmt == "rows":
+        rows = await db.vitals.find(vq.q, NO_ID).sort("ts", 1).to_list(None)
+        if archived:
+            rows = await _with_archive(patient_id, rows, vq.lower, vq.end, vq.since)
+        if vq.tz:
+            vitals_api.add_local_times(rows, vq.tz)
+        resp = jsonify(rows)
+    else:
+        cache = _get_ts_cache()
+        if cache:
+            rec = await asyncio.to_thread(cache[0].read, cache[1], patient_id, etag, **vq.cache_range())
+            cols = vitals_api.cached_columns(rec, vq.fmt == "columnar" or archived)
+        else:
+            groups = await db.vitals.aggregate(vitals_columns.columnar_pipeline(vq.q)).to_list(None)
+            cols = vitals_columns.merge_groups(groups)
+        if archived:
+            cols = vitals_columns.prepend_rows(await _with_archive(patient_id, [], vq.lower, vq.end, vq.since), cols)
+        if vq.fmt == "binary":
+            body, mimetype, headers = vitals_api.binary_body(cols)
+            resp = Response(body, mimetype=mimetype, headers=headers)
+        else:
+            resp = jsonify(cols)
+    return vitals_api.set_cache_headers(resp, etag, last_mod)
+
+
+@app.route("/api/vitals/<patient_id>/stream")
+async def api_vitals_stream(patient_id):
+    """同 app.py 的 SSE（?since= / Last-Event-ID 補送）；每條連線只是一個 coroutine，不佔執行緒。"""
+    since = vitals_api.stream_since(request)
+
+    async def catch_up(after):
+        q = {"patient_id": patient_id}
+        if after:
+            q["ts"] = {"$gt": after}
+        return await db.vitals.find(q, NO_ID).sort("ts", 1).to_list(None)
+
+    async def gen():
+        yield "retry: 3000\n\n"
+        # 有 change stream 時先訂閱再補送，補送期間的寫入才不會漏（可能重複，接收端依 ts 去重）
+        q = _bus.subscribe(patient_id) if _bus is not None else None
+        last = since
+        if last:
+            for d in await catch_up(last):
+                last = d["ts"]
+                yield vitals_api.sse_event(d, app.json.dumps)
+
+        if q is not None:
+            try:
+                while True:
+                    try:
+                        doc = await asyncio.wait_for(q.get(), SSE_HEARTBEAT_SEC)
+                    except asyncio.TimeoutError:
+                        yield ": ping\n\n"
+                        continue
+                    yield vitals_api.sse_event(doc, app.json.dumps)
+            finally:
+                _bus.unsubscribe(patient_id, q)
+
+        # 沒有 change stream：輪詢，只推送連線之後的新資料
+        if last is None:
+            newest = await db.vitals.find({"patient_id": patient_id}, {"ts": 1}).sort("ts", -1).limit(1).to_list(1)
+            last = newest[0]["ts"] if newest else datetime(1970, 1, 1)
+        idle = 0.0
+        while True:
+            await asyncio.sleep(SSE_POLL_SEC)
+            new = await catch_up(last)
+            for d in new:
+                yield vitals_api.sse_event(d, app.json.dumps)
+            if new:
+                last, idle = new[-1]["ts"], 0.0
+            else:
+                idle += SSE_POLL_SEC
+                if idle >= SSE_HEARTBEAT_SEC:
+                    idle = 0.0
+                    yield ": ping\n\n"  # 心跳，避免 proxy 斷線
+
+    resp = Response(gen(), mimetype="text/event-stream", headers=vitals_api.SSE_HEADERS)
+    resp.timeout = None  # SSE 不套用 Quart 的回應逾時
+    return resp
+
+
+@app.route("/api/ward")
+async def api_ward():
+    rows = await db.latest_vitals.find({}, NO_ID).sort("_id", 1).to_list(None)
+    shown, _ = local_time.local_pairs([d.get("ts") for d in rows])
+    for d, ts_local_str in zip(rows, shown):
+        d["ts_local_str"] = ts_local_str
+        d["abnormal"] = abnormal_fields(d)
+    return jsonify(rows)
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.getenv("PORT", "8001")))
@@ -0,0 +1,153 @@
+# bench_async.py — 同步 app.py 與 async_app.py 的併發連線容量比較（需要真的 mongod）
+#
+#   MONGO_BENCH_URI=mongodb://127.0.0.1:27017/vitals_bench python bench/bench_async.py
+#   python bench/bench_async.py --levels 50,200,500,1000 --duration 10
+#   python bench/bench_async.py --sync-cmd "gunicorn -w 4 --threads 16 -b 127.0.0.1:{port} app:app"
+#
+# 分別啟動兩個伺服器（預設：app.py 用 werkzeug 的 threaded 伺服器＝每條連線一條執行緒，
+# async_app.py 用 hypercorn），以 asyncio 開 N 條 keep-alive 連線，
+# 每條像儀表板一樣不停輪詢 /api/vitals/<pid>?start=&end=（一天的範圍）。
+# 每個併發數回報 req/s、p50 / p99 延遲，以及逾時 / 連線錯誤數。
+import argparse
+import asyncio
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, "..")
+sys.path.insert(0, APP_DIR)
+
+from synth import seed_collection  # noqa: E402
+
+SYNC_CMD = (f"{sys.executable} -c \"from werkzeug.serving import run_simple; import app; "
+            "run_simple('127.0.0.1', {port}, app.app, threaded=True)\"")
+ASYNC_CMD = f"{sys.executable} -m hypercorn async_app:app --bind 127.0.0.1:{{port}}"
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(cmd, port, uri):
+    env = dict(os.environ, MONGO_URI=uri, METRICS_ENABLED="0", AUTO_INDEX="1")
+    p = subprocess.Popen(shlex.split(cmd.format(port=port)), cwd=APP_DIR, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return p
+        except OSError:
+            time.sleep(0.2)
+    p.kill()
+    raise RuntimeError(f"server did not start: {cmd}")
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        if b":" in line:
+            k, v = line.split(b":", 1)
+            headers[k.strip().lower()] = v.strip()
+    if b"content-length" in headers:
+        await reader.readexactly(int(headers[b"content-length"]))
+    elif headers.get(b"transfer-encoding") == b"chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status, headers.get(b"connection") == b"close"
+
+
+async def poller(port, paths, stop_at, lat, errs, timeout):
+    reader = writer = None
+    rnd = random.Random()
+    while time.perf_counter() < stop_at:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            path = rnd.choice(paths)
+            t0 = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            status, close = await asyncio.wait_for(_read_response(reader), timeout)
+            lat.append(time.perf_counter() - t0)
+            if status != 200:
+                errs["status"] += 1
+            if close:
+                writer.close()
+                writer = None
+        except asyncio.TimeoutError:
+            errs["timeout"] += 1
+            if writer:
+                writer.close()
+            writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errs["conn"] += 1
+            if writer:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer:
+        writer.close()
+
+
+async def run_level(port, paths, conns, duration, timeout):
+    lat, errs = [], {"timeout": 0, "conn": 0, "status": 0}
+    stop_at = time.perf_counter() + duration
+    await asyncio.gather(*(poller(port, paths, stop_at, lat, errs, timeout) for _ in range(conns)))
+    lat.sort()
+    p = (lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1e3) if lat else (lambda q: float("nan"))
+    return len(lat) / duration, p(0.50), p(0.99), errs
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--uri", default=os.getenv("MONGO_BENCH_URI", "mongodb://127.0.0.1:27017/vitals_bench"))
+    ap.add_argument("--patients", type=int, default=200)
+    ap.add_argument("--days", type=int, default=7)
+    ap.add_argument("--levels", default="50,200,500,1000", help="併發連線數")
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--timeout", type=float, default=5, help="單一請求逾時秒數")
+    ap.add_argument("--sync-cmd", default=SYNC_CMD)
+    ap.add_argument("--async-cmd", default=ASYNC_CMD)
+    args = ap.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri).get_default_database()
+    n = seed_collection(db.vitals, args.patients, args.days)
+    print(f"vitals: {n} docs, {args.patients} patients\n")
+
+    paths = []
+    for p in range(args.patients):
+        day = START + timedelta(days=p % args.days)
+        s, e = int(day.timestamp() * 1000), int((day + timedelta(days=1)).timestamp() * 1000)
+        paths.append(f"/api/vitals/P{p:05d}?start={s}&end={e}")
+
+    levels = [int(x) for x in args.levels.split(",")]
+    print(f"{'server':6} {'conns':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9}  errors")
+    for name, cmd in (("sync", args.sync_cmd), ("async", args.async_cmd)):
+        port = free_port()
+        proc = start_server(cmd, port, args.uri)
+        try:
+            for conns in levels:
+                rps, p50, p99, errs = asyncio.run(run_level(port, paths, conns, args.duration, args.timeout))
+                print(f"{name:6} {conns:6d} {rps:8.0f} {p50:8.1f} {p99:9.1f}  {errs}")
+        finally:
+            proc.terminate()
+            proc.wait(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# bench_demo_update.py — 比較 /demo update 舊版（4 次往返）與新版（2 次往返）
+#
+# 需要一個可丟棄的 mongod（預設 mongodb://127.0.0.1:27017/vitals_bench），會建立約 100 萬筆資料。
+#   python bench/bench_demo_update.py [--patients 100] [--days 70] [--repeat 5]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("MONGO_URI", os.getenv("MONGO_BENCH_URI", "mongodb://127.0.0.1:27017/vitals_bench"))
+
+from pymongo import ASCENDING  # noqa: E402
+
+import app  # noqa: E402
+from synth import seed_collection  # noqa: E402
+
+
+def old_update(db, q, update_doc):
+    """原本的寫法：count → update_many → count → find"""
+    before = db.vitals.count_documents(q)
+    res = db.vitals.update_many(q, update_doc)
+    after = db.vitals.count_documents(q)
+    sample = list(db.vitals.find(q, {"_id": 0}).sort("ts", ASCENDING).limit(20))
+    return before, res.matched_count, after, len(sample)
+
+
+def new_update(db, q, update_doc):
+    u = app._apply_demo_update(q, update_doc)
+    return u.before, u.matched, u.after, len(u.sample)
+
+
+def timeit(fn, repeat):
+    ts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        ts.append(time.perf_counter() - t0)
+    return statistics.median(ts)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--patients", type=int, default=100)
+    ap.add_argument("--days", type=int, default=70)  # 100 人 × 70 天 × 每 10 分鐘 ≈ 100 萬筆
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    db = app.db
+    n = seed_collection(db.vitals, args.patients, args.days)
+    db.vitals.create_index([("patient_id", ASCENDING), ("ts", ASCENDING)], unique=True)
+    print(f"vitals: {n:,} 筆")
+
+    cases = {
+        # 更新欄位不在條件內：新版只需 update + 抽樣
+        "set note, 單一病人": ({"patient_id": "P00001"}, {"$set": {"note": "bench"}}),
+        "set note, 全表溫度範圍": ({"temp": {"$gte": 37.0}}, {"$set": {"note": "bench"}}),
+        # 更新欄位在條件內：新版用一次 $facet
+        "inc temp, 全表溫度範圍": ({"temp": {"$gte": 37.0}}, {"$inc": {"temp": 0}}),
+    }
+    print(f"{'case':<24}{'old (s)':>10}{'new (s)':>10}{'speedup':>10}")
+    for name, (q, u) in cases.items():
+        t_old = timeit(lambda: old_update(db, q, u), args.repeat)
+        t_new = timeit(lambda: new_update(db, q, u), args.repeat)
+        print(f"{name:<24}{t_old:>10.3f}{t_new:>10.3f}{t_old / t_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# bench_startup.py — app.py 冷啟動時間：STARTUP_MODE=lazy 與 eager 比較
+#   python bench/bench_startup.py [--runs 7] [--app 1103test] [--unreachable]
+# 每次都開新的 Python 行程 import app 並建立 test client，量到 import 完成為止的時間。
+# --unreachable：MONGO_URI 指到不存在的主機，確認 lazy 模式下 worker 仍能啟動。
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+
+SNIPPET = (
+    "import time; t=time.perf_counter(); import app; app.app.test_client(); "
+    "import sys; print(time.perf_counter()-t, 'pandas' in sys.modules, 'numpy' in sys.modules)"
+)
+
+
+def run_once(app_dir, mode, uri):
+    env = dict(os.environ, STARTUP_MODE=mode)
+    if uri:
+        env["MONGO_URI"] = uri
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-c", SNIPPET], cwd=app_dir, env=env,
+                       capture_output=True, text=True, timeout=120)
+    wall = time.perf_counter() - t0
+    if p.returncode != 0:
+        return None, wall, p.stderr.strip().splitlines()[-1].split(":")[0]
+    imp, pd_loaded, np_loaded = p.stdout.split()
+    return float(imp), wall, (pd_loaded, np_loaded)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--app", default="1103test", help="1103test 或 1027test")
+    ap.add_argument("--unreachable", action="store_true")
+    args = ap.parse_args()
+
+    app_dir = os.path.join(ROOT, args.app)
+    # serverSelectionTimeoutMS 縮短，eager 模式連不上時不用等 30 秒
+    uri = "mongodb://10.255.255.1:27017/medical_db?serverSelectionTimeoutMS=3000" if args.unreachable else None
+
+    print(f"{'mode':6} {'import p50':>11} {'process p50':>12}  heavy modules / error")
+    for mode in ("lazy", "eager"):
+        imports, walls, info = [], [], None
+        for _ in range(args.runs):
+            imp, wall, info = run_once(app_dir, mode, uri)
+            walls.append(wall)
+            if imp is not None:
+                imports.append(imp)
+        imp_s = f"{statistics.median(imports) * 1000:9.0f}ms" if imports else "     failed"
+        print(f"{mode:6} {imp_s:>11} {statistics.median(walls) * 1000:10.0f}ms  {info}")
+
+
+if __name__ == "__main__":
+    main()
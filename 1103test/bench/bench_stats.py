@@ -0,0 +1,63 @@
+# bench_stats.py — vitals_stats 的向量化計算隨資料量的擴展情形（不需要資料庫）
+#   python bench/bench_stats.py [--sizes 10000,100000,1000000,5000000] [--window 12]
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from vitals_store import VITAL_FIELDS  # noqa: E402
+from vitals_stats import PatientSeries, compute_stats  # noqa: E402
+
+THRESHOLDS = {"hr": (50, 120), "bp_sys": (90, 140), "bp_dia": (60, 90), "spo2": (94, None), "temp": (35.5, 37.5)}
+
+
+def make_series(n, seed=0):
+    """直接填陣列（繞過 append 的 dict 轉換），每分鐘一筆，1% 缺值。"""
+    rng = np.random.default_rng(seed)
+    s = PatientSeries(capacity=n)
+    s._ts[:n] = 1_735_689_600_000 + np.arange(n, dtype=np.int64) * 60_000
+    base = {"hr": 75, "bp_sys": 120, "bp_dia": 80, "spo2": 97, "temp": 36.7}
+    for k in VITAL_FIELDS:
+        x = base[k] + np.cumsum(rng.normal(0, 0.5, n))
+        x[rng.random(n) < 0.01] = np.nan
+        s._v[k][:n] = x
+    s.n = n
+    return s
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000,5000000")
+    ap.add_argument("--window", type=int, default=12)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'points':>10}{'compute (ms)':>15}{'Mpoints/s':>12}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        s = make_series(n)
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            compute_stats(s, args.window, THRESHOLDS)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{n:>10,}{best * 1000:>15.1f}{n / best / 1e6:>12.1f}")
+
+    # 增量附加：每次 1 筆 vs. 容量倍增的攤銷成本
+    s = make_series(1_000_000)
+    last = s.last_ms
+    docs = [{"ts": datetime.fromtimestamp((last + (i + 1) * 60_000) / 1000, tz=timezone.utc), "hr": 80.0}
+            for i in range(10_000)]
+    t0 = time.perf_counter()
+    for d in docs:
+        s.append([d])
+    dt = time.perf_counter() - t0
+    print(f"append 1 筆 × {len(docs):,}：平均 {dt / len(docs) * 1e6:.1f} µs/筆（序列長度 {s.n:,}）")
+
+
+if __name__ == "__main__":
+    main()
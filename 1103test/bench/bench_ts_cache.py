@@ -0,0 +1,102 @@
+# bench_ts_cache.py — 長範圍圖表讀取：直接查 Mongo 與 ts_cache（memory-mapped 本機檔）比較（需要真的 mongod）
+#
+#   MONGO_BENCH_URI=mongodb://127.0.0.1:27017/vitals_bench python bench/bench_ts_cache.py
+#   python bench/bench_ts_cache.py --patients 20 --days 90 --ranges 1,7,30,90 --repeat 20
+#
+# 以 test client 打 /api/vitals/<pid>?format=columnar|binary 與 /api/vitals/multi?bucket=1h，
+# 各範圍（天）回報每次請求的中位數毫秒：mongo（TS_CACHE 關閉）、cache（已同步，只讀檔）、
+# append（每次請求前先寫入一筆新資料，量增量同步的成本）。第一次建立快取的時間另外列出。
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, "..")
+sys.path.insert(0, APP_DIR)
+
+from synth import seed_collection  # noqa: E402
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)  # synth.gen_docs 的預設起點
+
+
+def timed(fn, repeat):
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return statistics.median(out) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--uri", default=os.getenv("MONGO_BENCH_URI", "mongodb://127.0.0.1:27017/vitals_bench"))
+    ap.add_argument("--patients", type=int, default=20)
+    ap.add_argument("--days", type=int, default=90)
+    ap.add_argument("--interval", type=int, default=5, help="每幾分鐘一筆")
+    ap.add_argument("--ranges", default="1,7,30,90", help="查詢範圍（天）")
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="ts_cache_")
+    os.environ.update(MONGO_URI=args.uri, METRICS_ENABLED="0", TS_CACHE_DIR=cache_dir)
+    import app as appmod
+    from vitals_store import record_write
+
+    db = appmod.db
+    n = seed_collection(db.vitals, args.patients, args.days, interval_min=args.interval)
+    # seed_collection 直接 insert_many，沒有版本資訊；快取第一次讀取時會補上 meta 並整個建立
+    db.vitals_meta.drop()
+    client = appmod.app.test_client()
+    print(f"vitals: {n} docs, {args.patients} patients × {args.days} days, every {args.interval} min\n")
+
+    def url(kind, days):
+        s = int(START.timestamp() * 1000)
+        e = int((START + timedelta(days=days)).timestamp() * 1000)
+        if kind == "multi":
+            ids = ",".join(f"P{p:05d}" for p in range(args.patients))
+            return f"/api/vitals/multi?ids={ids}&start={s}&end={e}&bucket=1h"
+        return f"/api/vitals/P00000?format={kind}&start={s}&end={e}"
+
+    def get(u):
+        r = client.get(u)
+        assert r.status_code == 200, (u, r.status_code)
+        return len(r.get_data())
+
+    try:
+        appmod.TS_CACHE_ENABLED = True
+        t0 = time.perf_counter()
+        get(url("multi", args.days))
+        print(f"first build for {args.patients} patients: {(time.perf_counter() - t0) * 1000:.0f} ms\n")
+
+        tick = [START + timedelta(days=args.days)]
+
+        def write_then_get(u):
+            tick[0] += timedelta(minutes=args.interval)
+            doc = {"patient_id": "P00000", "ts": tick[0], "hr": 80.0}
+            db.vitals.insert_one(dict(doc))
+            record_write(db, [doc])
+            get(u)
+
+        print(f"{'request':9} {'days':>5} {'mongo ms':>9} {'cache ms':>9} {'append ms':>10} {'speedup':>8}   body")
+        for kind in ("columnar", "binary", "multi"):
+            for days in (int(x) for x in args.ranges.split(",")):
+                u = url(kind, days)
+                appmod.TS_CACHE_ENABLED = False
+                mongo = timed(lambda: get(u), args.repeat)
+                appmod.TS_CACHE_ENABLED = True
+                cached = timed(lambda: get(u), args.repeat)
+                append = timed(lambda: write_then_get(u), args.repeat)
+                print(f"{kind:9} {days:5d} {mongo:9.1f} {cached:9.1f} {append:10.1f} {mongo / cached:7.1f}×"
+                      f"   {get(u) / 1024:.0f} KiB")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# load_test.py — 1103test/app.py 的可重現負載測試（匯入吞吐量 + 併發讀取延遲）
+#
+#   python bench/load_test.py                                   # mongomock，不需要資料庫
+#   python bench/load_test.py --backend mongod --uri mongodb://127.0.0.1:27017/vitals_loadtest
+#   python bench/load_test.py --patients 200 --days 14 --clients 16 --requests 4000
+#
+# 流程（同一個 --seed 每次產生一樣的資料與請求順序）：
+#   1. synth.gen_docs 產生 N 位病人 × T 天的 vitals
+#   2. 前一半病人經由 POST /upload（CSV）匯入，後一半經由 import_csv.upsert_df 匯入，各算 rows/sec
+#   3. 以 upsert_df(skip_unchanged=True) 重匯一次後半，量「內容沒變」的重匯速度
+#   4. --clients 個執行緒各自用 Flask test client 打 /api/vitals、/、/chart、/demo(find)，
+#      回報各路由與整體的 p50 / p95 / p99 與 req/s
+# 請求在行程內經 WSGI 呼叫（不經網路），量到的是 app + 資料庫的時間。
+# mongod 模式會先 drop 指定的資料庫，請用專門的測試資料庫。
+# mongomock 不是 thread-safe（find 時會暫時改動傳入的 projection dict），
+# 所以 mongomock 模式下請求會以一把鎖序列化；併發數字請以 mongod 模式為準。
+import argparse
+import io
+import os
+import random
+import sys
+import threading
+import time
+from datetime import timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from synth import gen_docs  # noqa: E402
+
+ROUTES = ("api_vitals", "home", "chart", "demo_find")
+WEIGHTS = (6, 2, 1, 1)
+_serial = None  # mongomock 模式下序列化請求的鎖
+
+
+def setup_backend(args):
+    """在 import app / import_csv 之前設定好 MONGO_URI（與 mongomock 的共用 client）。"""
+    os.environ["MONGO_URI"] = args.uri
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    if args.backend == "mongomock":
+        global _serial
+        _serial = threading.Lock()
+        import mongomock
+        import pymongo
+
+        shared = mongomock.MongoClient(args.uri)
+        # app 與 import_csv 各自 new MongoClient；mongomock 的 client 彼此不共用資料，改成同一個
+        pymongo.MongoClient = lambda *a, **kw: shared
+    else:
+        from pymongo import MongoClient
+        c = MongoClient(args.uri)
+        c.drop_database(c.get_default_database().name)
+
+
+def pct(xs, p):
+    if not xs:
+        return float("nan")
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def to_csv(docs):
+    buf = io.StringIO()
+    buf.write("patient_id,timestamp,hr,bp_sys,bp_dia,spo2,temp\n")
+    for d in docs:
+        vals = ["" if d[k] is None else d[k] for k in ("hr", "bp_sys", "bp_dia", "spo2", "temp")]
+        buf.write(f"{d['patient_id']},{d['ts'].isoformat()}," + ",".join(map(str, vals)) + "\n")
+    return buf.getvalue().encode()
+
+
+def import_phase(app_mod, import_csv, docs, upload_rows):
+    import pandas as pd
+
+    pids = sorted({d["patient_id"] for d in docs})
+    first = set(pids[:len(pids) // 2])
+    a = [d for d in docs if d["patient_id"] in first]
+    b = [d for d in docs if d["patient_id"] not in first]
+
+    client = app_mod.app.test_client()
+    t0 = time.perf_counter()
+    for i in range(0, len(a), upload_rows):
+        body = to_csv(a[i:i + upload_rows])
+        r = client.post("/upload", data={"file": (io.BytesIO(body), "load.csv")},
+                        content_type="multipart/form-data")
+        assert r.status_code == 302, r.status_code
+    t_upload = time.perf_counter() - t0
+
+    df = pd.DataFrame(b)
+    t0 = time.perf_counter()
+    import_csv.upsert_df(df.copy())
+    t_upsert = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    res = import_csv.upsert_df(df.copy(), skip_unchanged=True)
+    t_reimport = time.perf_counter() - t0
+    assert res["written"] == 0, res
+
+    print(f"{'import':24} {'rows':>9} {'sec':>8} {'rows/s':>10}")
+    for name, n, t in (("upload() CSV", len(a), t_upload),
+                       ("upsert_df", len(b), t_upsert),
+                       ("upsert_df unchanged", len(b), t_reimport)):
+        print(f"{name:24} {n:9d} {t:8.2f} {n / t:10.0f}")
+    return pids
+
+
+def make_requests(pids, start, days, n, seed):
+    """預先產生請求序列（路由, 參數），同一個 seed 結果相同。"""
+    rnd = random.Random(seed)
+    reqs = []
+    for _ in range(n):
+        route = rnd.choices(ROUTES, WEIGHTS)[0]
+        pid = rnd.choice(pids)
+        day = start + timedelta(days=rnd.randrange(days))
+        reqs.append((route, pid, day))
+    return reqs
+
+
+def call(client, route, pid, day):
+    if route == "api_vitals":
+        end = day + timedelta(days=1)
+        return client.get(f"/api/vitals/{pid}?start={day.isoformat()}&end={end.isoformat()}")
+    if route == "home":
+        return client.get("/")
+    if route == "chart":
+        return client.get(f"/chart/{pid}")
+    local = day.strftime("%Y-%m-%dT%H:%M")
+    return client.post("/demo", data={"action": "find", "q_patient_id": pid, "q_start": local})
+
+
+def load_phase(app_mod, reqs, clients):
+    lat = {r: [] for r in ROUTES}
+    errors = []
+    lock = threading.Lock()
+    it = iter(reqs)
+
+    def worker():
+        c = app_mod.app.test_client()
+        mine = {r: [] for r in ROUTES}
+        while True:
+            with lock:
+                job = next(it, None)
+            if job is None:
+                break
+            t0 = time.perf_counter()
+            if _serial is not None:
+                with _serial:
+                    r = call(c, *job)
+            else:
+                r = call(c, *job)
+            mine[job[0]].append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors.append((job[0], r.status_code))
+        with lock:
+            for k, v in mine.items():
+                lat[k] += v
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    print(f"\n{'route':12} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    allx = []
+    for k in ROUTES:
+        xs = lat[k]
+        allx += xs
+        print(f"{k:12} {len(xs):6d} {pct(xs, 50) * 1e3:8.1f} {pct(xs, 95) * 1e3:8.1f} {pct(xs, 99) * 1e3:8.1f}")
+    print(f"{'all':12} {len(allx):6d} {pct(allx, 50) * 1e3:8.1f} {pct(allx, 95) * 1e3:8.1f} {pct(allx, 99) * 1e3:8.1f}")
+    print(f"\n{len(allx) / wall:.0f} req/s with {clients} clients, {len(errors)} errors")
+    if errors:
+        print("first errors:", errors[:5])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", choices=["mongomock", "mongod"], default="mongomock")
+    ap.add_argument("--uri", default=os.getenv("MONGO_BENCH_URI", "mongodb://127.0.0.1:27017/vitals_loadtest"))
+    ap.add_argument("--patients", type=int, default=50)
+    ap.add_argument("--days", type=int, default=3)
+    ap.add_argument("--interval", type=int, default=10, help="每幾分鐘一筆")
+    ap.add_argument("--upload-rows", type=int, default=5000, help="每次 POST /upload 的列數")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    setup_backend(args)
+    import app as app_mod
+    import import_csv
+
+    docs = list(gen_docs(args.patients, args.days, args.interval, seed=args.seed))
+    print(f"backend={args.backend} patients={args.patients} days={args.days} rows={len(docs)}\n")
+    pids = import_phase(app_mod, import_csv, docs, args.upload_rows)
+    start = min(d["ts"] for d in docs)
+    load_phase(app_mod, make_requests(pids, start, args.days, args.requests, args.seed), args.clients)
+
+
+if __name__ == "__main__":
+    main()
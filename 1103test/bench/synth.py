@@ -0,0 +1,49 @@
+# synth.py — 產生合成 vitals 資料（benchmark 用）
+import random
+from datetime import datetime, timedelta, timezone
+
+
+def gen_docs(n_patients=100, days=7, interval_min=10, seed=42, start=None):
+    """
+    產生 n_patients 位病人、days 天、每 interval_min 分鐘一筆的 vitals 文件（ts 為 UTC）。
+    數值在正常範圍附近隨機漫步，偶爾缺值（None），模擬真實設備。
+    """
+    rnd = random.Random(seed)
+    start = start or datetime(2025, 1, 1, tzinfo=timezone.utc)
+    steps = days * 24 * 60 // interval_min
+    step = timedelta(minutes=interval_min)
+    for p in range(n_patients):
+        pid = f"P{p:05d}"
+        hr, sys_, dia, spo2, temp = 75.0, 120.0, 80.0, 97.0, 36.7
+        for i in range(steps):
+            hr = min(max(hr + rnd.gauss(0, 2), 40), 160)
+            sys_ = min(max(sys_ + rnd.gauss(0, 2), 80), 190)
+            dia = min(max(dia + rnd.gauss(0, 1.5), 45), 120)
+            spo2 = min(max(spo2 + rnd.gauss(0, 0.3), 85), 100)
+            temp = min(max(temp + rnd.gauss(0, 0.05), 35), 40)
+            yield {
+                "patient_id": pid,
+                "ts": start + i * step,
+                "hr": None if rnd.random() < 0.01 else round(hr, 1),
+                "bp_sys": round(sys_, 1),
+                "bp_dia": round(dia, 1),
+                "spo2": round(spo2, 1),
+                "temp": round(temp, 2),
+            }
+
+
+def seed_collection(coll, n_patients, days, interval_min=10, batch=10_000):
+    """把合成資料 insert_many 進集合（已有相同筆數就跳過），回傳總筆數。"""
+    want = n_patients * (days * 24 * 60 // interval_min)
+    if coll.estimated_document_count() == want:
+        return want
+    coll.drop()
+    buf = []
+    for d in gen_docs(n_patients, days, interval_min):
+        buf.append(d)
+        if len(buf) >= batch:
+            coll.insert_many(buf, ordered=False)
+            buf = []
+    if buf:
+        coll.insert_many(buf, ordered=False)
+    return want
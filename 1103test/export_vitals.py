@@ -0,0 +1,191 @@
+# export_vitals.py — 把 vitals 依時間範圍 / 病人清單匯出成 Parquet 或 Arrow IPC（給分析用）
+#
+# CLI：
+#   python export_vitals.py --out vitals.parquet --patients A001,B015 --start 2025-10-01 --end 2025-11-01
+#   python export_vitals.py --out vitals.arrow --format arrow
+#   python export_vitals.py --out vitals.parquet --tz Asia/Taipei   # ts 欄存成台北時間
+# 讀回：pd.read_parquet("vitals.parquet") / pyarrow.ipc.open_stream(...).read_pandas()
+#
+# 需要 pyarrow（pandas 的 Parquet 引擎）。
+import argparse
+import os
+
+import pandas as pd
+
+from local_time import parse_query_time
+from vitals_store import VITAL_FIELDS
+
+BATCH_ROWS = 100_000  # 每個 row group / record batch 的筆數
+
+
+def build_query(patient_ids=None, start=None, end=None):
+    q = {}
+    if patient_ids:
+        q["patient_id"] = {"$in": list(patient_ids)}
+    if start or end:
+        q["ts"] = {}
+        if start: q["ts"]["$gte"] = start
+        if end: q["ts"]["$lt"] = end
+    return q
+
+
+def iter_frames(db, patient_ids=None, start=None, end=None, batch_rows=BATCH_ROWS, tz="UTC"):
+    """
+    依 (patient_id, ts) 索引順序讀 vitals，每 batch_rows 筆組成一個 DataFrame：
+      patient_id: str, ts: datetime64[ms, tz], 各 vital: float64（缺值為 NaN）
+    直接累積成欄位串列，不另外建每列的 dict；時區轉換整欄一次做。
+    """
+    proj = {"_id": 0, "patient_id": 1, "ts": 1, **{k: 1 for k in VITAL_FIELDS}}
+    cur = (db.vitals.find(build_query(patient_ids, start, end), proj)
+           .sort([("patient_id", 1), ("ts", 1)])
+           .batch_size(10_000))
+
+    names = ("patient_id", "ts") + VITAL_FIELDS
+    cols = {k: [] for k in names}
+    n = 0
+    for d in cur:
+        for k in names:
+            cols[k].append(d.get(k))
+        n += 1
+        if n >= batch_rows:
+            yield _to_frame(cols, tz)
+            cols = {k: [] for k in names}
+            n = 0
+    if n:
+        yield _to_frame(cols, tz)
+
+
+def _to_frame(cols, tz="UTC"):
+    # Mongo 取回的 datetime 為 naive UTC
+    ts = pd.to_datetime(cols["ts"], utc=True)
+    if tz != "UTC":
+        ts = ts.tz_convert(tz)
+    df = pd.DataFrame({
+        "patient_id": pd.Series(cols["patient_id"], dtype="string"),
+        "ts": ts.astype(f"datetime64[ms, {tz}]"),
+    })
+    for k in VITAL_FIELDS:
+        df[k] = pd.Series(cols[k], dtype="float64")
+    return df
+
+
+def _schema(tz="UTC"):
+    import pyarrow as pa
+    return pa.schema(
+        [("patient_id", pa.string()), ("ts", pa.timestamp("ms", tz=tz))]
+        + [(k, pa.float64()) for k in VITAL_FIELDS]
+    )
+
+
+def write_parquet(sink, frames, compression="zstd", tz="UTC"):
+    """每個 DataFrame 寫成一個 row group；sink 可以是路徑或可寫的 file-like。回傳總筆數。"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(tz)
+    total = 0
+    with pq.ParquetWriter(sink, schema, compression=compression) as w:
+        for df in frames:
+            w.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            total += len(df)
+    return total
+
+
+def write_arrow(sink, frames, tz="UTC"):
+    """Arrow IPC stream 格式（可邊寫邊讀）。回傳總筆數。"""
+    import pyarrow as pa
+
+    schema = _schema(tz)
+    total = 0
+    with pa.ipc.new_stream(sink, schema) as w:
+        for df in frames:
+            w.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            total += len(df)
+    return total
+
+
+class _ChunkSink:
+    """給 HTTP 串流用的 file-like：寫入的 bytes 先暫存，由 drain() 取走。"""
+
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+        self.closed = False
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        out = b"".join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def stream_export(db, fmt="arrow", tz="UTC", **kw):
+    """
+    產生器：每寫完一個 batch 就把新產生的 bytes 吐出去，記憶體只放一個 batch。
+    fmt = "arrow"（IPC stream）或 "parquet"；tz 為 ts 欄的時區。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(tz)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for df in iter_frames(db, tz=tz, **kw):
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # Parquet footer / IPC 結束標記
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="匯出 vitals 為 Parquet / Arrow")
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--format", choices=["parquet", "arrow"], default=None,
+                    help="預設依副檔名判斷（.arrow / .arrows → arrow）")
+    ap.add_argument("--patients", help="逗號分隔的 patient_id，不給則全部")
+    ap.add_argument("--start", help="ISO 時間或 epoch 毫秒，無時區視為台北時間")
+    ap.add_argument("--end")
+    ap.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    ap.add_argument("--tz", default="UTC", help="ts 欄的時區，例如 Asia/Taipei（預設 UTC）")
+    args = ap.parse_args()
+
+    uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db")
+    db = MongoClient(uri).get_default_database()
+    fmt = args.format or ("arrow" if args.out.endswith((".arrow", ".arrows")) else "parquet")
+    pids = [p.strip() for p in args.patients.split(",") if p.strip()] if args.patients else None
+
+    # 與 /api/vitals 相同的時間解析（ISO 或 epoch 毫秒，無時區視為台北時間）；格式不符時報錯，不要默默匯出全部
+    start, end = parse_query_time(args.start), parse_query_time(args.end)
+    for flag, raw, dt in (("--start", args.start, start), ("--end", args.end, end)):
+        if raw and dt is None:
+            ap.error(f"{flag} 時間格式不符：{raw}")
+
+    frames = iter_frames(db, pids, start, end, args.batch_rows, args.tz)
+    n = write_arrow(args.out, frames, args.tz) if fmt == "arrow" else write_parquet(args.out, frames, tz=args.tz)
+    print(f"exported {n} rows -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-import os, glob
+import os, sys, glob
 import pandas as pd
-from pymongo import MongoClient, UpdateOne
-from pymongo.errors import BulkWriteError
+from pymongo import MongoClient
 from dotenv import load_dotenv
+from vitals_store import bulk_upsert, written_docs, record_write, rebuild_latest
 
 load_dotenv()
 
@@ -19,7 +19,13 @@ def _num(x):
     except Exception:
         return None
 
-def upsert_df(df: pd.DataFrame):
+def upsert_df(df: pd.DataFrame, on_written=None, skip_unchanged=False):
+    """
+    on_written(docs)：寫入成功後的回呼（例如 app 的即時推播）。
+    以 CLI 執行時是獨立行程，app 端要靠 VITALS_CHANGE_STREAM=1 才收得到。
+    skip_unchanged=True：與資料庫內容相同的列不重寫（比對內容雜湊）。
+    回傳 {"written", "unchanged", "failed"} 筆數。
+    """
     # 統一時間欄位名稱
     if "timestamp" in df.columns:
         ts_series = pd.to_datetime(df["timestamp"])
@@ -28,7 +34,7 @@ def upsert_df(df: pd.DataFrame):
     else:
         raise ValueError("CSV 需包含 timestamp 或 ts 欄位")
 
-    ops = []
+    docs = []
     for i, r in df.iterrows():
         ts = ts_series.iloc[i].to_pydatetime()
         pid = str(r.get("patient_id"))
@@ -41,23 +47,33 @@ def upsert_df(df: pd.DataFrame):
             "spo2": _num(r.get("spo2")),
             "temp": _num(r.get("temp")),
         }
-        ops.append(
-            UpdateOne({"patient_id": pid, "ts": ts}, {"$set": doc}, upsert=True)
-        )
+        docs.append(doc)
 
-    if ops:
-        try:
-            db.vitals.bulk_write(ops, ordered=False)
-        except BulkWriteError as e:
-            # 便於除錯：印出第一個錯誤
-            print("BulkWriteError:", e.details.get("writeErrors", [])[0])
+    res = bulk_upsert(db.vitals, docs, skip_unchanged=skip_unchanged)
+    if res["errors"]:
+        # 便於除錯：印出第一個錯誤
+        print("BulkWriteError:", next(iter(res["errors"].values())))
+    written = written_docs(docs, res)
+    if written:
+        # 更新 vitals_meta（讓 /api/vitals 的 ETag 失效）與 latest_vitals 快照
+        record_write(db, written)
+        if on_written:
+            on_written(written)
+    return {"written": len(written), "unchanged": len(res["unchanged"]), "failed": len(res["errors"])}
 
 if __name__ == "__main__":
     # 建議先建立索引（只需執行一次）
     db.vitals.create_index([("patient_id", 1), ("ts", 1)], unique=True)
     db.vitals.create_index([("ts", -1)])
 
+    # --changed-only：重跑同一份每日匯出時，只寫入新增或有變動的列
+    changed_only = "--changed-only" in sys.argv
     for path in glob.glob("data/*.csv"):
         df = pd.read_csv(path)
-        upsert_df(df)
-        print("imported:", path)
+        stats = upsert_df(df, skip_unchanged=changed_only)
+        print("imported:", path, stats)
+
+    if "--rebuild-latest" in sys.argv:
+        # 第一次啟用病房總覽時，從既有 vitals 補建 latest_vitals
+        rebuild_latest(db)
+        print("latest_vitals rebuilt")
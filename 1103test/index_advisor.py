@@ -0,0 +1,135 @@
+# index_advisor.py — /demo 查詢的 explain 摘要與索引建議
+#
+# 「查詢形狀」只看欄位與條件種類、不看值，例如：
+#   {"patient_id": "A001", "ts": {...}, "hr": {"$gte": 100}}  →  patient_id:eq,ts:range,hr:range+
+# range+ 表示有 >= 0 的下限，可以使用「欄位 >= 0」的部分索引（也順便排除 null）。
+from pymongo import ASCENDING
+
+SORT_FIELD = "ts"  # /demo 的查詢都依 ts 排序
+LOWER_OPS = ("$gt", "$gte")
+
+
+def _kind(cond):
+    if not isinstance(cond, dict):
+        return "eq"
+    lo = [cond[op] for op in LOWER_OPS if op in cond]
+    if lo and all(isinstance(v, (int, float)) and v >= 0 for v in lo):
+        return "range+"
+    return "range"
+
+
+def query_shape(q):
+    """回傳 [(欄位, 種類)]，依欄位名稱排序，讓相同形狀得到相同 key。"""
+    return sorted((f, _kind(c)) for f, c in q.items())
+
+
+def shape_key(shape):
+    return ",".join(f"{f}:{k}" for f, k in shape) or "(empty)"
+
+
+def record_shape(db, q):
+    """每次 /demo 查詢都記一筆，累計出現次數。"""
+    shape = query_shape(q)
+    db.query_shapes.update_one(
+        {"_id": shape_key(shape)},
+        {"$inc": {"count": 1}, "$set": {"fields": [list(p) for p in shape]},
+         "$currentDate": {"last_seen": True}},
+        upsert=True,
+    )
+
+
+def suggest_index(shape):
+    """
+    ESR 原則：等值欄位 → 排序欄位(ts) → 範圍欄位。
+    所有數值範圍欄位都帶 >= 0 下限時，加上部分索引條件讓索引只收有值的文件。
+    回傳 (keys, options) 或 None（空條件不需要索引）。
+    """
+    if not shape:
+        return None
+    eq = [f for f, k in shape if k == "eq"]
+    rng = [f for f, k in shape if k != "eq" and f != SORT_FIELD]
+    keys = [(f, ASCENDING) for f in eq] + [(SORT_FIELD, ASCENDING)] + [(f, ASCENDING) for f in rng]
+    opts = {"name": "adv_" + "_".join(f for f, _ in keys)}
+    partial = {f: {"$gte": 0} for f, k in shape if k == "range+" and f != SORT_FIELD}
+    if partial and len(partial) == len(rng):
+        opts["partialFilterExpression"] = partial
+        opts["name"] += "_partial"
+    return keys, opts
+
+
+def _index_covers(existing, keys):
+    """已有索引的 key 前綴與建議相同就視為已覆蓋。"""
+    want = [f for f, _ in keys]
+    for info in existing.values():
+        have = [f for f, _ in info["key"]]
+        if have[:len(want)] == want:
+            return info
+    return None
+
+
+def advise(db, limit=10):
+    """列出最常見的查詢形狀與建議索引（已存在則標示）。"""
+    existing = db.vitals.index_information()
+    out = []
+    for s in db.query_shapes.find().sort("count", -1).limit(limit):
+        shape = [tuple(p) for p in s.get("fields", [])]
+        sug = suggest_index(shape)
+        if not sug:
+            continue
+        keys, opts = sug
+        out.append({
+            "shape": s["_id"],
+            "count": s.get("count", 0),
+            "index_keys": keys,
+            "options": opts,
+            "exists": _index_covers(existing, keys) is not None,
+        })
+    return out
+
+
+def create_suggested(db, key):
+    """依 query_shapes 內記錄的形狀建立建議索引（只接受曾出現過的形狀）。"""
+    s = db.query_shapes.find_one({"_id": key})
+    if not s:
+        return None
+    sug = suggest_index([tuple(p) for p in s.get("fields", [])])
+    if not sug:
+        return None
+    keys, opts = sug
+    return db.vitals.create_index(keys, **opts)
+
+
+def _index_names(plan):
+    """遞迴找出計畫中所有 IXSCAN 使用的索引名稱。"""
+    names = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "IXSCAN" and plan.get("indexName"):
+            names.append(plan["indexName"])
+        for v in plan.values():
+            names += _index_names(v)
+    elif isinstance(plan, list):
+        for v in plan:
+            names += _index_names(v)
+    return names
+
+
+def explain_find(db, q, sort=SORT_FIELD, limit=200):
+    """
+    以 executionStats 模式 explain /demo 的 find，
+    回傳 docsExamined / keysExamined / nReturned / 耗時 / 使用的索引。
+    """
+    res = db.command(
+        "explain",
+        {"find": "vitals", "filter": q, "sort": {sort: 1}, "limit": limit},
+        verbosity="executionStats",
+    )
+    stats = res.get("executionStats", {})
+    winning = res.get("queryPlanner", {}).get("winningPlan", {})
+    names = _index_names(winning)
+    return {
+        "nReturned": stats.get("nReturned"),
+        "docsExamined": stats.get("totalDocsExamined"),
+        "keysExamined": stats.get("totalKeysExamined"),
+        "millis": stats.get("executionTimeMillis"),
+        "index": ", ".join(dict.fromkeys(names)) or "COLLSCAN",
+    }
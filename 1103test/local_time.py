@@ -0,0 +1,81 @@
+# local_time.py — 整欄時間一次轉成本地時間（列表、JSON API、匯出共用）
+#
+# Mongo 取回的 ts 是 naive UTC。逐筆 astimezone + strftime 在幾千筆時很慢，
+# 這裡整欄交給 pandas（C 實作的 datetime 轉換與時區表）轉成本地牆上時間的 datetime64，
+# 再用 np.datetime_as_string 一次格式化。
+# pandas / numpy 只在第一次呼叫時才 import（見 app.py 的 STARTUP_MODE）。
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TZ = "Asia/Taipei"
+TAIPEI = ZoneInfo(DEFAULT_TZ)
+
+
+def get_tz(name):
+    """檢查時區名稱，回傳原字串；不認得時丟 ValueError（給路由回 400）。"""
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"未知的時區：{name}") from e
+    return name
+
+
+def parse_query_time(s):
+    """查詢參數時間：ISO 字串（無時區視為台北）或 epoch 毫秒 → UTC datetime；格式不符回傳 None"""
+    if not s:
+        return None
+    try:
+        if s.isdigit():
+            return datetime.fromtimestamp(int(s) / 1000, tz=timezone.utc)
+        dt = datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=TAIPEI)
+        return dt.astimezone(timezone.utc)
+    except Exception:
+        return None
+
+
+def localize(ts_list, tz=DEFAULT_TZ):
+    """
+    datetime 串列（naive 視為 UTC，帶時區的照實轉換，None → NaT）→ 回傳 (local, offsets_ms)：
+      local：本地牆上時間的 datetime64[ms] 陣列
+      offsets_ms：每筆的 UTC 偏移毫秒（缺值為 0）
+    """
+    import numpy as np
+    import pandas as pd
+
+    utc = pd.to_datetime(pd.Index(ts_list, dtype=object), utc=True)
+    local = utc.tz_convert(tz).tz_localize(None).values.astype("datetime64[ms]")
+    utc_naive = utc.tz_localize(None).values.astype("datetime64[ms]")
+    off = (local - utc_naive).astype(np.int64)
+    off[np.isnat(local)] = 0
+    return local, off
+
+
+def local_pairs(ts_list, tz=DEFAULT_TZ):
+    """
+    to_local_pair 的批次版，回傳兩個字串串列：
+      'YYYY/MM/DD HH:MM'（表格顯示）、'YYYY-MM-DDTHH:MM'（<input type="datetime-local">）
+    缺值為空字串。
+    """
+    if len(ts_list) == 0:
+        return [], []
+    import numpy as np
+
+    local, _ = localize(ts_list, tz)
+    iso = np.datetime_as_string(local, unit="m").tolist()
+    iso = ["" if s == "NaT" else s for s in iso]
+    return [s.replace("-", "/").replace("T", " ") for s in iso], iso
+
+
+def iso_with_offset(ts_list, tz=DEFAULT_TZ):
+    """ISO 8601 本地時間含偏移，例如 '2025-01-01T08:00:00.000+08:00'（缺值為 None）。"""
+    if len(ts_list) == 0:
+        return []
+    import numpy as np
+
+    local, off = localize(ts_list, tz)
+    base = np.datetime_as_string(local, unit="ms").tolist()
+    mins = (off // 60_000).tolist()
+    return [None if b == "NaT" else f"{b}{'-' if m < 0 else '+'}{abs(m) // 60:02d}:{abs(m) % 60:02d}"
+            for b, m in zip(base, mins)]
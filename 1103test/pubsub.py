@@ -0,0 +1,92 @@
+# pubsub.py — 行程內的 vitals 發布/訂閱（給 SSE 即時圖表用）
+# VitalsBus / start_change_stream 給 app.py（執行緒），AsyncVitalsBus / watch_changes 給 async_app.py（asyncio）。
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class VitalsBus:
+    """
+    每個 patient_id 一組訂閱者，每個訂閱者一個 Queue。
+    publish 不阻塞：訂閱者太慢、Queue 滿了就丟掉該筆（圖表下次重整會補齊）。
+    """
+    queue_class, full_error = queue.Queue, queue.Full
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._subs = {}  # patient_id -> set(Queue)
+        self._lock = threading.Lock()
+
+    def subscribe(self, patient_id):
+        q = self.queue_class(maxsize=self.maxsize)
+        with self._lock:
+            self._subs.setdefault(patient_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, patient_id, q):
+        with self._lock:
+            subs = self._subs.get(patient_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[patient_id]
+
+    def publish(self, docs):
+        for d in docs:
+            with self._lock:
+                targets = list(self._subs.get(d.get("patient_id"), ()))
+            for q in targets:
+                try:
+                    q.put_nowait(d)
+                except self.full_error:
+                    pass
+
+
+class AsyncVitalsBus(VitalsBus):
+    """asyncio 版：訂閱者是 asyncio.Queue，只能在事件迴圈的執行緒內 publish / subscribe。"""
+    queue_class, full_error = asyncio.Queue, asyncio.QueueFull
+
+
+CHANGE_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+
+
+def start_change_stream(coll, bus, retry_sec=5):
+    """
+    可選的資料來源：監聽 Mongo change stream（需 replica set），
+    把任何行程（包含 import_csv.py）寫入的 vitals 都轉發到 bus。
+    """
+    def run():
+        while True:
+            try:
+                with coll.watch(CHANGE_PIPELINE, full_document="updateLookup") as stream:
+                    for change in stream:
+                        doc = change.get("fullDocument")
+                        if doc:
+                            bus.publish([doc])
+            except Exception:
+                log.warning("change stream 中斷，%s 秒後重試", retry_sec, exc_info=True)
+                time.sleep(retry_sec)
+
+    t = threading.Thread(target=run, name="vitals-change-stream", daemon=True)
+    t.start()
+    return t
+
+
+async def watch_changes(coll, bus, retry_sec=5):
+    """start_change_stream 的 asyncio 版（coll 為 Motor 集合）：整個行程共用一條 change stream。"""
+    while True:
+        try:
+            async with coll.watch(CHANGE_PIPELINE, full_document="updateLookup") as stream:
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc:
+                        bus.publish([doc])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.warning("change stream 中斷，%s 秒後重試", retry_sec, exc_info=True)
+            await asyncio.sleep(retry_sec)
@@ -0,0 +1,172 @@
+# retention.py — vitals 保留政策：熱資料留在 vitals，較舊的搬到壓縮的月份桶（vitals_archive）
+#
+#   python retention.py [--hot-days 90] [--dry-run]
+#
+# 桶文件：{_id: "A001|2025-06", patient_id, month, n, ts_min, ts_max,
+#          data: zlib(BSON({"ts": [...], "hr": [...], ...}))}
+# 流程：依 (patient_id, ts) 順序讀出 cutoff 之前的資料 → 每個病人每個月合併寫成一個桶
+#      → 桶寫入成功後才分批刪除原始文件。中途中斷重跑也安全（依 ts 去重合併）。
+# vitals_meta 的 archived_before 在開始搬之前就推進，讀取端（/api/vitals）依它決定要不要讀歸檔。
+import argparse
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import bson
+from bson.binary import Binary
+
+HOT_DAYS = int(os.getenv("VITALS_HOT_DAYS", "90"))
+DELETE_BATCH = 5000
+META_ID = "__retention__"  # vitals_meta 中記錄「此時間之前的資料已歸檔」
+SKIP_KEYS = ("_id", "patient_id", "h")
+
+
+def _month_start(ts):
+    return datetime(ts.year, ts.month, 1)
+
+
+def _naive_utc(dt):
+    """查詢參數可能帶時區；桶內與 Mongo 取回的都是 naive UTC。"""
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _encode(rows):
+    keys = sorted({k for r in rows for k in r if k not in SKIP_KEYS})
+    cols = {k: [r.get(k) for r in rows] for k in keys}
+    return Binary(zlib.compress(bson.encode(cols), 6))
+
+
+def _decode(bucket):
+    cols = bson.decode(zlib.decompress(bucket["data"]))
+    n = len(cols.get("ts", []))
+    pid = bucket["patient_id"]
+    return [{"patient_id": pid, **{k: v[i] for k, v in cols.items()}} for i in range(n)]
+
+
+def _write_bucket(db, pid, month, rows):
+    """與既有的同月桶合併（新資料覆蓋同 ts），整桶 replace。"""
+    _id = f"{pid}|{month:%Y-%m}"
+    old = db.vitals_archive.find_one({"_id": _id})
+    merged = {r["ts"]: r for r in (_decode(old) if old else [])}
+    for r in rows:
+        merged[r["ts"]] = r
+    rows = [merged[t] for t in sorted(merged)]
+    db.vitals_archive.replace_one({"_id": _id}, {
+        "patient_id": pid,
+        "month": month,
+        "n": len(rows),
+        "ts_min": rows[0]["ts"],
+        "ts_max": rows[-1]["ts"],
+        "data": _encode(rows),
+    }, upsert=True)
+
+
+def _delete(db, ids):
+    for i in range(0, len(ids), DELETE_BATCH):
+        db.vitals.delete_many({"_id": {"$in": ids[i:i + DELETE_BATCH]}})
+
+
+def archive_old(db, hot_days=HOT_DAYS, dry_run=False):
+    """把 now - hot_days 之前的 vitals 歸檔並刪除，回傳 (桶數, 筆數)。"""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=hot_days)
+    if not dry_run:
+        # 先推進邊界再刪任何一筆：執行中或中途中斷時，讀取端也已經會去讀 vitals_archive
+        # （尚未搬走的部分仍在 vitals，merge_with_hot 依 ts 去重）
+        db.vitals_meta.update_one({"_id": META_ID}, {"$max": {"archived_before": cutoff}}, upsert=True)
+    cur = db.vitals.find({"ts": {"$lt": cutoff}}).sort([("patient_id", 1), ("ts", 1)])
+
+    buckets = moved = 0
+    key, rows = None, []
+
+    def flush():
+        nonlocal buckets, moved
+        if not rows:
+            return
+        if not dry_run:
+            _write_bucket(db, key[0], key[1], rows)
+            _delete(db, [r["_id"] for r in rows])
+        buckets += 1
+        moved += len(rows)
+
+    for d in cur:
+        k = (d["patient_id"], _month_start(d["ts"]))
+        if k != key:
+            flush()
+            key, rows = k, []
+        rows.append(d)
+    flush()
+
+    if not dry_run:
+        db.vitals_archive.create_index([("patient_id", 1), ("month", 1)])
+    return buckets, moved
+
+
+def archived_before(db):
+    m = db.vitals_meta.find_one({"_id": META_ID})
+    return m.get("archived_before") if m else None
+
+
+def needs_archive(boundary, start):
+    """查詢下限早於歸檔邊界（或沒有下限）時才需要讀 vitals_archive。"""
+    return bool(boundary) and (start is None or _naive_utc(start) < boundary)
+
+
+def archive_query(patient_id, start=None, end=None):
+    """涵蓋 [start, end) 的月份桶查詢條件（依 month 排序讀取）。"""
+    start, end = _naive_utc(start), _naive_utc(end)
+    q = {"patient_id": patient_id}
+    if start:
+        q["month"] = {"$gte": _month_start(start)}
+    if end:
+        q.setdefault("month", {})["$lt"] = end
+    return q
+
+
+def rows_from_buckets(buckets, start=None, end=None):
+    """解開依 month 排序的桶，只留 [start, end) 內的資料。"""
+    start, end = _naive_utc(start), _naive_utc(end)
+    out = []
+    for b in buckets:
+        for r in _decode(b):
+            if (start is None or r["ts"] >= start) and (end is None or r["ts"] < end):
+                out.append(r)
+    return out
+
+
+def read_archive(db, patient_id, start=None, end=None):
+    """讀出 [start, end) 內的歸檔資料（依 ts 排序），格式同 vitals 的 find 結果。"""
+    buckets = db.vitals_archive.find(archive_query(patient_id, start, end)).sort("month", 1)
+    return rows_from_buckets(buckets, start, end)
+
+
+def merge_with_hot(old, rows, since=None):
+    """歸檔資料接在熱資料前面；同 ts 以熱資料為準，since 之前的略過。"""
+    if since:
+        since = _naive_utc(since)
+        old = [r for r in old if r["ts"] > since]
+    if not old:
+        return rows
+    hot_ts = {r["ts"] for r in rows}
+    return [r for r in old if r["ts"] not in hot_ts] + rows
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="把舊的 vitals 歸檔到 vitals_archive")
+    ap.add_argument("--hot-days", type=int, default=HOT_DAYS)
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db")
+    db = MongoClient(uri).get_default_database()
+    buckets, moved = archive_old(db, args.hot_days, args.dry_run)
+    print(f"{'(dry run) ' if args.dry_run else ''}archived {moved} rows into {buckets} buckets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# ts_cache.py — 圖表讀取用的本機時間序列快取（每位病人一個 memory-mapped 二進位檔）
+#
+# 長範圍的 /api/vitals/<id>?format=columnar|binary 與 /api/vitals/multi 每次都回 Mongo 撈整段、
+# 解 BSON；開啟後改讀本機檔案：
+#   <TS_CACHE_DIR>/<patient_id>.vts
+#   0    4 bytes  b"VTS1"
+#   4    uint32   欄位數（= len(VITAL_FIELDS)，版面不符就重建）
+#   8    uint64   n：已寫完的筆數（讀取端只看前 n 筆）
+#   16   uint64   writes：同步時 vitals_meta 的病人寫入數
+#   24   uint64   all：同步時 vitals_meta 的全域世代號
+#   32   n 筆固定寬度紀錄：int64 ts（epoch ms，遞增）+ float32 × 欄位（缺值 NaN），共 28 bytes
+#
+# 讀取：np.memmap 映射前 n 筆，np.searchsorted 找出時間範圍，回傳的是映射上的切片（不複製）。
+# 同步：請求已經查了 vitals_meta 的版本（ETag），檔頭不比它舊就直接讀；
+#   - vitals_meta 還沒有這位病人（舊資料）→ 先以現有筆數補上 meta（vitals_store.backfill_meta）；
+#   - 全域世代號變了（/demo 的 update_many）→ 整個重建；
+#   - 否則只向 Mongo 要 ts > 最後一筆的新資料附加在檔尾，
+#     新資料筆數對不上寫入數的差（代表有舊時間點被改寫）→ 整個重建。
+# 附加只寫在 n 之後，最後才更新檔頭，所以沒上鎖的讀者最多看到舊的 n；
+# 重建寫到暫存檔再 os.replace，已映射舊檔的讀者不受影響。
+# 多個 worker（shared/serve.py）共用同一個目錄，同步時以 flock 互斥（Windows 只有行程內的鎖）。
+#
+# 數值存成 float32（約 7 位有效數字），欄位式 JSON 輸出四捨五入到小數四位。
+# 目錄可以隨時整個刪掉，下次讀取會重建。
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+import vitals_columns
+from vitals_store import VITAL_FIELDS, backfill_meta
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MAGIC = b"VTS1"
+HEADER = struct.Struct("<4sIQQQ")
+RECORD = np.dtype([("ts", "<i8")] + [(k, "<f4") for k in VITAL_FIELDS])
+SUFFIX = ".vts"
+JSON_DECIMALS = 4
+
+_SAFE_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+_local_lock = threading.Lock()
+
+
+def parse_version(etag):
+    """vitals_store.version_from_metas 的 ETag "writes-all-last_ts" → (writes, all)。"""
+    writes, all_writes, _ = etag.split("-")
+    return int(writes), int(all_writes)
+
+
+class Segment:
+    """一位病人檔案的一個快照：檔頭資訊 + 前 n 筆紀錄（memmap 或記憶體內陣列）。"""
+
+    def __init__(self, n, writes, all_writes, records):
+        self.n = n
+        self.writes = writes
+        self.all = all_writes
+        self.records = records
+
+    def covers(self, writes, all_writes):
+        """檔頭的版本不比 (writes, all) 舊：其他 worker 可能已用更新的版本同步過。"""
+        return self.all > all_writes or (self.all == all_writes and self.writes >= writes)
+
+    @property
+    def last_ms(self):
+        return int(self.records["ts"][-1]) if self.n else None
+
+    def range(self, start_ms=None, end_ms=None, after_ms=None):
+        """start ≤ ts < end 且 ts > after 的紀錄（切片，不複製）。"""
+        ts = self.records["ts"]
+        lo, hi = 0, self.n
+        if start_ms is not None:
+            lo = max(lo, int(np.searchsorted(ts, start_ms, side="left")))
+        if after_ms is not None:
+            lo = max(lo, int(np.searchsorted(ts, after_ms, side="right")))
+        if end_ms is not None:
+            hi = int(np.searchsorted(ts, end_ms, side="left"))
+        return self.records[lo:max(lo, hi)]
+
+
+def _read_segment(f):
+    """從已開啟的檔案讀檔頭並映射前 n 筆；檔案是空的或版面不符回傳 None。"""
+    f.seek(0)
+    raw = f.read(HEADER.size)
+    if len(raw) < HEADER.size:
+        return None
+    magic, nfields, n, writes, all_writes = HEADER.unpack(raw)
+    if magic != MAGIC or nfields != len(VITAL_FIELDS):
+        return None
+    if os.fstat(f.fileno()).st_size < HEADER.size + n * RECORD.itemsize:
+        return None
+    if n == 0:
+        records = np.empty(0, dtype=RECORD)
+    else:
+        records = np.memmap(f, dtype=RECORD, mode="r", offset=HEADER.size, shape=(n,))
+    return Segment(n, writes, all_writes, records)
+
+
+def _to_records(cols):
+    """vitals_columns 的欄位資料（串列，缺值 None）→ 紀錄陣列"""
+    rec = np.empty(len(cols["ts"]), dtype=RECORD)
+    rec["ts"] = np.asarray(cols["ts"], dtype=np.int64)
+    for k in VITAL_FIELDS:
+        rec[k] = np.array(cols[k], dtype=np.float32)  # None → NaN
+    return rec
+
+
+def _fetch(db, patient_id, after_ms=None):
+    q = {"patient_id": patient_id}
+    if after_ms is not None:
+        q["ts"] = {"$gt": datetime.fromtimestamp(after_ms / 1000, tz=timezone.utc)}
+    return _to_records(vitals_columns.merge_groups(db.vitals.aggregate(vitals_columns.columnar_pipeline(q))))
+
+
+class TsCache:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.reads = self.appends = self.rebuilds = 0
+
+    def _path(self, patient_id):
+        name = patient_id if _SAFE_ID.fullmatch(patient_id) else \
+            "h-" + hashlib.blake2b(patient_id.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.root, name + SUFFIX)
+
+    def read(self, db, patient_id, etag, start_ms=None, end_ms=None, after_ms=None):
+        """
+        etag 為 get_version / get_versions_each 取得的病人版本；快取落後就先同步。
+        回傳時間範圍內的紀錄（RECORD 結構陣列）；沒有任何資料的病人回傳空陣列、不建檔。
+        """
+        writes, all_writes = parse_version(etag)
+        if writes == 0:
+            writes, all_writes = parse_version(backfill_meta(db, patient_id)[0])
+            if writes == 0:
+                return np.empty(0, dtype=RECORD)
+        path = self._path(patient_id)
+        seg = None
+        try:
+            with open(path, "rb") as f:
+                with _flock(f, shared=True):
+                    seg = _read_segment(f)
+        except FileNotFoundError:
+            pass
+        if seg is None or not seg.covers(writes, all_writes):
+            seg = self._sync(db, patient_id, path, writes, all_writes)
+        self.reads += 1
+        return seg.range(start_ms, end_ms, after_ms)
+
+    def _sync(self, db, patient_id, path, writes, all_writes):
+        with _locked(path) as f:
+            seg = _read_segment(f)  # 等鎖期間可能已被其他 worker 同步
+            if seg is not None and seg.covers(writes, all_writes):
+                return seg
+            if seg is not None and seg.all == all_writes:
+                new = _fetch(db, patient_id, seg.last_ms)
+                # 多出來的可能是 meta 還沒記到的新寫入，先收下；少了代表有舊時間點被改寫
+                if seg.writes + len(new) >= writes:
+                    return self._append(f, seg, new)
+            return self._rebuild(path, _fetch(db, patient_id), writes, all_writes)
+
+    def _append(self, f, seg, new):
+        n = seg.n + len(new)
+        writes = seg.writes + len(new)
+        if len(new):
+            f.seek(HEADER.size + seg.n * RECORD.itemsize)
+            f.write(new.tobytes())
+            f.truncate()
+            f.flush()
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(VITAL_FIELDS), n, writes, seg.all))
+        f.flush()
+        self.appends += 1
+        return _read_segment(f)
+
+    def _rebuild(self, path, rec, writes, all_writes):
+        self.rebuilds += 1
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, len(VITAL_FIELDS), len(rec), writes, all_writes))
+                out.write(rec.tobytes())
+            os.replace(tmp, path)
+        except OSError:
+            # Windows 上舊檔仍被映射時無法取代：這次直接用記憶體內的資料
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        return Segment(len(rec), writes, all_writes, rec)
+
+
+@contextmanager
+def _flock(f, shared=False):
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _open_rw(path):
+    # 不能用 "a+b"：O_APPEND 會讓寫檔頭也跑到檔尾
+    return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+
+
+@contextmanager
+def _locked(path):
+    """開啟（必要時建立）病人檔並取得獨占鎖；拿到鎖時檔案已被 os.replace 換掉就重開。"""
+    if fcntl is None:
+        with _local_lock:
+            with _open_rw(path) as f:
+                yield f
+        return
+    while True:
+        f = _open_rw(path)
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            same = os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            same = False
+        if same:
+            break
+        f.close()
+    try:
+        yield f
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+# ---- 給圖表 API 的輸出 ----
+def to_arrays(rec):
+    """紀錄 → vitals_columns.to_binary 可直接吃的欄位陣列（各欄位仍是映射上的 view）。"""
+    return {"ts": rec["ts"], **{k: rec[k] for k in VITAL_FIELDS}}
+
+
+def _json_list(a, nd):
+    x = np.round(a.astype(np.float64), nd)
+    return [None if v != v else v for v in x.tolist()]
+
+
+def to_columns(rec):
+    """紀錄 → 欄位式 JSON 資料（與 vitals_columns.merge_groups 同格式，缺值 None）。"""
+    return {"ts": rec["ts"].tolist(), **{k: _json_list(rec[k], JSON_DECIMALS) for k in VITAL_FIELDS}}
+
+
+def bucket_means(rec, bucket_ms):
+    """
+    依時間桶取平均（同 vitals_columns.multi_pipeline 的 bucket 版：缺值不列入、全缺為 None、
+    小數兩位，ts 為桶的起點）。紀錄已依 ts 排序，同一桶必定相鄰，用 reduceat 一次算完。
+    """
+    if not len(rec):
+        return vitals_columns.empty_columns()
+    ts = rec["ts"]
+    b = ts - ts % bucket_ms
+    starts = np.flatnonzero(np.concatenate(([True], b[1:] != b[:-1])))
+    out = {"ts": b[starts].tolist()}
+    for k in VITAL_FIELDS:
+        x = rec[k].astype(np.float64)
+        valid = ~np.isnan(x)
+        total = np.add.reduceat(np.where(valid, x, 0.0), starts)
+        count = np.add.reduceat(valid.astype(np.int64), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+        out[k] = _json_list(mean, 2)
+    return out
@@ -0,0 +1,120 @@
+# vitals_api.py — /api/vitals 系列的請求解析與回應組裝（app.py 的 Flask 與 async_app.py 的 Quart 共用）
+#
+# 兩個 app 只各自負責 I/O（vitals_meta 版本、vitals / 歸檔查詢、ts_cache），其餘都在這裡：
+#   VitalsQuery        ?start / end / since / tz / format 的解析與檢查、Mongo 查詢條件、要不要接歸檔
+#   not_modified       If-None-Match / If-Modified-Since 判斷 304
+#   set_cache_headers  ETag / Last-Modified / Cache-Control
+#   add_local_times    rows 格式的 ts_local
+#   cached_columns     ts_cache 讀出的紀錄 → 欄位資料
+#   binary_body        二進位回應的內容與標頭
+#   stream_since / sse_event   SSE 的補送起點與事件格式
+# request / response 物件只用到 Flask 與 Quart 相同的介面（args、headers、if_none_match、set_etag…）。
+from datetime import timezone
+
+import local_time
+import retention
+import vitals_columns
+from vitals_store import HASH_FIELD, VITAL_FIELDS
+
+NO_ID = {"_id": 0, HASH_FIELD: 0}
+FORMATS = ("rows", "columnar", "binary")
+
+
+class VitalsQuery:
+    """
+    /api/vitals/<patient_id> 的查詢參數；格式不符丟 ValueError（訊息直接回給前端）。
+      q             Mongo 查詢條件（patient_id + ts 範圍）
+      lower         start 與 since 較晚的那個（歸檔從這裡開始讀）
+    """
+
+    def __init__(self, patient_id, args):
+        self.patient_id = patient_id
+        self.tz = args.get("tz")
+        if self.tz:
+            local_time.get_tz(self.tz)
+        self.fmt = args.get("format", "rows")
+        if self.fmt not in FORMATS:
+            raise ValueError("format 需為 rows、columnar 或 binary")
+
+        self.start = local_time.parse_query_time(args.get("start"))
+        self.end = local_time.parse_query_time(args.get("end"))
+        self.since = local_time.parse_query_time(args.get("since"))
+        self.q = {"patient_id": patient_id}
+        if self.start or self.end or self.since:
+            self.q["ts"] = {}
+            if self.start: self.q["ts"]["$gte"] = self.start
+            if self.end: self.q["ts"]["$lt"] = self.end
+            if self.since: self.q["ts"]["$gt"] = self.since
+
+        self.lower = max([t for t in (self.start, self.since) if t], default=None)
+
+    def needs_archive(self, boundary):
+        """
+        boundary 為 vitals_meta 記下的歸檔邊界（vitals_store.archive_boundary）：範圍下限早於它才接 vitals_archive。
+        以實際歸檔時的邊界判斷，不用本行程的 VITALS_HOT_DAYS 猜（歸檔可能用不同的 --hot-days 跑）。
+        """
+        return retention.needs_archive(boundary, self.lower)
+
+    def cache_range(self):
+        """ts_cache.TsCache.read 的範圍參數（epoch ms）"""
+        return {"start_ms": ts_ms(self.start) if self.start else None,
+                "end_ms": ts_ms(self.end) if self.end else None,
+                "after_ms": ts_ms(self.since) if self.since else None}
+
+
+def not_modified(request, etag, last_mod):
+    """If-None-Match 優先；沒帶才看 If-Modified-Since（HTTP 日期只到秒）"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    ims = request.if_modified_since
+    return bool(ims and last_mod and last_mod.replace(microsecond=0) <= ims)
+
+
+def set_cache_headers(resp, etag, last_mod):
+    resp.set_etag(etag, weak=True)
+    if last_mod:
+        resp.last_modified = last_mod
+    resp.headers["Cache-Control"] = "no-cache"  # 可快取但每次都要回來驗證
+    return resp
+
+
+def add_local_times(rows, tz):
+    """每筆多一個 ts_local（ISO 8601 含偏移），整批一次轉換"""
+    for r, iso in zip(rows, local_time.iso_with_offset([r["ts"] for r in rows], tz)):
+        r["ts_local"] = iso
+    return rows
+
+
+def cached_columns(rec, as_lists):
+    """ts_cache 的紀錄 → 欄位資料；二進位直接用映射上的陣列，要接歸檔或輸出 JSON（as_lists）時才轉成串列"""
+    import ts_cache
+    if as_lists:
+        return ts_cache.to_columns(rec)
+    return ts_cache.to_arrays(rec)
+
+
+def binary_body(cols):
+    """?format=binary 的 (內容, mimetype, headers)"""
+    return vitals_columns.to_binary(cols), "application/octet-stream", {"X-Vitals-Fields": ",".join(VITAL_FIELDS)}
+
+
+# ---- SSE ----
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def ts_ms(dt):
+    """datetime（Mongo 取回為 naive UTC）→ epoch 毫秒"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def sse_event(doc, dumps):
+    doc = {k: v for k, v in doc.items() if k not in NO_ID}
+    return f"id: {ts_ms(doc['ts'])}\ndata: {dumps(doc)}\n\n"
+
+
+def stream_since(request):
+    """SSE 從哪一筆之後開始補送：?since= 與 Last-Event-ID（都是 epoch ms）取較新的；都沒有回傳 None"""
+    marks = [v for v in (request.args.get("since", ""), request.headers.get("Last-Event-ID", "")) if v.isdigit()]
+    return local_time.parse_query_time(max(marks, key=int)) if marks else None
@@ -0,0 +1,143 @@
+# vitals_columns.py — vitals 的欄位式（columnar）輸出，給圖表用
+#
+# 列式 JSON 每個點都重複 patient_id、hr、bp_sys… 這些鍵，瀏覽器還要再拆回各序列。
+# 欄位式：{"ts": [epoch ms...], "hr": [...], ...}，缺值保留為 null，各陣列等長。
+# 由 Mongo 的 $group/$push 直接組好陣列（每天一組，避免單一文件超過 16MB），
+# Python 端只把各組陣列接起來，不建每一筆的 dict。
+#
+# 二進位版（format=binary，application/octet-stream，little-endian）：
+#   0    4 bytes  b"VTL1"
+#   4    uint32   n
+#   8    float64 × n  ts（epoch ms，JS 可直接 new Float64Array）
+#   …    float32 × n  依 VITAL_FIELDS 順序各一段，缺值為 NaN
+from datetime import datetime
+
+from vitals_store import VITAL_FIELDS
+
+EPOCH = datetime(1970, 1, 1)
+MAGIC = b"VTL1"
+BUCKET_UNITS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+_TS_MS = {"$subtract": ["$ts", EPOCH]}  # date - date 在 Mongo 中得到毫秒數
+_DAY = {"$dateToString": {"format": "%Y-%m-%d", "date": "$ts"}}
+
+
+def _push_fields():
+    # $push 遇到不存在的欄位會略過，用 $ifNull 補 null 保持對齊
+    return {"ts": {"$push": _TS_MS}, **{k: {"$push": {"$ifNull": [f"${k}", None]}} for k in VITAL_FIELDS}}
+
+
+def columnar_pipeline(q):
+    """依 ts 排序後，以 UTC 日期分組把各欄位 $push 成陣列。"""
+    return [
+        {"$match": q},
+        {"$sort": {"ts": 1}},
+        {"$group": {"_id": _DAY, **_push_fields()}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def parse_bucket(s):
+    """'30s' / '5m' / '1h' / '1d' 或毫秒數 → 毫秒；空值回傳 None，格式不符或小於 1 秒丟 ValueError。"""
+    if not s:
+        return None
+    s = s.strip().lower()
+    try:
+        ms = int(s) if s.isdigit() else int(float(s[:-1]) * BUCKET_UNITS[s[-1]])
+    except (KeyError, ValueError, IndexError):
+        ms = None
+    if ms is None or ms < 1000:
+        raise ValueError("bucket 需為 30s、5m、1h、1d 或 ≥ 1000 的毫秒數")
+    return ms
+
+
+def multi_pipeline(q, bucket_ms=None):
+    """
+    多位病人一次查詢（q 內 patient_id 為 $in），依 (patient_id, ts) 索引順序。
+    沒有 bucket：每位病人每天一組陣列；
+    有 bucket：先依 (病人, 時間桶) 取平均（缺值不列入平均），再每位病人一組陣列，ts 為桶的起點。
+    """
+    if not bucket_ms:
+        return [
+            {"$match": q},
+            {"$sort": {"patient_id": 1, "ts": 1}},
+            {"$group": {"_id": {"p": "$patient_id", "d": _DAY}, **_push_fields()}},
+            {"$sort": {"_id.p": 1, "_id.d": 1}},
+        ]
+    return [
+        {"$match": q},
+        {"$group": {
+            "_id": {"p": "$patient_id", "b": {"$subtract": [_TS_MS, {"$mod": [_TS_MS, bucket_ms]}]}},
+            **{k: {"$avg": f"${k}"} for k in VITAL_FIELDS},
+        }},
+        {"$sort": {"_id.p": 1, "_id.b": 1}},
+        {"$group": {"_id": {"p": "$_id.p"}, "ts": {"$push": "$_id.b"},
+                    **{k: {"$push": f"${k}"} for k in VITAL_FIELDS}}},
+        {"$sort": {"_id.p": 1}},
+    ]
+
+
+def iter_patients(groups, bucketed=False):
+    """multi_pipeline 的結果 → 依病人產生 (patient_id, 欄位資料)；平均值四捨五入到小數兩位。"""
+    pid, cols = None, None
+    for g in groups:
+        if g["_id"]["p"] != pid:
+            if cols is not None:
+                yield pid, cols
+            pid, cols = g["_id"]["p"], empty_columns()
+        if bucketed:
+            cols["ts"].extend(int(t) for t in g["ts"])
+            for k in VITAL_FIELDS:
+                cols[k].extend(None if v is None else round(v, 2) for v in g[k])
+        else:
+            for k in cols:
+                cols[k].extend(g[k])
+    if cols is not None:
+        yield pid, cols
+
+
+def empty_columns():
+    return {"ts": [], **{k: [] for k in VITAL_FIELDS}}
+
+
+def merge_groups(groups):
+    """把 columnar_pipeline 的各組結果依序接成一份欄位資料。"""
+    out = empty_columns()
+    for g in groups:
+        for k in out:
+            out[k].extend(g[k])
+    return out
+
+
+def columns_from_rows(rows):
+    """列式資料（例如歸檔解開的結果）轉欄位式。"""
+    out = empty_columns()
+    for r in rows:
+        ts = r["ts"]
+        sec = ts.timestamp() if ts.tzinfo else (ts - EPOCH).total_seconds()  # naive 為 UTC
+        out["ts"].append(round(sec * 1000))
+        for k in VITAL_FIELDS:
+            out[k].append(r.get(k))
+    return out
+
+
+def prepend_rows(rows, cols):
+    """把較舊的列式資料（歸檔）接在欄位資料前面；同 ts 以 cols 為準。"""
+    if not rows:
+        return cols
+    old = columns_from_rows(rows)
+    hot = set(cols["ts"])
+    keep = [i for i, t in enumerate(old["ts"]) if t not in hot]
+    return {k: [old[k][i] for i in keep] + cols[k] for k in cols}
+
+
+def to_binary(cols):
+    """欄位資料 → 二進位 typed array 格式（見檔頭說明）。"""
+    import numpy as np
+
+    n = len(cols["ts"])
+    parts = [MAGIC, np.uint32(n).astype("<u4").tobytes(),
+             np.asarray(cols["ts"], dtype="<f8").tobytes()]
+    # None 在 float 陣列中會變成 NaN
+    parts += [np.array(cols[k], dtype="<f4").tobytes() for k in VITAL_FIELDS]
+    return b"".join(parts)
@@ -0,0 +1,274 @@
+# vitals_stats.py — 以 NumPy 對單一病人的 vitals 陣列做滾動統計與早期預警分數
+#
+# 資料以欄位陣列存放：ts 為 int64 epoch 毫秒，各 vital 為 float64（缺值 NaN），
+# 所有計算都是整段向量化，沒有逐筆 Python 迴圈。
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from ts_cache import parse_version
+from vitals_store import VITAL_FIELDS, backfill_meta, get_version
+
+# NEWS2 分數區間：np.digitize(x, bins, right=True) 的結果當 index 去查 scores
+# 例：hr ≤40 → 3、41–50 → 1、51–90 → 0、91–110 → 1、111–130 → 2、≥131 → 3
+NEWS_BANDS = {
+    "hr":     ([40, 50, 90, 110, 130], [3, 1, 0, 1, 2, 3]),
+    "bp_sys": ([90, 100, 110, 219],    [3, 2, 1, 0, 3]),
+    "spo2":   ([91, 93, 95],           [3, 2, 1, 0]),
+    "temp":   ([35.0, 36.0, 38.0, 39.0], [3, 1, 0, 1, 2]),
+}
+
+
+def _ms(dt):
+    """datetime（Mongo 取回為 naive UTC）→ epoch 毫秒"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+class PatientSeries:
+    """單一病人的欄位陣列，容量倍增，append 攤銷 O(1)。"""
+
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self._ts = np.empty(capacity, dtype=np.int64)
+        self._v = {k: np.empty(capacity, dtype=np.float64) for k in VITAL_FIELDS}
+        self.writes = self.all = 0  # StatsCache 同步時的 vitals_meta 版本（同 ts_cache 的檔頭）
+
+    @property
+    def ts(self):
+        return self._ts[:self.n]
+
+    def values(self, k):
+        return self._v[k][:self.n]
+
+    @property
+    def last_ms(self):
+        return int(self._ts[self.n - 1]) if self.n else None
+
+    def covers(self, writes, all_writes):
+        """記下的版本不比 (writes, all) 舊（同 ts_cache.Segment.covers）"""
+        return self.all > all_writes or (self.all == all_writes and self.writes >= writes)
+
+    def snapshot(self):
+        """固定目前的 n 的唯讀快照：之後的 append 只寫在 n 之後或換新陣列，不影響快照內容。"""
+        s = PatientSeries.__new__(PatientSeries)
+        s.n, s._ts, s._v = self.n, self._ts, dict(self._v)
+        s.writes, s.all = self.writes, self.all
+        return s
+
+    def _grow(self, need):
+        cap = len(self._ts)
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        self._ts = np.resize(self._ts, cap)
+        for k in VITAL_FIELDS:
+            self._v[k] = np.resize(self._v[k], cap)
+
+    def append(self, docs):
+        """
+        依 ts 排序後附加；只接受比目前最後一筆更新的資料。
+        有舊時間點（補資料或修改）時回傳 False，呼叫端應整個重建。
+        """
+        docs = sorted(docs, key=lambda d: d["ts"])
+        if not docs:
+            return True
+        ms = np.fromiter((_ms(d["ts"]) for d in docs), dtype=np.int64, count=len(docs))
+        if self.n and ms[0] <= self._ts[self.n - 1]:
+            return False
+        m = len(docs)
+        self._grow(self.n + m)
+        self._ts[self.n:self.n + m] = ms
+        for k in VITAL_FIELDS:
+            self._v[k][self.n:self.n + m] = np.fromiter(
+                (np.nan if d.get(k) is None else d[k] for d in docs), dtype=np.float64, count=m)
+        self.n += m
+        return True
+
+
+# ---- 向量化計算 ----
+def rolling_mean_std(x, window):
+    """
+    最近 window 個點（忽略 NaN）的平均與標準差，用累積和一次算完。
+    有效點數為 0 的位置回傳 NaN。
+    """
+    valid = ~np.isnan(x)
+    x0 = np.where(valid, x, 0.0)
+    c = np.concatenate(([0], np.cumsum(valid)))
+    s1 = np.concatenate(([0.0], np.cumsum(x0)))
+    s2 = np.concatenate(([0.0], np.cumsum(x0 * x0)))
+    hi = np.arange(1, len(x) + 1)
+    lo = np.maximum(hi - window, 0)
+    cnt = c[hi] - c[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (s1[hi] - s1[lo]) / cnt
+        var = (s2[hi] - s2[lo]) / cnt - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    mean[cnt == 0] = np.nan
+    std[cnt == 0] = np.nan
+    return mean, std
+
+
+def rate_of_change(ts_ms, x):
+    """每小時變化量：(x[i] - 上一個有效值) / 經過小時數；第一筆或缺值為 NaN。"""
+    out = np.full(len(x), np.nan)
+    idx = np.flatnonzero(~np.isnan(x))
+    if len(idx) > 1:
+        dt_h = (ts_ms[idx[1:]] - ts_ms[idx[:-1]]) / 3_600_000
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[idx[1:]] = (x[idx[1:]] - x[idx[:-1]]) / dt_h
+    return out
+
+
+def news_scores(series):
+    """每筆的 NEWS2 部分分數（只含有量測的項目），回傳 (總分, {欄位: 分數陣列})。"""
+    parts = {}
+    total = np.zeros(series.n, dtype=np.int64)
+    for k, (bins, scores) in NEWS_BANDS.items():
+        x = series.values(k)
+        sc = np.asarray(scores)[np.digitize(np.nan_to_num(x, nan=0.0), bins, right=True)]
+        sc[np.isnan(x)] = 0
+        parts[k] = sc
+        total += sc
+    return total, parts
+
+
+def news_level(total, parts_max):
+    """NEWS2 臨床反應等級：≥7 high、≥5 或任一項 3 分 medium、其餘 low。"""
+    if total >= 7:
+        return "high"
+    if total >= 5 or parts_max >= 3:
+        return "medium"
+    return "low"
+
+
+def threshold_flags(series, thresholds):
+    """每個欄位超出 (下限, 上限) 的布林陣列。"""
+    flags = {}
+    for k, (lo, hi) in thresholds.items():
+        x = series.values(k)
+        f = np.zeros(series.n, dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if lo is not None: f |= x < lo
+            if hi is not None: f |= x > hi
+        flags[k] = f
+    return flags
+
+
+def compute_stats(series, window, thresholds, start_ms=None, end_ms=None):
+    """整段計算後再依時間範圍切片（滾動視窗需要範圍前的資料）。"""
+    ts = series.ts
+    lo = int(np.searchsorted(ts, start_ms, "left")) if start_ms is not None else 0
+    hi = int(np.searchsorted(ts, end_ms, "left")) if end_ms is not None else series.n
+
+    fields = {}
+    for k in VITAL_FIELDS:
+        x = series.values(k)
+        mean, std = rolling_mean_std(x, window)
+        fields[k] = {
+            "value": x[lo:hi],
+            "mean": mean[lo:hi],
+            "std": std[lo:hi],
+            "roc_per_h": rate_of_change(ts, x)[lo:hi],
+        }
+    total, parts = news_scores(series)
+    flags = threshold_flags(series, thresholds)
+
+    latest = None
+    if hi > lo:
+        i = hi - 1
+        pmax = max(int(p[i]) for p in parts.values())
+        latest = {
+            "ts": int(ts[i]),
+            "news": int(total[i]),
+            "level": news_level(int(total[i]), pmax),
+            "alerts": [k for k, f in flags.items() if f[i]],
+        }
+    return {
+        "ts": ts[lo:hi],
+        "fields": fields,
+        "news": total[lo:hi],
+        "alerts": {k: np.flatnonzero(f[lo:hi]) for k, f in flags.items()},
+        "latest": latest,
+    }
+
+
+class StatsCache:
+    """
+    行程內的 patient → PatientSeries 快取（LRU，最多 max_patients 位）。
+    每筆快取記下同步時 vitals_meta 的版本，讀取時先查 get_version（同 ts_cache 的同步規則）：
+      - 版本不比快取新 → 直接用；
+      - 全域世代號變了（其他 worker 的 /demo update_many）→ 整個重建；
+      - 否則以 ts > 最後一筆向 Mongo 補齊，新資料筆數對不上寫入數的差
+        （import_csv 補舊資料、改寫既有時間點）→ 整個重建。
+    寫入路徑呼叫 on_write 增量附加，同時把快取的寫入數加上附加的筆數。
+    共用的 PatientSeries 只在 self._lock 內修改（查 Mongo 時不持有鎖），get 回傳的是快照，
+    計算途中有人附加也不會讀到長度不一的陣列。
+    """
+
+    def __init__(self, max_patients=256):
+        self.max_patients = max_patients
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, db, patient_id):
+        s = PatientSeries()
+        s.append(list(db.vitals.find({"patient_id": patient_id}, {"_id": 0}).sort("ts", 1)))
+        return s
+
+    def get(self, db, patient_id):
+        writes, all_writes = parse_version(get_version(db, patient_id)[0])
+        if writes == 0:
+            writes, all_writes = parse_version(backfill_meta(db, patient_id)[0])
+        with self._lock:
+            s = self._items.get(patient_id)
+            if s is not None:
+                self._items.move_to_end(patient_id)
+                if s.covers(writes, all_writes):
+                    return s.snapshot()
+                last, same_gen = s.last_ms, s.all == all_writes
+        if s is not None and same_gen:
+            q = {"patient_id": patient_id}
+            if last is not None:
+                q["ts"] = {"$gt": datetime.fromtimestamp(last / 1000, tz=timezone.utc)}
+            new = list(db.vitals.find(q, {"_id": 0}).sort("ts", 1))
+            with self._lock:
+                if self._items.get(patient_id) is s:
+                    # 查詢期間 on_write 可能已附加其中一部分：只接比目前最後一筆新的
+                    if s.n:
+                        new = [d for d in new if _ms(d["ts"]) > s.last_ms]
+                    # 多出來的可能是 meta 還沒記到的新寫入，先收下；少了代表有舊時間點被改寫
+                    if s.writes + len(new) >= writes and s.append(new):
+                        s.writes += len(new)
+                        return s.snapshot()
+        # 沒有快取、世代號變了、有舊時間點被改寫，或查詢期間被淘汰 → 整個重載
+        s = self._load(db, patient_id)
+        s.writes, s.all = writes, all_writes  # 版本先查：資料只會比記下的版本新
+        with self._lock:
+            self._items[patient_id] = s
+            self._items.move_to_end(patient_id)
+            while len(self._items) > self.max_patients:
+                self._items.popitem(last=False)
+            return s.snapshot()
+
+    def on_write(self, docs):
+        by_pid = {}
+        for d in docs:
+            by_pid.setdefault(d["patient_id"], []).append(d)
+        with self._lock:
+            for pid, ds in by_pid.items():
+                s = self._items.get(pid)
+                if s is None:
+                    continue
+                if s.append(ds):
+                    s.writes += len(ds)  # record_write 的 touch_meta 也是一筆算一次
+                else:
+                    del self._items[pid]  # 舊時間點被改 → 下次讀取重建
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,259 @@
+# vitals_store.py — vitals 集合的共用寫入工具（app.py / import_csv.py 共用）
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from retention import META_ID as RETENTION_META
+
+VITAL_FIELDS = ("hr", "bp_sys", "bp_dia", "spo2", "temp")
+
+# 異常門檻 (下限, 上限)，None 表示不檢查該側（病房總覽、統計 API 共用）
+THRESHOLDS = {
+    "hr": (50, 120),
+    "bp_sys": (90, 140),
+    "bp_dia": (60, 90),
+    "spo2": (94, None),
+    "temp": (35.5, 37.5),
+}
+
+
+def abnormal_fields(doc):
+    out = []
+    for k, (lo, hi) in THRESHOLDS.items():
+        v = doc.get(k)
+        if v is None:
+            continue
+        if (lo is not None and v < lo) or (hi is not None and v > hi):
+            out.append(k)
+    return out
+
+
+HASH_FIELD = "h"      # 正規化內容的雜湊，用來判斷重新匯入時資料是否真的有變
+LOOKUP_CHUNK = 1000  # 查既有雜湊時每次帶的鍵數
+
+
+def _key(pid, ts):
+    """(patient_id, epoch ms)；Mongo 取回的 ts 為 naive UTC，寫入前的可能帶時區"""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return pid, int(ts.timestamp() * 1000)
+
+
+def doc_hash(doc):
+    """patient_id、ts 與各 vital 數值的雜湊（None 與數字分開表示）。"""
+    pid, ms = _key(doc["patient_id"], doc["ts"])
+    vals = [None if doc.get(k) is None else float(doc[k]) for k in VITAL_FIELDS]
+    raw = json.dumps([pid, ms, vals], separators=(",", ":"))
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def _existing_hashes(coll, docs):
+    """一次查回這批 (patient_id, ts) 在資料庫中的雜湊：{key: h}"""
+    out = {}
+    for i in range(0, len(docs), LOOKUP_CHUNK):
+        part = docs[i:i + LOOKUP_CHUNK]
+        q = {"patient_id": {"$in": list({d["patient_id"] for d in part})},
+             "ts": {"$in": list({d["ts"] for d in part})}}
+        for e in coll.find(q, {"_id": 0, "patient_id": 1, "ts": 1, HASH_FIELD: 1}):
+            out[_key(e["patient_id"], e["ts"])] = e.get(HASH_FIELD)
+    return out
+
+
+def bulk_upsert(coll, docs, skip_unchanged=False):
+    """
+    以 (patient_id, ts) 為鍵，一次 bulk_write 把 docs 全部 upsert。
+    ordered=False：單筆失敗不影響其他筆。每筆都會寫入內容雜湊 h。
+    skip_unchanged=True：先查回既有雜湊，內容相同的筆數不送出寫入。
+    回傳 dict：
+      matched / modified：整批統計
+      upserted：{docs 索引: _id}（新插入的那幾筆）
+      errors：{docs 索引: 錯誤訊息}
+      unchanged：內容相同而略過的 docs 索引（set）
+    """
+    out = {"matched": 0, "modified": 0, "upserted": {}, "errors": {}, "unchanged": set()}
+    if not docs:
+        return out
+
+    for d in docs:
+        d[HASH_FIELD] = doc_hash(d)
+    todo = list(range(len(docs)))
+    if skip_unchanged:
+        existing = _existing_hashes(coll, docs)
+        todo = [i for i in todo
+                if existing.get(_key(docs[i]["patient_id"], docs[i]["ts"])) != docs[i][HASH_FIELD]]
+        out["unchanged"] = set(range(len(docs))) - set(todo)
+    if not todo:
+        return out
+
+    ops = [
+        UpdateOne({"patient_id": docs[i]["patient_id"], "ts": docs[i]["ts"]}, {"$set": docs[i]}, upsert=True)
+        for i in todo
+    ]
+    try:
+        res = coll.bulk_write(ops, ordered=False)
+        out["matched"] = res.matched_count
+        out["modified"] = res.modified_count
+        out["upserted"] = {todo[j]: _id for j, _id in (res.upserted_ids or {}).items()}
+    except BulkWriteError as e:
+        # 部分失敗：其餘成功的筆數仍在 details 裡
+        d = e.details
+        out["matched"] = d.get("nMatched", 0)
+        out["modified"] = d.get("nModified", 0)
+        out["upserted"] = {todo[u["index"]]: u["_id"] for u in d.get("upserted", [])}
+        out["errors"] = {todo[w["index"]]: w.get("errmsg", "write error") for w in d.get("writeErrors", [])}
+    return out
+
+
+def written_docs(docs, res):
+    """bulk_upsert 結果中實際寫入成功（非略過、非失敗）的文件。"""
+    return [d for i, d in enumerate(docs) if i not in res["errors"] and i not in res["unchanged"]]
+
+
+# ---- 每位病人的版本資訊（vitals_meta）----
+# {_id: patient_id, writes: 累計寫入筆數, last_ts: 最新一筆 ts, updated_at: 最後寫入時間}
+# 另有一筆 _id="__all__" 的全域世代號：/demo 這類跨病人的 update_many 只會 bump 這個。
+META_ALL = "__all__"
+
+
+def touch_meta(db, docs):
+    """寫入 vitals 後呼叫：依 patient 累加 writes、推進 last_ts。"""
+    per_pid = {}
+    for d in docs:
+        n, mx = per_pid.get(d["patient_id"], (0, d["ts"]))
+        per_pid[d["patient_id"]] = (n + 1, max(mx, d["ts"]))
+    if not per_pid:
+        return
+    ops = [
+        UpdateOne({"_id": pid},
+                  {"$inc": {"writes": n}, "$max": {"last_ts": mx}, "$currentDate": {"updated_at": True}},
+                  upsert=True)
+        for pid, (n, mx) in per_pid.items()
+    ]
+    db.vitals_meta.bulk_write(ops, ordered=False)
+
+
+def bump_all(db):
+    """無法得知影響哪些病人的寫入（例如條件式 update_many）→ 讓所有病人的版本都失效。"""
+    db.vitals_meta.update_one({"_id": META_ALL},
+                              {"$inc": {"writes": 1}, "$currentDate": {"updated_at": True}},
+                              upsert=True)
+
+
+def version_query(patient_id):
+    """病人自己、全域世代號與歸檔邊界三筆 meta 的查詢條件（_id 索引）。"""
+    return {"_id": {"$in": [patient_id, META_ALL, RETENTION_META]}}
+
+
+def archive_boundary(metas):
+    """version_query 查回的 meta 中 retention.archive_old 記下的歸檔邊界（沒歸檔過為 None）。"""
+    for m in metas:
+        if m["_id"] == RETENTION_META:
+            return m.get("archived_before")
+    return None
+
+
+def version_from_metas(patient_id, metas):
+    """由 version_query 查回的 meta 文件算出 (etag 字串, last_modified datetime 或 None)。"""
+    metas = {m["_id"]: m for m in metas}
+    me, al = metas.get(patient_id, {}), metas.get(META_ALL, {})
+    last_ts = me.get("last_ts")
+    ts_part = int(last_ts.replace(tzinfo=timezone.utc).timestamp() * 1000) if last_ts else 0
+    etag = f"{me.get('writes', 0)}-{al.get('writes', 0)}-{ts_part}"
+    stamps = [m["updated_at"] for m in (me, al) if m.get("updated_at")]
+    last_mod = max(stamps).replace(tzinfo=timezone.utc) if stamps else None
+    return etag, last_mod
+
+
+def get_versions_each(db, patient_ids):
+    """get_versions 再加上各病人自己的 etag：回傳 (合併 etag, last_modified, {patient_id: etag})。"""
+    metas = list(db.vitals_meta.find({"_id": {"$in": list(patient_ids) + [META_ALL]}}))
+    parts = {pid: version_from_metas(pid, metas) for pid in patient_ids}
+    raw = "|".join(e for e, _ in parts.values())
+    stamps = [m for _, m in parts.values() if m]
+    return (hashlib.blake2b(raw.encode(), digest_size=8).hexdigest(), (max(stamps) if stamps else None),
+            {pid: e for pid, (e, _) in parts.items()})
+
+
+def get_versions(db, patient_ids):
+    """
+    多位病人的合併版本：一次 $in 查回所有 meta，任何一位有寫入 ETag 就會變。
+    回傳 (etag 字串, last_modified datetime 或 None)。
+    """
+    etag, last_mod, _ = get_versions_each(db, patient_ids)
+    return etag, last_mod
+
+
+def get_version(db, patient_id):
+    """一次查詢取回版本資訊，見 version_from_metas。"""
+    return version_from_metas(patient_id, db.vitals_meta.find(version_query(patient_id)))
+
+
+def get_version_and_boundary(db, patient_id):
+    """同 get_version，另外回傳歸檔邊界（同一次查詢）：(etag, last_modified, archived_before)。"""
+    metas = list(db.vitals_meta.find(version_query(patient_id)))
+    return (*version_from_metas(patient_id, metas), archive_boundary(metas))
+
+
+def backfill_meta(db, patient_id):
+    """
+    vitals_meta 還沒有這位病人（record_write 之前就存在、或繞過 record_write 寫入的資料）：
+    以目前的筆數與最新 ts 補一筆，回傳補完後的版本（同 get_version）。沒有任何資料就不建立。
+    """
+    last = db.vitals.find_one({"patient_id": patient_id}, {"ts": 1}, sort=[("ts", -1)])
+    if last is not None:
+        n = db.vitals.count_documents({"patient_id": patient_id})
+        # 同時有 record_write 建立這筆時以它為準（$setOnInsert 不覆蓋）
+        db.vitals_meta.update_one(
+            {"_id": patient_id},
+            {"$setOnInsert": {"writes": n, "last_ts": last["ts"], "updated_at": datetime.now(timezone.utc)}},
+            upsert=True)
+    return get_version(db, patient_id)
+
+
+# ---- 每位病人的最新一筆（latest_vitals）----
+# {_id: patient_id, patient_id, ts, hr, ...}：只有更新的 ts 才會覆蓋，病房總覽一次查完。
+def update_latest(db, docs):
+    newest = {}
+    for d in docs:
+        cur = newest.get(d["patient_id"])
+        if cur is None or d["ts"] >= cur["ts"]:
+            newest[d["patient_id"]] = d
+    if not newest:
+        return
+    # 條件含 ts <= 新值：舊的快照才會被覆蓋；已有更新的快照時 upsert 會撞 _id（11000），忽略即可
+    ops = [
+        UpdateOne({"_id": pid, "ts": {"$lte": d["ts"]}}, {"$set": {k: v for k, v in d.items() if k not in ("_id", HASH_FIELD)}}, upsert=True)
+        for pid, d in newest.items()
+    ]
+    try:
+        db.latest_vitals.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        others = [w for w in e.details.get("writeErrors", []) if w.get("code") != 11000]
+        if others:
+            raise
+
+
+def rebuild_latest(db, patient_ids=None):
+    """從 vitals 重建快照（初次啟用、或條件式 update_many 之後）。"""
+    pipeline = []
+    if patient_ids:
+        pipeline.append({"$match": {"patient_id": {"$in": list(patient_ids)}}})
+    pipeline += [
+        {"$sort": {"patient_id": 1, "ts": -1}},
+        {"$group": {"_id": "$patient_id", "doc": {"$first": "$$ROOT"}}},
+    ]
+    ops = []
+    for g in db.vitals.aggregate(pipeline, allowDiskUse=True):
+        d = {k: v for k, v in g["doc"].items() if k not in ("_id", HASH_FIELD)}
+        ops.append(ReplaceOne({"_id": g["_id"]}, d, upsert=True))
+    if ops:
+        db.latest_vitals.bulk_write(ops, ordered=False)
+
+
+def record_write(db, docs):
+    """寫入 vitals 後要同步維護的衍生資料（app 與 import_csv 共用）。"""
+    touch_meta(db, docs)
+    update_latest(db, docs)
@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, Response, stream_with_context
+import click
 
 # 先安裝 PyMySQL 當 MySQLdb 的替身
 import pymysql
@@ -13,7 +14,13 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 
 
+import csv
+import io
 import os
+import sys
+import threading
+import time
+from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()  # 讀取 .env（若沒裝 python-dotenv 也不會壞）
 
@@ -34,26 +41,45 @@ app.config.update(
 
 mysql = MySQL(app)
 
+# ---- 請求延遲 / DB 時間指標（/metrics）----
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.init_app(app)
+from shared import profiler  # noqa: E402
+profiler.init_app(app)  # PROFILE_ENABLED=1 時才會掛上（見 shared/profiler.py）
+
+# ---- 讀寫分離：讀取走 MYSQL_REPLICAS 的副本，寫入與寫後讀走主庫（見 shared/db_router.py）----
+from shared import db_router  # noqa: E402
+router = db_router.Router(app, primary=lambda: mysql.connection)
+
 # ---- 小工具：執行 SQL ----
+@metrics.timed_db
 def query_all(sql, params=None):
-    cur = mysql.connection.cursor()
-    cur.execute(sql, params or ())
-    rows = cur.fetchall()
-    cur.close()
-    return rows
+    def run(conn):
+        cur = conn.cursor()
+        cur.execute(sql, params or ())
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    return router.read(run)
 
+@metrics.timed_db
 def query_one(sql, params=None):
-    cur = mysql.connection.cursor()
-    cur.execute(sql, params or ())
-    row = cur.fetchone()
-    cur.close()
-    return row
+    def run(conn):
+        cur = conn.cursor()
+        cur.execute(sql, params or ())
+        row = cur.fetchone()
+        cur.close()
+        return row
+    return router.read(run)
 
+@metrics.timed_db
 def exec_sql(sql, params=None):
     cur = mysql.connection.cursor()
     cur.execute(sql, params or ())
     mysql.connection.commit()
     cur.close()
+    router.mark_write()
 
 # ---- 登入保護裝飾器 ----
 def login_required(view):
@@ -119,21 +145,25 @@ def logout():
 @login_required
 def index():
     category = request.args.get("category")  # None / work / school / other
-    if category:
-        todos = query_all(
-            "SELECT id, task, category, status, note FROM todos "
-            "WHERE user_id=%s AND category=%s ORDER BY id DESC",
-            [g.user["id"], category]
-        )
+    archived = request.args.get("view") == "archive"  # ?view=archive：看已封存的完成任務
+    params = [g.user["id"]]
+    if archived:
+        sql = "SELECT id, task, category, status, note, completed_at FROM todos_archive WHERE user_id=%s "
     else:
-        todos = query_all(
+        # 預設：未完成 + 近期完成（還沒被 archive-done 搬走的舊完成任務也不顯示）
+        sql = (
             "SELECT id, task, category, status, note FROM todos "
-            "WHERE user_id=%s ORDER BY id DESC",
-            [g.user["id"]]
+            "WHERE user_id=%s AND (status <> '完成' OR completed_at >= NOW() - INTERVAL %s DAY) "
         )
-    return render_template("index.html", todos=todos, category=category)
-
-
+        params.append(ARCHIVE_AFTER_DAYS)
+    if category:
+        sql += "AND category=%s "
+        params.append(category)
+    sql += "ORDER BY id DESC"
+    if archived:
+        sql += f" LIMIT {ARCHIVE_VIEW_LIMIT}"
+    todos = query_all(sql, params)
+    return render_template("index.html", todos=todos, category=category, archived=archived)
 
 
 @app.route("/add", methods=["POST"])
@@ -153,7 +183,7 @@ def add():
 @app.route("/complete/<int:todo_id>")
 @login_required
 def complete(todo_id):
-    exec_sql("UPDATE todos SET status='完成' WHERE id=%s", (todo_id,))
+    exec_sql("UPDATE todos SET status='完成', completed_at=NOW() WHERE id=%s", (todo_id,))
     return redirect(url_for("index"))
 
 @app.route("/delete/<int:todo_id>")
@@ -171,9 +201,12 @@ def edit(todo_id):
         category = request.form.get("category", "").strip()
         status = request.form.get("status", "未完成").strip()
         note = request.form.get("note", "").strip()
+        # 改成完成時記下完成時間（已完成的保留原時間），改回未完成則清掉
         exec_sql(
-            "UPDATE todos SET task=%s, category=%s, status=%s, note=%s WHERE id=%s",
-            (task, category, status, note, todo_id)
+            "UPDATE todos SET task=%s, category=%s, status=%s, note=%s, "
+            "completed_at = CASE WHEN %s='完成' THEN COALESCE(completed_at, NOW()) END "
+            "WHERE id=%s",
+            (task, category, status, note, status, todo_id)
         )
         flash("已更新任務")
         return redirect(url_for("index"))
@@ -197,5 +230,207 @@ def update_note(todo_id):
     category = request.args.get("category")
     return redirect(url_for("index", category=category) if category else url_for("index"))
 
+# ====== 匯出 / 匯入 CSV ======
+# 匯出：SSCursor（伺服器端、不緩衝的游標）邊讀邊寫，每 EXPORT_CHUNK 列送出一段，記憶體用量固定
+# 匯入：每 IMPORT_BATCH 列一次 executemany（PyMySQL 會改寫成多列 INSERT），整份檔案同一個交易
+EXPORT_FIELDS = ["id", "task", "category", "status", "note"]
+EXPORT_CHUNK = 500
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))
+
+@app.route("/export.csv")
+@login_required
+def export_csv():
+    uid = g.user["id"]
+
+    def gen():
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        buf.write("\ufeff")  # BOM：讓 Excel 以 UTF-8 開啟中文
+        w.writerow(EXPORT_FIELDS)
+        yield buf.getvalue()
+
+        cur = router.connection().cursor(pymysql.cursors.SSCursor)
+        try:
+            cur.execute(
+                "SELECT id, task, category, status, note FROM todos WHERE user_id=%s ORDER BY id",
+                [uid]
+            )
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                buf.seek(0)
+                buf.truncate()
+                w.writerows(rows)
+                yield buf.getvalue()
+        finally:
+            cur.close()  # 沒讀完（用戶端中斷）也會把剩下的結果丟掉，連線才能再用
+
+    # stream_with_context：產生器執行期間保留請求 / app context（mysql.connection 掛在上面）
+    return Response(
+        stream_with_context(gen()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=todos.csv"},
+    )
+
+@metrics.timed_db
+def import_batch(cur, uid, batch):
+    now = datetime.now()
+    cur.executemany(
+        "INSERT INTO todos (task, category, status, note, user_id, completed_at) VALUES (%s, %s, %s, %s, %s, %s)",
+        [(r["task"], r["category"], r["status"], r["note"], uid, now if r["status"] == "完成" else None)
+         for r in batch]
+    )
+
+@app.route("/import", methods=["POST"])
+@login_required
+def import_csv():
+    f = request.files.get("file")
+    if not f or not f.filename:
+        flash("請選擇 CSV 檔")
+        return redirect(url_for("index"))
+
+    # 欄位同匯出（id 會被忽略）；至少要有 task 欄
+    reader = csv.DictReader(io.TextIOWrapper(f.stream, encoding="utf-8-sig", newline=""))
+    if "task" not in (reader.fieldnames or []):
+        flash("CSV 缺少 task 欄位")
+        return redirect(url_for("index"))
+
+    conn = mysql.connection
+    cur = conn.cursor()
+    total, batch = 0, []
+    try:
+        for row in reader:
+            task = (row.get("task") or "").strip()
+            if not task:
+                continue
+            batch.append({
+                "task": task,
+                "category": (row.get("category") or "").strip().lower() or "other",
+                "status": (row.get("status") or "").strip() or "未完成",
+                "note": (row.get("note") or "").strip(),
+            })
+            if len(batch) >= IMPORT_BATCH:
+                import_batch(cur, g.user["id"], batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            import_batch(cur, g.user["id"], batch)
+            total += len(batch)
+        conn.commit()
+        router.mark_write()
+    except (UnicodeDecodeError, csv.Error, pymysql.MySQLError) as e:
+        conn.rollback()
+        flash(f"匯入失敗，已全部取消：{e}")
+        return redirect(url_for("index"))
+    finally:
+        cur.close()
+
+    flash(f"已匯入 {total} 筆任務")
+    return redirect(url_for("index"))
+
+# ====== 封存已完成的任務（todos → todos_archive）======
+# 完成超過 ARCHIVE_AFTER_DAYS 天的待辦搬到 todos_archive，讓 todos 與其索引只留未完成 + 近期完成；
+# 列表頁預設也只顯示這些，?view=archive 才查封存表。
+# todos.completed_at 與 todos_archive 在每個行程的第一個請求時自動補上（冪等；也可以部署時先跑
+# flask --app app init-archive），之後排程（例如每天）flask --app app archive-done。
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_VIEW_LIMIT = 500
+ARCHIVE_COLUMNS = "id, task, category, status, note, user_id, completed_at"
+
+def _has_column(cur, table, column):
+    cur.execute(
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s",
+        (table, column)
+    )
+    return cur.fetchone() is not None
+
+def _add_column(cur, table, column, ddl):
+    """欄位不存在才 ALTER；其他 worker 同時加好了（重複欄位）就當作成功"""
+    if _has_column(cur, table, column):
+        return False
+    try:
+        cur.execute(ddl)
+    except pymysql.MySQLError:
+        if not _has_column(cur, table, column):
+            raise
+        return False
+    return True
+
+def ensure_archive_schema():
+    """todos 加 completed_at（既有的已完成待辦以現在時間補上），並建立 todos_archive；可重複執行"""
+    conn = mysql.connection
+    cur = conn.cursor()
+    if _add_column(cur, "todos", "completed_at",
+                   "ALTER TABLE todos ADD COLUMN completed_at DATETIME NULL, "
+                   "ADD INDEX idx_todos_user_status (user_id, status, completed_at)"):
+        cur.execute("UPDATE todos SET completed_at=NOW() WHERE status='完成' AND completed_at IS NULL")
+    cur.execute("CREATE TABLE IF NOT EXISTS todos_archive LIKE todos")
+    _add_column(cur, "todos_archive", "archived_at",
+                "ALTER TABLE todos_archive ADD COLUMN archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP")
+    conn.commit()
+    cur.close()
+
+_archive_ready = False
+_archive_lock = threading.Lock()
+
+@app.before_request
+def _ensure_archive_schema():
+    # 列表 / 完成 / 編輯 / 匯入都會用到 completed_at：既有資料庫沒跑過 init-archive 也能直接用
+    global _archive_ready
+    if _archive_ready:
+        return
+    with _archive_lock:
+        if not _archive_ready:
+            ensure_archive_schema()
+            _archive_ready = True
+
+@app.cli.command("init-archive")
+def init_archive_command():
+    """todos 加 completed_at、建立 todos_archive（第一個請求也會自動做）"""
+    ensure_archive_schema()
+    print("todos_archive ready")
+
+@app.cli.command("archive-done")
+@click.option("--days", default=ARCHIVE_AFTER_DAYS, show_default=True, help="完成超過幾天才封存")
+@click.option("--batch", default=1000, show_default=True, help="每個交易搬幾筆")
+@click.option("--pause", default=0.1, show_default=True, help="批次之間暫停秒數（讓複寫與其他交易跟上）")
+def archive_done_command(days, batch, pause):
+    """分批把舊的已完成待辦搬到 todos_archive，每批一個交易"""
+    conn = mysql.connection
+    cur = conn.cursor()
+    total = 0
+    try:
+        while True:
+            cur.execute(
+                "SELECT id FROM todos WHERE status='完成' AND completed_at < NOW() - INTERVAL %s DAY "
+                "ORDER BY id LIMIT %s FOR UPDATE",
+                (days, batch)
+            )
+            ids = [r["id"] for r in cur.fetchall()]
+            if not ids:
+                conn.commit()
+                break
+            marks = ", ".join(["%s"] * len(ids))
+            cur.execute(
+                f"INSERT INTO todos_archive ({ARCHIVE_COLUMNS}) "
+                f"SELECT {ARCHIVE_COLUMNS} FROM todos WHERE id IN ({marks})",
+                ids
+            )
+            cur.execute(f"DELETE FROM todos WHERE id IN ({marks})", ids)
+            conn.commit()
+            total += len(ids)
+            print(f"archived {total} todos")
+            if len(ids) < batch:
+                break
+            time.sleep(pause)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    print(f"done: {total} todos archived")
+
 if __name__ == "__main__":
     app.run(debug=True)
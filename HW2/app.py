@@ -1,12 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, Response, stream_with_context
+from flask import get_template_attribute
+import click
 
 # 讓 flask_mysqldb 使用 PyMySQL
 import pymysql
 pymysql.install_as_MySQLdb()
 from flask_mysqldb import MySQL
 
+from contextlib import contextmanager
 from functools import wraps
+from collections import Counter
+import csv
+import io
 import os
+import sys
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -26,26 +35,261 @@ app.config.update(
 
 mysql = MySQL(app)
 
+# ---- 請求延遲 / DB 時間指標（/metrics）----
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.init_app(app)
+from shared import profiler  # noqa: E402
+profiler.init_app(app)  # PROFILE_ENABLED=1 時才會掛上（見 shared/profiler.py）
+
+# ---- 讀寫分離：讀取走 MYSQL_REPLICAS 的副本，寫入與寫後讀走主庫（見 shared/db_router.py）----
+from shared import db_router  # noqa: E402
+router = db_router.Router(app, primary=lambda: mysql.connection)
+
+# ---- 列表頁片段快取：版本號為 users.frag_version，寫入時在同一個交易內 bump（見 fragment_cache.py）----
+from fragment_cache import FragmentCache, render_cached  # noqa: E402
+fragments = FragmentCache()
+
+def bump_fragments(cur, uid=None):
+    """在寫入的交易內把使用者的 frag_version +1（uid 為 None＝所有使用者），每個 worker 的片段都跟著失效"""
+    if uid is None:
+        cur.execute("UPDATE users SET frag_version = frag_version + 1")
+    else:
+        cur.execute("UPDATE users SET frag_version = frag_version + 1 WHERE id=%s", (uid,))
+
 # ---------------- 共用 SQL 小工具 ----------------
+@metrics.timed_db
 def query_all(sql, params=None):
-    cur = mysql.connection.cursor()
-    cur.execute(sql, params or ())
-    rows = cur.fetchall()
-    cur.close()
-    return rows
-
+    def run(conn):
+        cur = conn.cursor()
+        cur.execute(sql, params or ())
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    return router.read(run)
+
+@metrics.timed_db
 def query_one(sql, params=None):
-    cur = mysql.connection.cursor()
-    cur.execute(sql, params or ())
-    row = cur.fetchone()
-    cur.close()
-    return row
-
+    def run(conn):
+        cur = conn.cursor()
+        cur.execute(sql, params or ())
+        row = cur.fetchone()
+        cur.close()
+        return row
+    return router.read(run)
+
+@metrics.timed_db
 def exec_sql(sql, params=None):
     cur = mysql.connection.cursor()
     cur.execute(sql, params or ())
     mysql.connection.commit()
     cur.close()
+    router.mark_write()
+
+# 多個寫入放在同一個交易：成功才 commit，出錯全部 rollback
+@contextmanager
+def transaction():
+    conn = mysql.connection
+    cur = conn.cursor()
+    t0 = time.perf_counter()
+    try:
+        yield cur
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        metrics.add_db_time(time.perf_counter() - t0, "mysql")
+    router.mark_write()
+
+# ---------------- 任務計數（task_counters） ----------------
+# 每位使用者 ×（分類, 狀態）一列 n，跟 tasks 的寫入在同一個交易內增減，
+# 列表頁的分類徽章 / 摘要只要讀這幾列，不必每次 COUNT(*) GROUP BY 整個 tasks。
+# 沒分類的任務 category_id 記成 0。表不存在時第一個請求會建立並由 tasks 算出初值；
+# 懷疑不一致時：flask --app app reconcile-counters
+COUNTERS_DDL = (
+    "CREATE TABLE IF NOT EXISTS {table} ("
+    "  user_id INT NOT NULL,"
+    "  category_id INT NOT NULL DEFAULT 0,"
+    "  status VARCHAR(20) NOT NULL,"
+    "  n INT NOT NULL DEFAULT 0,"
+    "  PRIMARY KEY (user_id, category_id, status)"
+    ")"
+)
+COUNTERS_FILL = (
+    "INSERT INTO {table} (user_id, category_id, status, n) "
+    "SELECT user_id, COALESCE(category_id, 0), status, COUNT(*) FROM tasks "
+    "GROUP BY user_id, COALESCE(category_id, 0), status"
+)
+
+def _has_table(cur, table):
+    cur.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s",
+        (table,)
+    )
+    return cur.fetchone() is not None
+
+COUNTERS_LOCK = "todo_counters"
+COUNTERS_LOCK_TIMEOUT = 30
+
+def ensure_counters_schema():
+    """
+    task_counters 不存在就建立並填入初值；可重複執行。
+    CREATE TABLE 會隱含 commit：表一出現，其他 worker 的 add_counters 就可能在填初值之前寫進去（重複計）。
+    所以以 GET_LOCK 讓各 worker 排隊，在暫存表建好、填完後才 RENAME TABLE 換上（原子操作），
+    task_counters 一出現就已經是完整的初值。
+    """
+    with transaction() as cur:
+        if _has_table(cur, "task_counters"):
+            return
+        cur.execute("SELECT GET_LOCK(%s, %s) AS ok", (COUNTERS_LOCK, COUNTERS_LOCK_TIMEOUT))
+        if cur.fetchone()["ok"] != 1:
+            raise RuntimeError(f"等不到 {COUNTERS_LOCK} 鎖（{COUNTERS_LOCK_TIMEOUT} 秒）")
+        try:
+            if _has_table(cur, "task_counters"):  # 等鎖期間其他 worker 已建好
+                return
+            cur.execute("DROP TABLE IF EXISTS task_counters_new")  # 上次建到一半中斷留下的
+            cur.execute(COUNTERS_DDL.format(table="task_counters_new"))
+            cur.execute(COUNTERS_FILL.format(table="task_counters_new"))
+            cur.execute("RENAME TABLE task_counters_new TO task_counters")
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (COUNTERS_LOCK,))
+
+def add_counters(cur, uid, deltas):
+    """deltas：{(category_id, status): 增減量}，0 的略過"""
+    rows = [(uid, cat_id or 0, status, d, d) for (cat_id, status), d in deltas.items() if d]
+    if rows:
+        cur.executemany(
+            "INSERT INTO task_counters (user_id, category_id, status, n) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE n = n + %s",
+            rows
+        )
+
+def get_counters(uid):
+    """回傳 {category_id: {"open": 未完成數, "done": 完成數}}，另有 "all" 為總計"""
+    out = {"all": {"open": 0, "done": 0}}
+    for r in query_all("SELECT category_id, status, n FROM task_counters WHERE user_id=%s", [uid]):
+        kind = "done" if r["status"] == "完成" else "open"
+        out.setdefault(r["category_id"], {"open": 0, "done": 0})[kind] += r["n"]
+        out["all"][kind] += r["n"]
+    return out
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_command():
+    """由 tasks 重建 task_counters（不存在會先建立）：flask --app app reconcile-counters"""
+    with transaction() as cur:
+        cur.execute(COUNTERS_DDL.format(table="task_counters"))
+        cur.execute("DELETE FROM task_counters")
+        cur.execute(COUNTERS_FILL.format(table="task_counters"))
+        bump_fragments(cur)
+        cur.execute("SELECT COUNT(*) AS n FROM task_counters")
+        print(f"task_counters: {cur.fetchone()['n']} rows rebuilt")
+
+# ---------------- 封存已完成的任務（tasks → tasks_archive） ----------------
+# 完成且 updated_at 超過 ARCHIVE_AFTER_DAYS 天的任務搬到 tasks_archive，讓 tasks 與其索引只留未完成 + 近期完成；
+# 列表頁預設也只顯示這些，?view=archive 才查封存表。
+# tasks_archive 在每個行程的第一個請求時自動建立（冪等；也可以部署時先跑 flask --app app init-archive），
+# 之後排程（例如每天）flask --app app archive-done。
+# task_counters 只計 tasks，搬走時在同一個交易內扣掉。
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_VIEW_LIMIT = 500
+ARCHIVE_COLUMNS = "id, task, status, note, user_id, category_id, updated_at"
+
+def _has_column(cur, table, column):
+    cur.execute(
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s",
+        (table, column)
+    )
+    return cur.fetchone() is not None
+
+def ensure_archive_schema():
+    """建立 tasks_archive（欄位同 tasks，另加 archived_at）；可重複執行"""
+    with transaction() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS tasks_archive LIKE tasks")
+        if not _has_column(cur, "tasks_archive", "archived_at"):
+            try:
+                cur.execute(
+                    "ALTER TABLE tasks_archive "
+                    "ADD COLUMN archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                    "ADD INDEX idx_archive_user (user_id, updated_at)"
+                )
+            except pymysql.MySQLError:
+                # 其他 worker 同時加好了（重複欄位）就當作成功
+                if not _has_column(cur, "tasks_archive", "archived_at"):
+                    raise
+
+def ensure_fragment_schema():
+    """users.frag_version（片段快取的版本號）；可重複執行"""
+    with transaction() as cur:
+        if not _has_column(cur, "users", "frag_version"):
+            try:
+                cur.execute("ALTER TABLE users ADD COLUMN frag_version INT NOT NULL DEFAULT 0")
+            except pymysql.MySQLError:
+                if not _has_column(cur, "users", "frag_version"):
+                    raise
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+@app.before_request
+def _ensure_schema():
+    # 列表頁的封存連結一直都在：既有資料庫沒跑過 init-archive / reconcile-counters 時也不會 500
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            ensure_fragment_schema()
+            ensure_counters_schema()
+            ensure_archive_schema()
+            _schema_ready = True
+
+@app.cli.command("init-archive")
+def init_archive_command():
+    """建立 tasks_archive（第一個請求也會自動做）：flask --app app init-archive"""
+    ensure_archive_schema()
+    print("tasks_archive ready")
+
+@app.cli.command("archive-done")
+@click.option("--days", default=ARCHIVE_AFTER_DAYS, show_default=True, help="完成超過幾天才封存")
+@click.option("--batch", default=1000, show_default=True, help="每個交易搬幾筆")
+@click.option("--pause", default=0.1, show_default=True, help="批次之間暫停秒數（讓複寫與其他交易跟上）")
+def archive_done_command(days, batch, pause):
+    """分批把舊的已完成任務搬到 tasks_archive：flask --app app archive-done"""
+    total = 0
+    while True:
+        with transaction() as cur:
+            cur.execute(
+                "SELECT id, user_id, category_id, status FROM tasks "
+                "WHERE status='完成' AND updated_at < NOW() - INTERVAL %s DAY "
+                "ORDER BY id LIMIT %s FOR UPDATE",
+                (days, batch)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            ids = [r["id"] for r in rows]
+            marks = ", ".join(["%s"] * len(ids))
+            cur.execute(
+                f"INSERT INTO tasks_archive ({ARCHIVE_COLUMNS}) "
+                f"SELECT {ARCHIVE_COLUMNS} FROM tasks WHERE id IN ({marks})",
+                ids
+            )
+            cur.execute(f"DELETE FROM tasks WHERE id IN ({marks})", ids)
+            by_user = {}
+            for r in rows:
+                by_user.setdefault(r["user_id"], Counter())[(r["category_id"], r["status"])] -= 1
+            for uid, deltas in by_user.items():
+                add_counters(cur, uid, deltas)
+                bump_fragments(cur, uid)
+        total += len(rows)
+        print(f"archived {total} tasks")
+        if len(rows) < batch:
+            break
+        time.sleep(pause)
+    print(f"done: {total} tasks archived")
 
 # 依分類名稱取得 id（沒有就回 None）
 def get_category_id_by_name(name: str):
@@ -69,7 +313,10 @@ def load_current_user():
     g.user = None
     uid = session.get("user_id")
     if uid:
-        g.user = query_one("SELECT id, username FROM users WHERE id=%s", [uid])
+        # 每個請求都以主鍵查一次 users，帳號被刪除或改名時立即生效（片段快取命中時也只剩這一個查詢）
+        g.user = query_one("SELECT id, username, frag_version FROM users WHERE id=%s", [uid])
+        if g.user is None:
+            session.clear()  # 帳號已不存在：當作登出，login_required 會導回登入頁
 
 # ===================== 使用者：註冊 / 登入 / 登出 =====================
 # 說明：按你的要求，這裡密碼改為「明文」存放 users.password
@@ -138,35 +385,56 @@ def logout():
 @app.route("/")
 @login_required
 def index():
-    # 允許以 ?category=school/work/other 篩選
+    # 允許以 ?category=school/work/other 篩選；?view=archive 看已封存的任務
     category_name = request.args.get("category")
-    params = [g.user["id"]]
-
-    base_sql = (
-        "SELECT "
-        "  t.id, t.task, t.status, t.note, "
-        "  COALESCE(c.name, 'uncategorized') AS category_name, "
-        "  t.updated_at "
-        "FROM tasks AS t "
-        "INNER JOIN users AS u ON u.id = t.user_id "        # 作業要求：示範 JOIN
-        "LEFT JOIN categories AS c ON c.id = t.category_id " # LEFT JOIN：即使沒分類也顯示
-        "WHERE t.user_id = %s "
-    )
+    archived = request.args.get("view") == "archive"
+    uid = g.user["id"]
+
+    def render_tasks():
+        params = [uid]
+        base_sql = (
+            "SELECT "
+            "  t.id, t.task, t.status, t.note, "
+            "  COALESCE(c.name, 'uncategorized') AS category_name, "
+            "  t.updated_at "
+            f"FROM {'tasks_archive' if archived else 'tasks'} AS t "
+            "INNER JOIN users AS u ON u.id = t.user_id "        # 作業要求：示範 JOIN
+            "LEFT JOIN categories AS c ON c.id = t.category_id " # LEFT JOIN：即使沒分類也顯示
+            "WHERE t.user_id = %s "
+        )
 
-    if category_name:
-        base_sql += "AND c.name = %s "
-        params.append(category_name)
+        if not archived:
+            # 預設：未完成 + 近期完成（還沒被 archive-done 搬走的舊完成任務也不顯示）
+            base_sql += "AND (t.status <> '完成' OR t.updated_at >= NOW() - INTERVAL %s DAY) "
+            params.append(ARCHIVE_AFTER_DAYS)
 
-    base_sql += "ORDER BY t.id DESC"
+        if category_name:
+            base_sql += "AND c.name = %s "
+            params.append(category_name)
 
-    todos = query_all(base_sql, params)
+        base_sql += "ORDER BY t.id DESC"
+        if archived:
+            base_sql += f" LIMIT {ARCHIVE_VIEW_LIMIT}"
 
-    # 供頁面選單使用
-    cats = query_all(
-        "SELECT id, name FROM categories WHERE user_id=%s ORDER BY id",
-        [g.user["id"]]
-    )
-    return render_template("index.html", todos=todos, categories=cats, category=category_name)
+        todos = query_all(base_sql, params)
+        return get_template_attribute("_fragments.html", "task_table")(todos, archived)
+
+    def render_categories():
+        # 供頁面選單使用
+        cats = query_all(
+            "SELECT id, name FROM categories WHERE user_id=%s ORDER BY id",
+            [uid]
+        )
+        counts = get_counters(uid)
+        return (get_template_attribute("_fragments.html", "category_options")(cats, category_name),
+                get_template_attribute("_fragments.html", "category_chips")(cats, category_name, counts))
+
+    # 沒有寫入過的重新整理直接用快取好的 HTML，只有 load_current_user 那一個查詢；封存表最多 500 列、不快取
+    key, ver = category_name or "", g.user["frag_version"]
+    task_table = render_tasks() if archived else render_cached(fragments, uid, ver, ("tasks", key), render_tasks)
+    options, chips = render_cached(fragments, uid, ver, ("categories", key), render_categories)
+    return render_template("index.html", task_table=task_table, archived=archived,
+                           category_options=options, category_chips=chips, category=category_name)
 
 @app.route("/add_category", methods=["POST"])
 @login_required
@@ -184,10 +452,12 @@ def add_category():
         flash("此分類已存在")
         return redirect(url_for("index"))
 
-    exec_sql(
-        "INSERT INTO categories (name, user_id) VALUES (%s, %s)",
-        [name, g.user["id"]]
-    )
+    with transaction() as cur:
+        cur.execute(
+            "INSERT INTO categories (name, user_id) VALUES (%s, %s)",
+            [name, g.user["id"]]
+        )
+        bump_fragments(cur, g.user["id"])
     flash(f"成功新增分類：{name}")
     return redirect(url_for("index"))
 
@@ -203,23 +473,45 @@ def add():
         return redirect(url_for("index"))
 
     cat_id = get_category_id_by_name(category_name)
-    exec_sql(
-        "INSERT INTO tasks (task, status, note, user_id, category_id) VALUES (%s, %s, %s, %s, %s)",
-        (task, status, note, g.user["id"], cat_id)
-    )
+    with transaction() as cur:
+        cur.execute(
+            "INSERT INTO tasks (task, status, note, user_id, category_id) VALUES (%s, %s, %s, %s, %s)",
+            (task, status, note, g.user["id"], cat_id)
+        )
+        add_counters(cur, g.user["id"], {(cat_id, status): 1})
+        bump_fragments(cur, g.user["id"])
     return redirect(url_for("index", category=category_name) if category_name else url_for("index"))
 
 @app.route("/complete/<int:task_id>")
 @login_required
 def complete(task_id):
-    # 僅能操作自己的任務
-    exec_sql("UPDATE tasks SET status='完成' WHERE id=%s AND user_id=%s", (task_id, g.user["id"]))
+    # 僅能操作自己的任務；先鎖住該列取得原本的分類 / 狀態，計數才不會被同時的請求算兩次
+    with transaction() as cur:
+        cur.execute(
+            "SELECT category_id, status FROM tasks WHERE id=%s AND user_id=%s FOR UPDATE",
+            (task_id, g.user["id"])
+        )
+        old = cur.fetchone()
+        if old and old["status"] != "完成":
+            cur.execute("UPDATE tasks SET status='完成' WHERE id=%s", (task_id,))
+            add_counters(cur, g.user["id"], {(old["category_id"], old["status"]): -1,
+                                             (old["category_id"], "完成"): 1})
+            bump_fragments(cur, g.user["id"])
     return redirect(url_for("index"))
 
 @app.route("/delete/<int:task_id>")
 @login_required
 def delete(task_id):
-    exec_sql("DELETE FROM tasks WHERE id=%s AND user_id=%s", (task_id, g.user["id"]))
+    with transaction() as cur:
+        cur.execute(
+            "SELECT category_id, status FROM tasks WHERE id=%s AND user_id=%s FOR UPDATE",
+            (task_id, g.user["id"])
+        )
+        old = cur.fetchone()
+        if old:
+            cur.execute("DELETE FROM tasks WHERE id=%s", (task_id,))
+            add_counters(cur, g.user["id"], {(old["category_id"], old["status"]): -1})
+            bump_fragments(cur, g.user["id"])
     return redirect(url_for("index"))
 
 # 編輯頁：GET 顯示、POST 儲存
@@ -233,11 +525,22 @@ def edit(task_id):
         note = request.form.get("note", "").strip()
         cat_id = get_category_id_by_name(category_name)
 
-        exec_sql(
-            "UPDATE tasks SET task=%s, status=%s, note=%s, category_id=%s "
-            "WHERE id=%s AND user_id=%s",
-            (task, status, note, cat_id, task_id, g.user["id"])
-        )
+        with transaction() as cur:
+            cur.execute(
+                "SELECT category_id, status FROM tasks WHERE id=%s AND user_id=%s FOR UPDATE",
+                (task_id, g.user["id"])
+            )
+            old = cur.fetchone()
+            if old:
+                cur.execute(
+                    "UPDATE tasks SET task=%s, status=%s, note=%s, category_id=%s WHERE id=%s",
+                    (task, status, note, cat_id, task_id)
+                )
+                # 換分類或改狀態：舊的格子 -1、新的格子 +1（沒變時兩者抵銷）
+                deltas = Counter({(old["category_id"] or 0, old["status"]): -1})
+                deltas[(cat_id or 0, status)] += 1
+                add_counters(cur, g.user["id"], deltas)
+                bump_fragments(cur, g.user["id"])
         flash("已更新任務")
         return redirect(url_for("index", category=category_name) if category_name else url_for("index"))
 
@@ -264,10 +567,137 @@ def edit(task_id):
 @login_required
 def update_note(task_id):
     note = request.form.get("note", "").strip()
-    exec_sql("UPDATE tasks SET note=%s WHERE id=%s AND user_id=%s", (note, task_id, g.user["id"]))
+    with transaction() as cur:
+        cur.execute("UPDATE tasks SET note=%s WHERE id=%s AND user_id=%s", (note, task_id, g.user["id"]))
+        if cur.rowcount:
+            bump_fragments(cur, g.user["id"])
     flash("備註已更新")
     category_name = request.args.get("category")
     return redirect(url_for("index", category=category_name) if category_name else url_for("index"))
 
+# ===================== 匯出 / 匯入 CSV =====================
+# 匯出：SSCursor（伺服器端、不緩衝的游標）邊讀邊寫，每 EXPORT_CHUNK 列送出一段，記憶體用量與任務數無關
+# 匯入：每 IMPORT_BATCH 列一次 executemany（PyMySQL 會改寫成多列 INSERT），整份檔案同一個交易
+EXPORT_FIELDS = ["id", "task", "category", "status", "note", "updated_at"]
+EXPORT_CHUNK = 500
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))
+
+@app.route("/export.csv")
+@login_required
+def export_csv():
+    uid = g.user["id"]
+
+    def gen():
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        buf.write("\ufeff")  # BOM：讓 Excel 以 UTF-8 開啟中文
+        w.writerow(EXPORT_FIELDS)
+        yield buf.getvalue()
+
+        cur = router.connection().cursor(pymysql.cursors.SSCursor)
+        try:
+            cur.execute(
+                "SELECT t.id, t.task, COALESCE(c.name, ''), t.status, t.note, t.updated_at "
+                "FROM tasks t "
+                "LEFT JOIN categories c ON c.id = t.category_id "
+                "WHERE t.user_id = %s ORDER BY t.id",
+                [uid]
+            )
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                buf.seek(0)
+                buf.truncate()
+                w.writerows(rows)
+                yield buf.getvalue()
+        finally:
+            cur.close()  # 沒讀完（用戶端中斷）也會把剩下的結果丟掉，連線才能再用
+
+    # stream_with_context：產生器執行期間保留請求 / app context（mysql.connection 掛在上面）
+    return Response(
+        stream_with_context(gen()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=tasks.csv"},
+    )
+
+@metrics.timed_db
+def import_batch(cur, uid, batch):
+    """一批 CSV 列寫入 tasks：分類名稱一次查完，不存在的先建立（同一交易）。"""
+    names = sorted({r["category"] for r in batch if r["category"]})
+    cat_ids = {}
+    if names:
+        marks = ", ".join(["%s"] * len(names))
+        cur.execute(
+            f"SELECT id, name FROM categories WHERE user_id=%s AND name IN ({marks})",
+            [uid, *names]
+        )
+        cat_ids = {row["name"]: row["id"] for row in cur.fetchall()}
+        missing = [n for n in names if n not in cat_ids]
+        if missing:
+            cur.executemany(
+                "INSERT INTO categories (name, user_id) VALUES (%s, %s)",
+                [(n, uid) for n in missing]
+            )
+            cur.execute(
+                f"SELECT id, name FROM categories WHERE user_id=%s AND name IN ({marks})",
+                [uid, *names]
+            )
+            cat_ids = {row["name"]: row["id"] for row in cur.fetchall()}
+
+    cur.executemany(
+        "INSERT INTO tasks (task, status, note, user_id, category_id) VALUES (%s, %s, %s, %s, %s)",
+        [(r["task"], r["status"], r["note"], uid, cat_ids.get(r["category"])) for r in batch]
+    )
+    add_counters(cur, uid, Counter((cat_ids.get(r["category"]), r["status"]) for r in batch))
+
+@app.route("/import", methods=["POST"])
+@login_required
+def import_csv():
+    f = request.files.get("file")
+    if not f or not f.filename:
+        flash("請選擇 CSV 檔")
+        return redirect(url_for("index"))
+
+    # 欄位同匯出（id、updated_at 會被忽略）；至少要有 task 欄
+    reader = csv.DictReader(io.TextIOWrapper(f.stream, encoding="utf-8-sig", newline=""))
+    if "task" not in (reader.fieldnames or []):
+        flash("CSV 缺少 task 欄位")
+        return redirect(url_for("index"))
+
+    conn = mysql.connection
+    cur = conn.cursor()
+    total, batch = 0, []
+    try:
+        for row in reader:
+            task = (row.get("task") or "").strip()
+            if not task:
+                continue
+            batch.append({
+                "task": task,
+                "category": (row.get("category") or "").strip().lower(),  # 與 add_category 一致用小寫
+                "status": (row.get("status") or "").strip() or "未完成",
+                "note": (row.get("note") or "").strip(),
+            })
+            if len(batch) >= IMPORT_BATCH:
+                import_batch(cur, g.user["id"], batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            import_batch(cur, g.user["id"], batch)
+            total += len(batch)
+        bump_fragments(cur, g.user["id"])
+        conn.commit()
+        router.mark_write()
+    except (UnicodeDecodeError, csv.Error, pymysql.MySQLError) as e:
+        conn.rollback()
+        flash(f"匯入失敗，已全部取消：{e}")
+        return redirect(url_for("index"))
+    finally:
+        cur.close()
+
+    flash(f"已匯入 {total} 筆任務")
+    return redirect(url_for("index"))
+
 if __name__ == "__main__":
     app.run(debug=True)
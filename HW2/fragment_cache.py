@@ -0,0 +1,96 @@
+# fragment_cache.py — 列表頁的片段快取（已渲染的任務表格、分類選單）
+#
+# 每位使用者一個版本號，存在 MySQL 的 users.frag_version：所有會改到列表頁的寫入（app.py 的
+# add / edit / complete / delete / update_note / add_category / import、archive-done 與 reconcile-counters）
+# 都在同一個交易內 +1，load_current_user 每個請求查 users 時一併取回，所以多個 worker 之間也一致。
+# 快取鍵含版本號，所以「渲染到一半時有人寫入」的結果會存在舊鍵下、不會再被讀到。
+# 存入較新版本的片段時，順手刪掉該使用者舊版本的片段，其餘靠 LRU 淘汰，總大小不超過 max_bytes。
+#
+# 設定（.env）：
+#   FRAGMENT_CACHE_MAX_BYTES=33554432    全部片段的大小上限（UTF-8 位元組）
+#   FRAGMENT_CACHE_MAX_ENTRIES=10000     片段數上限
+#   FRAGMENT_CACHE_TTL=0                 片段存活秒數；0＝只靠版本號失效
+#
+# 片段本身在行程記憶體內（每個 worker 各存一份），版本號在資料庫，寫入後每個 worker 都立即失效。
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=None, max_entries=None, ttl=None):
+        self.max_bytes = int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(32 << 20))) if max_bytes is None else max_bytes
+        self.max_entries = int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "10000")) if max_entries is None else max_entries
+        self.ttl = float(os.getenv("FRAGMENT_CACHE_TTL", "0")) if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (value, size, 到期時間)
+        self._by_user = {}           # uid -> set((uid, key))；key[0] 為版本號
+        self.size = 0
+        self.hits = self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def forget(self, uid):
+        """丟掉使用者的所有片段（只釋放本行程的記憶體；失效靠版本號）。"""
+        with self._lock:
+            for key in self._by_user.pop(uid, ()):
+                self._drop(key)
+
+    def get(self, uid, key):
+        k = (uid, key)
+        with self._lock:
+            item = self._items.get(k)
+            if item is None or (item[2] and item[2] < time.monotonic()):
+                self.misses += 1
+                return None
+            self._items.move_to_end(k)
+            self.hits += 1
+            return item[0]
+
+    def put(self, uid, key, value, size):
+        """value 可以是字串或字串 tuple；size 為 UTF-8 位元組數。超過上限八分之一的片段不存。"""
+        if not self.enabled or size > self.max_bytes // 8:
+            return
+        k = (uid, key)
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            mine = self._by_user.setdefault(uid, set())
+            for old in [o for o in mine if o[1][0] < key[0]]:  # 舊版本的片段不會再被讀到
+                mine.discard(old)
+                self._drop(old)
+            self._drop(k)
+            self._items[k] = (value, size, expires)
+            mine.add(k)
+            self.size += size
+            while self._items and (self.size > self.max_bytes or len(self._items) > self.max_entries):
+                old, _ = next(iter(self._items.items()))
+                self._drop(old)
+                keys = self._by_user.get(old[0])
+                if keys is not None:
+                    keys.discard(old)
+                    if not keys:
+                        del self._by_user[old[0]]
+
+    def _drop(self, k):
+        item = self._items.pop(k, None)
+        if item is not None:
+            self.size -= item[1]
+
+
+def render_cached(cache, uid, version, name, render):
+    """
+    取片段 name（tuple，例如 ("tasks", 分類)；鍵另外加上 version＝users.frag_version），
+    沒有就呼叫 render() 產生並存起來。render() 回傳字串或字串 tuple；cache 關閉時直接渲染。
+    """
+    if not cache.enabled:
+        return render()
+    key = (version, *name)
+    value = cache.get(uid, key)
+    if value is None:
+        value = render()
+        parts = value if isinstance(value, tuple) else (value,)
+        cache.put(uid, key, value, sum(len(p.encode("utf-8")) for p in parts))
+    return value
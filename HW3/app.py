@@ -11,6 +11,7 @@ from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
 import os
+import sys
 import json
 import csv
 import io
@@ -19,9 +20,17 @@ import io
 app = Flask(__name__, template_folder="templates")
 CORS(app)
 
+# --- 請求延遲 / DB 時間指標（/metrics）---
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import metrics  # noqa: E402
+metrics.install_pymongo_listener()  # 要在建立 MongoClient 之前
+metrics.init_app(app)
+from shared import profiler  # noqa: E402
+profiler.init_app(app)  # PROFILE_ENABLED=1 時才會掛上（見 shared/profiler.py）
+
 # --- MongoDB 連線設定 ---
 MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/")
-client = MongoClient(MONGODB_URI)
+client = MongoClient(MONGODB_URI, connect=False)  # 第一次查詢才連線：shared/serve.py preload 後 fork 也安全
 db = client["travel_journal"]        # 資料庫名稱
 collection = db["trips"]             # 集合名稱
 
@@ -0,0 +1 @@
+# 各作業 app 共用的小工具（metrics、db_router 等），app.py 以 sys.path 加入 repo 根目錄後匯入
@@ -0,0 +1,271 @@
+# bench_read_replicas.py — db_router 讀取吞吐量隨副本數的變化，以及寫後讀 / 故障轉移檢查
+#
+#   python shared/bench/bench_read_replicas.py
+#   python shared/bench/bench_read_replicas.py --replicas 0,1,2,4 --threads 32 --duration 5
+#   python shared/bench/bench_read_replicas.py --service-ms 2 --slots 8
+#
+# 不需要 MySQL：每台「伺服器」是一個 SQLite 檔案（副本為主庫檔案的複本），
+# 外加一個容量模型——同時最多 --slots 個查詢、每個查詢額外花 --service-ms（sleep 會放開 GIL），
+# 用來代表一台 MySQL 的固定處理能力；否則同一個行程內的 SQLite 看不出多台機器的差別。
+# 查詢與 HW2 的 index() 相同（tasks JOIN users LEFT JOIN categories，取一位使用者的任務）。
+#
+# 輸出：每個副本數的 reads/s、p50 / p99 延遲、主庫承擔的讀取比例；
+# 之後驗證 (1) 寫入後同 session 的讀取走主庫 (2) 副本掛掉時讀取照常成功並改走其他台 / 主庫。
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+from flask import Flask, g, session  # noqa: E402
+
+from shared.db_router import Router  # noqa: E402
+
+INDEX_SQL = (
+    "SELECT t.id, t.task, t.status, t.note, COALESCE(c.name, 'uncategorized') AS category_name, t.updated_at "
+    "FROM tasks AS t "
+    "INNER JOIN users AS u ON u.id = t.user_id "
+    "LEFT JOIN categories AS c ON c.id = t.category_id "
+    "WHERE t.user_id = %s ORDER BY t.id DESC"
+)
+
+
+class StandIn:
+    """一台資料庫伺服器的替身：SQLite 檔案 + 同時處理數上限 + 每個查詢的固定處理時間。"""
+
+    def __init__(self, name, path, slots, service_ms):
+        self.name = name
+        self.path = path
+        self.sem = threading.BoundedSemaphore(slots)
+        self.service = service_ms / 1000
+        self.down = False
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        if self.down:
+            raise ConnectionRefusedError(f"{self.name} is down")
+        return _Conn(self)
+
+
+class _Conn:
+    def __init__(self, server):
+        self.server = server
+        self.db = sqlite3.connect(server.path, check_same_thread=False)
+
+    def cursor(self, cls=None):
+        return _Cursor(self)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class _Cursor:
+    # 轉成 MySQL 風格：%s 參數、DictCursor 的 dict 列
+    def __init__(self, conn):
+        self.conn = conn
+        self.cur = conn.db.cursor()
+
+    def execute(self, sql, params=()):
+        server = self.conn.server
+        if server.down:
+            raise ConnectionResetError(f"{server.name} went away")
+        with server.sem:
+            time.sleep(server.service)
+            self.cur.execute(sql.replace("%s", "?"), tuple(params))
+        with server._lock:
+            server.queries += 1
+
+    def _row(self, r):
+        return None if r is None else {d[0]: v for d, v in zip(self.cur.description, r)}
+
+    def fetchall(self):
+        return [self._row(r) for r in self.cur.fetchall()]
+
+    def fetchone(self):
+        return self._row(self.cur.fetchone())
+
+    def close(self):
+        self.cur.close()
+
+
+def seed(path, users, tasks_per_user):
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password TEXT);
+        CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT, user_id INT);
+        CREATE TABLE tasks (id INTEGER PRIMARY KEY, task TEXT, status TEXT, note TEXT,
+                            user_id INT, category_id INT, updated_at TEXT DEFAULT CURRENT_TIMESTAMP);
+        CREATE INDEX idx_tasks_user ON tasks (user_id, id);
+    """)
+    rnd = random.Random(0)
+    db.executemany("INSERT INTO users VALUES (?, ?, 'x')", [(u, f"user{u}") for u in range(1, users + 1)])
+    cats = [(None, n, u) for u in range(1, users + 1) for n in ("school", "work", "other")]
+    db.executemany("INSERT INTO categories VALUES (?, ?, ?)", cats)
+    db.executemany(
+        "INSERT INTO tasks (task, status, note, user_id, category_id) VALUES (?, ?, '', ?, ?)",
+        [(f"task {i}", rnd.choice(["未完成", "完成"]), u, (u - 1) * 3 + rnd.randint(1, 3))
+         for u in range(1, users + 1) for i in range(tasks_per_user)],
+    )
+    db.commit()
+    db.close()
+
+
+def make_app(primary, replicas, ryw_sec=5.0, retry_sec=30.0):
+    app = Flask(__name__)
+    app.secret_key = "bench"
+    servers = {("standin", i): s for i, s in enumerate(replicas)}
+
+    def primary_conn():
+        if "_bench_primary" not in g:
+            g._bench_primary = primary.connect()
+        return g._bench_primary
+
+    @app.teardown_appcontext
+    def _close(exc):
+        conn = g.pop("_bench_primary", None)
+        if conn:
+            conn.close()
+
+    router = Router(app, primary=primary_conn, replicas=list(servers),
+                    connect=lambda r: servers[r].connect(), ryw_sec=ryw_sec, retry_sec=retry_sec)
+    return app, router
+
+
+def read_index(router, uid):
+    def run(conn):
+        cur = conn.cursor()
+        cur.execute(INDEX_SQL, [uid])
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    return router.read(run)
+
+
+def run_level(app, router, users, threads, duration):
+    lat, lock = [], threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        rnd, mine = random.Random(), []
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            with app.test_request_context("/"):  # 每次讀取模擬一個請求（各自的 g 與 session）
+                read_index(router, rnd.randint(1, users))
+                app.do_teardown_appcontext()
+            mine.append(time.perf_counter() - t0)
+        with lock:
+            lat.extend(mine)
+
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    lat.sort()
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1e3  # noqa: E731
+    return len(lat) / duration, p(0.50), p(0.99)
+
+
+def check_read_your_writes(primary, replica):
+    app, router = make_app(primary, [replica])
+    with app.test_request_context("/"):
+        before = primary.queries
+        read_index(router, 1)
+        assert primary.queries == before, "讀取應走副本"
+        conn = router.primary()
+        cur = conn.cursor()
+        cur.execute("INSERT INTO tasks (task, status, note, user_id) VALUES (%s, %s, '', %s)", ["new", "未完成", 1])
+        conn.commit()
+        router.mark_write()
+        rows = read_index(router, 1)
+        assert primary.queries == before + 2 and rows[0]["task"] == "new", "寫入後的讀取應走主庫"
+        saved = dict(session)
+    # 下一個請求帶著同一個 session：仍在 read-your-writes 期間內
+    with app.test_request_context("/"):
+        session.update(saved)
+        before = primary.queries
+        read_index(router, 1)
+        assert primary.queries == before + 1, "同 session 寫後讀應走主庫"
+    print("read-your-writes: ok（寫入後同請求與同 session 的讀取都走主庫）")
+
+
+def check_failover(primary, replicas):
+    app, router = make_app(primary, replicas, retry_sec=60)
+    replicas[0].down = True
+    served = {s.name: s.queries for s in [primary, *replicas]}
+    for _ in range(20):
+        with app.test_request_context("/"):
+            assert read_index(router, 1)
+            app.do_teardown_appcontext()
+    served = {s.name: s.queries - served[s.name] for s in [primary, *replicas]}
+    for s in replicas:
+        s.down = True
+    with app.test_request_context("/"):
+        before = primary.queries
+        assert read_index(router, 1)
+        assert primary.queries == before + 1, "副本全掛應退回主庫"
+        app.do_teardown_appcontext()
+    for s in replicas:
+        s.down = False
+    print(f"failover: ok（{replicas[0].name} 掛掉時 20 次讀取分布 {served}；副本全掛 → 主庫）")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--replicas", default="0,1,2,4", help="要測的副本數")
+    ap.add_argument("--threads", type=int, default=64)
+    ap.add_argument("--duration", type=float, default=3)
+    ap.add_argument("--slots", type=int, default=4, help="每台伺服器同時處理的查詢數")
+    ap.add_argument("--service-ms", type=float, default=10, help="每個查詢的固定處理時間")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--tasks", type=int, default=50, help="每位使用者的任務數")
+    args = ap.parse_args()
+
+    levels = [int(x) for x in args.replicas.split(",")]
+    tmp = tempfile.mkdtemp(prefix="bench_replicas_")
+    try:
+        base = os.path.join(tmp, "primary.db")
+        seed(base, args.users, args.tasks)
+        paths = [base]
+        for i in range(max(levels + [2])):
+            paths.append(os.path.join(tmp, f"replica{i}.db"))
+            shutil.copy(base, paths[-1])
+
+        def servers(n):
+            return (StandIn("primary", paths[0], args.slots, args.service_ms),
+                    [StandIn(f"replica{i}", paths[i + 1], args.slots, args.service_ms) for i in range(n)])
+
+        print(f"{args.users} users × {args.tasks} tasks, {args.threads} threads, "
+              f"each server {args.slots} slots × {args.service_ms} ms\n")
+        print(f"{'replicas':>8} {'reads/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'primary %':>10}")
+        base_rps = None
+        for n in levels:
+            primary, reps = servers(n)
+            app, router = make_app(primary, reps)
+            rps, p50, p99 = run_level(app, router, args.users, args.threads, args.duration)
+            total = primary.queries + sum(r.queries for r in reps)
+            base_rps = base_rps or rps
+            print(f"{n:8d} {rps:9.0f} {p50:8.1f} {p99:8.1f} {100 * primary.queries / max(total, 1):9.0f}%"
+                  f"   ×{rps / base_rps:.2f}")
+        print()
+
+        primary, reps = servers(2)
+        check_read_your_writes(primary, reps[0])
+        check_failover(primary, reps)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
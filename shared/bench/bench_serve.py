@@ -0,0 +1,116 @@
+# bench_serve.py — 開發伺服器（app.run(debug=True)）與 shared/serve.py（gunicorn preload）的吞吐量比較
+#
+#   python shared/bench/bench_serve.py                                  # HW3 首頁（不需要資料庫）
+#   python shared/bench/bench_serve.py --levels 10,50,200 --duration 10
+#   python shared/bench/bench_serve.py --app 1103test --uri mongodb://127.0.0.1:27017/vitals_bench
+#   python shared/bench/bench_serve.py --workers 1,4,8 --threads 8       # 只比較不同 worker 數
+#
+# 兩種伺服器各啟動一次，以 asyncio 開 N 條 keep-alive 連線不停 GET（poller 與 1103test/bench/bench_async.py 共用）。
+# --app 1103test 時先用 synth 灌資料，輪詢 /api/vitals/<pid>?start=&end=；其他 app 輪詢 --path。
+# 每個併發數回報 req/s、p50 / p99 延遲與錯誤數；最後送 SIGTERM 給 gunicorn，量到全部行程結束的時間。
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, "..", ".."))
+sys.path.insert(0, os.path.join(ROOT, "1103test", "bench"))
+
+from bench_async import START, free_port, run_level  # noqa: E402
+
+DEV_CMD = [sys.executable, "-c",
+           "import os, app; app.app.run(host='127.0.0.1', port=int(os.environ['PORT']), debug=True, use_reloader=False)"]
+SERVE_CMD = [sys.executable, os.path.join(ROOT, "shared", "serve.py")]
+
+
+def start(cmd, cwd, env, port):
+    p = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if p.poll() is not None:
+            raise RuntimeError(f"server exited ({p.returncode}): {' '.join(cmd)}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return p
+        except OSError:
+            time.sleep(0.2)
+    p.kill()
+    raise RuntimeError(f"server did not start: {' '.join(cmd)}")
+
+
+def stop(p, timeout=30):
+    """SIGTERM 後等整個行程群組結束（gunicorn 會等 worker 做完手上的請求），回傳花了幾秒。"""
+    t0 = time.perf_counter()
+    os.killpg(p.pid, signal.SIGTERM)
+    try:
+        p.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(p.pid, signal.SIGKILL)
+        p.wait()
+    return time.perf_counter() - t0
+
+
+def vitals_paths(uri, patients, days):
+    from pymongo import MongoClient
+    from synth import seed_collection
+    db = MongoClient(uri).get_default_database()
+    n = seed_collection(db.vitals, patients, days)
+    print(f"vitals: {n} docs, {patients} patients")
+    paths = []
+    for p in range(patients):
+        day = START + timedelta(days=p % days)
+        s, e = int(day.timestamp() * 1000), int((day + timedelta(days=1)).timestamp() * 1000)
+        paths.append(f"/api/vitals/P{p:05d}?start={s}&end={e}")
+    return paths
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--app", default="HW3", help="app 目錄（HW3 / 1103test / 1027test …）")
+    ap.add_argument("--path", default="/", help="要輪詢的路徑（--app 1103test 時改用 vitals 查詢）")
+    ap.add_argument("--uri", default=os.getenv("MONGO_BENCH_URI", "mongodb://127.0.0.1:27017/vitals_bench"))
+    ap.add_argument("--patients", type=int, default=200)
+    ap.add_argument("--days", type=int, default=7)
+    ap.add_argument("--levels", default="10,50,200", help="併發連線數")
+    ap.add_argument("--duration", type=float, default=5)
+    ap.add_argument("--timeout", type=float, default=5)
+    ap.add_argument("--workers", default=str(os.cpu_count() * 2 + 1), help="serve.py 的 worker 數，可逗號分隔多組")
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--skip-dev", action="store_true")
+    args = ap.parse_args()
+
+    app_dir = os.path.join(ROOT, args.app)
+    paths = vitals_paths(args.uri, args.patients, args.days) if args.app == "1103test" else [args.path]
+    env = dict(os.environ, MONGO_URI=args.uri, MONGODB_URI=args.uri, METRICS_ENABLED="0",
+               WEB_THREADS=str(args.threads))
+    servers = [] if args.skip_dev else [("dev", DEV_CMD, {})]
+    servers += [(f"serve w{w}×t{args.threads}", SERVE_CMD + [args.app], {"WEB_WORKERS": w})
+                for w in args.workers.split(",")]
+    levels = [int(x) for x in args.levels.split(",")]
+
+    print(f"{args.app} {paths[0] if len(paths) == 1 else f'{len(paths)} vitals paths'}, {os.cpu_count()} CPUs\n")
+    print(f"{'server':16} {'conns':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9}  errors")
+    base = {}
+    for name, cmd, extra in servers:
+        port = free_port()
+        proc = start(cmd, app_dir, dict(env, PORT=str(port), WEB_BIND=f"127.0.0.1:{port}", **extra), port)
+        try:
+            for conns in levels:
+                rps, p50, p99, errs = asyncio.run(run_level(port, paths, conns, args.duration, args.timeout))
+                base.setdefault(conns, rps)
+                print(f"{name:16} {conns:6d} {rps:8.0f} {p50:8.1f} {p99:9.1f}  {errs}"
+                      f"   ×{rps / max(base[conns], 1e-9):.2f}")
+        finally:
+            took = stop(proc)
+        print(f"{name:16} SIGTERM → exit {took:.1f}s\n")
+
+
+if __name__ == "__main__":
+    main()
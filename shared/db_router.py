@@ -0,0 +1,181 @@
+# shared/db_router.py — HW1 / HW2 MySQL 小工具的讀寫分離
+#
+# 設定（.env）：
+#   MYSQL_REPLICAS=10.0.0.2:3306,10.0.0.3    讀取副本（帳號 / 密碼 / 資料庫同主庫）；不設＝全部走主庫
+#   MYSQL_READ_YOUR_WRITES_SEC=5             同一 session 寫入後幾秒內的讀取仍走主庫（躲開複寫延遲）
+#   MYSQL_REPLICA_RETRY_SEC=30               副本連不上或連線中斷後，暫停使用幾秒再試
+#
+# 規則：
+#   寫入（exec_sql）一律走主庫，寫完呼叫 mark_write()：這個請求之後的讀取、以及同一 session
+#   接下來 MYSQL_READ_YOUR_WRITES_SEC 秒內的讀取都走主庫（例如註冊後的 LAST_INSERT_ID()、
+#   新增任務後 redirect 回列表）。
+#   其他讀取輪流挑一台健康的副本；同一個請求內沿用同一台（連線存在 g，請求結束時關閉）。
+#   副本連不上或連線中斷 → 標記暫停、換下一台；全部不可用 → 主庫。
+#   其他錯誤（SQL 錯誤、鎖等待逾時、死結…）直接丟出，不換台也不標記。
+#
+# 用法（app.py）：
+#   router = db_router.Router(app, primary=lambda: mysql.connection)
+#   rows = router.read(lambda conn: ...)      # 出錯會換副本重跑 fn
+#   conn = router.connection()               # 串流讀取用（只在取得連線時容錯）
+#   router.mark_write()
+import itertools
+import os
+import threading
+import time
+
+from flask import g, has_request_context, session
+
+RYW_KEY = "_db_rw_until"
+
+
+def parse_hosts(s, default_port=3306):
+    """'h1:3307,h2' → [('h1', 3307), ('h2', 3306)]"""
+    out = []
+    for part in (s or "").split(","):
+        part = part.strip()
+        if part:
+            host, _, port = part.partition(":")
+            out.append((host, int(port or default_port)))
+    return out
+
+
+# 連線層級的 OperationalError：連不上（2002 / 2003）、連線中斷（2006 / 2013）
+CONNECTION_ERRNOS = frozenset({2002, 2003, 2006, 2013})
+
+
+def _default_errors():
+    # 可能是「這台副本有問題」的例外；SQL 本身寫錯（ProgrammingError 等）不換台
+    errors = [OSError]
+    try:
+        import pymysql
+        errors += [pymysql.err.OperationalError, pymysql.err.InterfaceError]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_connection_error(e):
+    """
+    errors 抓到的例外是否真的是副本連線出問題。OperationalError 還包含鎖等待逾時、死結、
+    權限不足、查詢被中止等，換一台重跑只會把同樣的錯誤帶到每台副本，所以只認上面的錯誤碼。
+    """
+    try:
+        import pymysql
+    except ImportError:
+        return True
+    if isinstance(e, pymysql.err.OperationalError):
+        return bool(e.args) and e.args[0] in CONNECTION_ERRNOS
+    return True
+
+
+class Router:
+    """
+    primary：回傳主庫連線的函式（flask_mysqldb 的 mysql.connection，本身已是每個 app context 一條）
+    replicas：副本清單，預設讀 MYSQL_REPLICAS
+    connect：replica → 連線 的函式，預設依 app.config 的 MYSQL_* 以 PyMySQL 連線（測試可換成 SQLite 替身）
+    """
+
+    def __init__(self, app, primary, replicas=None, connect=None, errors=None,
+                 ryw_sec=None, retry_sec=None):
+        self.app = app
+        self.primary = primary
+        self.replicas = parse_hosts(os.getenv("MYSQL_REPLICAS")) if replicas is None else list(replicas)
+        self.connect = connect or self._mysql_connect
+        self.errors = errors or _default_errors()
+        self.ryw_sec = float(os.getenv("MYSQL_READ_YOUR_WRITES_SEC", "5")) if ryw_sec is None else ryw_sec
+        self.retry_sec = float(os.getenv("MYSQL_REPLICA_RETRY_SEC", "30")) if retry_sec is None else retry_sec
+        self._down = {}  # replica -> 可以再試的時間
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+        app.teardown_appcontext(self._teardown)
+
+    # ---------- 連線 ----------
+    def _mysql_connect(self, replica):
+        import pymysql
+
+        cfg = self.app.config
+        host, port = replica
+        return pymysql.connect(
+            host=host, port=port,
+            user=cfg["MYSQL_USER"], password=cfg["MYSQL_PASSWORD"], database=cfg["MYSQL_DB"],
+            charset=cfg.get("MYSQL_CHARSET", "utf8mb4"),
+            cursorclass=getattr(pymysql.cursors, cfg.get("MYSQL_CURSORCLASS", "DictCursor")),
+            connect_timeout=2,
+        )
+
+    def _teardown(self, exc):
+        held = g.pop("_db_replica", None)
+        if held:
+            try:
+                held[1].close()
+            except Exception:
+                pass
+
+    # ---------- 路由 ----------
+    def mark_write(self):
+        """寫入後呼叫：本請求與同 session 接下來 ryw_sec 秒的讀取都走主庫。"""
+        if not has_request_context():
+            return
+        g._db_wrote = True
+        if self.replicas and self.ryw_sec > 0:
+            session[RYW_KEY] = time.time() + self.ryw_sec
+
+    def _use_primary(self):
+        if not self.replicas or not has_request_context():
+            return True
+        return g.get("_db_wrote", False) or session.get(RYW_KEY, 0) > time.time()
+
+    def _candidates(self):
+        now = time.time()
+        with self._lock:
+            start = next(self._rr)
+            healthy = [r for r in self.replicas if self._down.get(r, 0) <= now]
+        if not healthy:
+            return []
+        i = start % len(healthy)
+        return healthy[i:] + healthy[:i]
+
+    def _fail(self, replica, err):
+        with self._lock:
+            self._down[replica] = time.time() + self.retry_sec
+        held = g.get("_db_replica")
+        if held and held[0] == replica:
+            self._teardown(None)
+        self.app.logger.warning("MySQL 副本 %s:%s 暫停使用 %ss：%s", *replica, self.retry_sec, err)
+
+    def _pick(self):
+        """回傳 (連線, replica)；走主庫時 replica 為 None。"""
+        if self._use_primary():
+            return self.primary(), None
+        held = g.get("_db_replica")
+        if held:
+            return held[1], held[0]
+        for replica in self._candidates():
+            try:
+                conn = self.connect(replica)
+            except self.errors as e:
+                if not is_connection_error(e):
+                    raise
+                self._fail(replica, e)
+                continue
+            g._db_replica = (replica, conn)
+            return conn, replica
+        return self.primary(), None
+
+    def connection(self):
+        """讀取用連線（副本或主庫）；給沒辦法重跑的串流讀取。"""
+        return self._pick()[0]
+
+    def read(self, fn):
+        """fn(conn) 在副本上執行；副本出錯就換下一台重跑，最後退回主庫。"""
+        while True:
+            conn, replica = self._pick()
+            if replica is None:
+                return fn(conn)
+            try:
+                return fn(conn)
+            except self.errors as e:
+                if not is_connection_error(e):
+                    raise
+                self._fail(replica, e)
+
@@ -0,0 +1,241 @@
+# shared/metrics.py — 各作業 Flask app 共用的請求指標，/metrics 以 Prometheus 文字格式輸出
+#
+# 用法（app.py）：
+#   sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+#   from shared import metrics
+#   metrics.install_pymongo_listener()   # Mongo：要在建立 MongoClient 之前
+#   metrics.init_app(app)
+#   @metrics.timed_db                    # MySQL：包在 query_all / query_one / exec_sql 上
+# Quart（1103test/async_app.py）也可以 init_app（註冊的是 async def hook，不經執行緒池）；Motor 的指令在它自己的執行緒池執行，
+# 只計入 db_operations_total，不分攤到個別請求的 http_request_db_seconds。
+#
+# 記錄內容（標籤 endpoint 用路由樣板，例如 /api/vitals/<patient_id>，避免標籤數爆炸）：
+#   http_request_duration_seconds    每個 endpoint 的延遲直方圖
+#   http_requests_total              依 endpoint / method / status 計數
+#   http_requests_in_flight          目前處理中的請求數
+#   http_response_size_bytes         回應大小直方圖（串流回應長度未知，不計）
+#   http_request_db_seconds          每個請求花在資料庫的時間直方圖
+#   db_operations_total              依種類（mysql / mongo 指令名稱）的資料庫操作次數
+#
+# 指標存在行程記憶體內，多個 worker 時每個 worker 各自回報（由 Prometheus 端加總）。
+# 每個請求只有兩次 perf_counter 與一次加鎖的陣列累加。
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """固定 bucket 的直方圖，依標籤分組；counts 不累加，輸出時才轉成累積值。"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # labels(tuple) -> [counts..., +Inf, sum]
+
+    def observe(self, labels, value):
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        # Prometheus 的 le 是「小於等於」，bisect_left 正好落在第一個 >= value 的 bucket
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self, label_names):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, s in sorted(self._series.items()):
+            base = _labels(label_names, labels)
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), s[:-1]):
+                acc += c
+                out.append(f'{self.name}_bucket{{{base},le="{le}"}} {acc}')
+            out.append(f"{self.name}_sum{{{base}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{base}}} {acc}")
+        return out
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = Histogram("http_request_duration_seconds", "Request latency by endpoint.", LATENCY_BUCKETS)
+        self.size = Histogram("http_response_size_bytes", "Response body size by endpoint.", SIZE_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Database time spent per request.", LATENCY_BUCKETS)
+        self.requests = {}  # (endpoint, method, status) -> n
+        self.db_ops = {}    # (kind,) -> n
+        self.in_flight = 0
+
+    def render(self):
+        with self.lock:
+            out = self.latency.render(("endpoint", "method"))
+            out += self.size.render(("endpoint",))
+            out += self.db_time.render(("endpoint",))
+            out += ["# HELP http_requests_total Requests by endpoint, method and status.",
+                    "# TYPE http_requests_total counter"]
+            out += [f"http_requests_total{{{_labels(('endpoint', 'method', 'status'), k)}}} {n}"
+                    for k, n in sorted(self.requests.items())]
+            out += ["# HELP db_operations_total Database calls by kind.",
+                    "# TYPE db_operations_total counter"]
+            out += [f"db_operations_total{{{_labels(('kind',), k)}}} {n}"
+                    for k, n in sorted(self.db_ops.items())]
+            out += ["# HELP http_requests_in_flight Requests currently being handled.",
+                    "# TYPE http_requests_in_flight gauge",
+                    f"http_requests_in_flight {self.in_flight}"]
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+# ---- 資料庫時間 ----
+def add_db_time(seconds, kind):
+    """把一次資料庫呼叫的耗時算進目前請求（不在請求中時只計次數）。"""
+    if not ENABLED:
+        return
+    if has_request_context():
+        g._metrics_db = g.get("_metrics_db", 0.0) + seconds
+    with registry.lock:
+        registry.db_ops[(kind,)] = registry.db_ops.get((kind,), 0) + 1
+
+
+def timed_db(fn, kind="mysql"):
+    """裝飾 MySQL 小工具（query_all / query_one / exec_sql），把執行時間算進請求的 DB 時間。"""
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_db_time(time.perf_counter() - t0, kind)
+    return wrapped
+
+
+def install_pymongo_listener():
+    """註冊 pymongo 指令監聽器；只影響之後才建立的 MongoClient。"""
+    if not ENABLED:
+        return
+    from pymongo import monitoring
+
+    class _MongoTimer(monitoring.CommandListener):
+        # 監聽器在送出指令的執行緒上被呼叫，因此可以直接算進該請求
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            add_db_time(event.duration_micros / 1e6, f"mongo.{event.command_name}")
+
+        def failed(self, event):
+            add_db_time(event.duration_micros / 1e6, f"mongo.{event.command_name}")
+
+    monitoring.register(_MongoTimer())
+
+
+# ---- Flask / Quart middleware ----
+def _is_quart(app):
+    return type(app).__module__.split(".")[0] == "quart"
+
+
+def _framework(app):
+    """init_app 用到的 g / request / Response：Flask，或 Quart（介面相同）"""
+    if _is_quart(app):
+        import quart
+        return quart.g, quart.request, quart.Response
+    return g, request, Response
+
+
+def _endpoint(req):
+    rule = req.url_rule
+    return rule.rule if rule is not None else "(unmatched)"
+
+
+def _body_size(resp):
+    """回應大小；串流回應（長度未知）回傳 None"""
+    if hasattr(resp, "calculate_content_length"):  # Flask
+        return None if resp.is_streamed else resp.calculate_content_length()
+    return resp.content_length  # Quart：有固定內容時已算好
+
+
+def _hooks(g, request):
+    """before / after / teardown 三個 hook 的本體；Flask 直接註冊，Quart 包成 async def"""
+
+    def start():
+        g._metrics_t0 = time.perf_counter()
+        g._metrics_db = 0.0
+        g._metrics_status = 500  # 沒走到 after_request（例外）就算 500
+        with registry.lock:
+            registry.in_flight += 1
+
+    def response(resp):
+        g._metrics_status = resp.status_code
+        n = _body_size(resp)
+        if n is not None:
+            with registry.lock:
+                registry.size.observe((_endpoint(request),), n)
+        return resp
+
+    def finish(exc):
+        # 串流回應（SSE、匯出）在串流結束後才會 teardown，延遲包含整段傳輸
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is None:
+            return
+        elapsed = time.perf_counter() - t0
+        ep = _endpoint(request)
+        key = (ep, request.method, str(500 if exc is not None else g.get("_metrics_status", 500)))
+        with registry.lock:
+            registry.in_flight -= 1
+            registry.latency.observe((ep, request.method), elapsed)
+            registry.db_time.observe((ep,), g.get("_metrics_db", 0.0))
+            registry.requests[key] = registry.requests.get(key, 0) + 1
+
+    return start, response, finish
+
+
+def init_app(app, path="/metrics"):
+    if not ENABLED:
+        return
+    g, request, Response = _framework(app)
+    start, response, finish = _hooks(g, request)
+
+    if _is_quart(app):
+        # Quart 會把同步的 hook / view 丟進執行緒池執行，每個請求多好幾次換執行緒；
+        # 這裡都只是幾個加減與一次短暫加鎖，直接在事件迴圈上跑
+        @app.before_request
+        async def _metrics_start():
+            start()
+
+        @app.after_request
+        async def _metrics_response(resp):
+            return response(resp)
+
+        @app.teardown_request
+        async def _metrics_finish(exc):
+            finish(exc)
+
+        @app.route(path, endpoint="metrics")
+        async def _metrics_view():
+            return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+        return
+
+    app.before_request(start)
+    app.after_request(response)
+    app.teardown_request(finish)
+
+    @app.route(path, endpoint="metrics")
+    def _metrics_view():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
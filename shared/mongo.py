@@ -0,0 +1,55 @@
+# shared/mongo.py — 1027test / 1103test 共用的延遲建立 MongoClient
+#
+# 用法（app.py）：
+#   from shared import mongo
+#   mongo_conn = mongo.LazyMongo(os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/medical_db"))
+#   get_client, close_client, db = mongo_conn.get_client, mongo_conn.close, mongo_conn.db
+#   db.vitals.find(...)        # 第一次存取集合時才建立 MongoClient（連線字串裡的預設資料庫）
+#
+# 配合 shared/serve.py 的 preload：建立時就登記 post_fork（丟掉 master 在 eager 模式下建立的 client，
+# worker 用到時重建）與 on_exit（worker 結束前關閉）。app 自己登記的 post_fork 排在後面，
+# 例如 1103test 在 post_fork 啟動 change stream 時拿到的已經是 worker 自己的 client。
+import threading
+
+from pymongo import MongoClient
+
+from shared import serve
+
+
+class LazyMongo:
+    def __init__(self, uri):
+        self.uri = uri
+        self._client = None
+        self._lock = threading.Lock()
+        self.db = _LazyDB(self)
+        serve.post_fork(self.reset)
+        serve.on_exit(self.close)
+
+    def get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = MongoClient(self.uri)
+        return self._client
+
+    def reset(self):
+        """fork 之後：master 的 client 不能在 worker 內使用，也不能 close（會動到 master 的 socket）"""
+        self._client = None
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class _LazyDB:
+    """第一次存取集合時才建立 MongoClient；其餘程式照舊寫 db.vitals…"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn.get_client().get_default_database(), name)
+
+    def __getitem__(self, name):
+        return self._conn.get_client().get_default_database()[name]
@@ -0,0 +1,262 @@
+# shared/profiler.py — 請求層級的取樣 profiler（預設關閉）
+#
+# 用法（app.py，放在 metrics.init_app 之後）：
+#   from shared import profiler
+#   profiler.init_app(app)
+#
+# 設定（.env）：
+#   PROFILE_ENABLED=1            開啟（沒設就完全不掛任何 hook）
+#   PROFILE_SAMPLE_RATE=0.01     隨機取樣多少比例的請求（預設 0：只剖析帶 token 的請求）
+#   PROFILE_TOKEN=some-secret    請求帶 X-Profile: some-secret 就一定剖析；/_profiles?token= 也要帶它
+#   PROFILE_LOCAL_ONLY=1         開發用：不帶 token 也讓本機連線（127.0.0.1 / ::1）看 /_profiles。
+#                                放在 reverse proxy 後面時 remote_addr 都是 proxy 的位址，不要開
+#   PROFILE_INTERVAL_MS=5        取樣間隔
+#   PROFILE_DIR=<app>/profiles   輸出目錄，每個 endpoint 一個子目錄
+#   PROFILE_KEEP=20              每個 endpoint 保留最新幾份
+#
+# 做法：被選中的請求把自己的執行緒 id 登記起來，一條共用的背景執行緒每 PROFILE_INTERVAL_MS
+# 用 sys._current_frames() 抓這些執行緒當下的 call stack 計數（不用 sys.setprofile，
+# 所以被剖析的程式碼本身不變慢，沒被選中的請求只多一次亂數判斷）。
+# 請求結束時把結果寫成 collapsed stacks（"a;b;c 次數"，flamegraph.pl / speedscope 可直接讀）。
+# /_profiles 列出各 endpoint 最新的幾份，點進去看 self / total 排名前面的函式與最常見的 stack；
+# 一律要帶 ?token=PROFILE_TOKEN（沒設 token 時頁面不開放），PROFILE_LOCAL_ONLY=1 才放行本機連線。
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Response, abort, g, render_template_string, request
+
+ENABLED = os.getenv("PROFILE_ENABLED") == "1"
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+TOKEN = os.getenv("PROFILE_TOKEN", "")
+LOCAL_ONLY = os.getenv("PROFILE_LOCAL_ONLY") == "1"
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+HEADER = "X-Profile"
+SUFFIX = ".folded"
+
+_NAME_RE = re.compile(r"^(\d{8}-\d{6})-(\w+)-(\d+)ms-(\d+)s-[0-9a-f]+\.folded$")
+
+
+class Sampler:
+    """一條背景執行緒輪流取樣所有登記中的執行緒；沒有登記時就睡著等。"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}  # thread id -> Counter(collapsed stack -> 次數)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._names = {}  # code object -> 顯示名稱
+
+    def start(self, tid):
+        with self._lock:
+            self._active[tid] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, tid):
+        with self._lock:
+            return self._active.pop(tid, None)
+
+    def _name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            path = code.co_filename
+            # site-packages 內的只留套件相對路徑，專案內的只留檔名
+            i = path.rfind("site-packages")
+            short = path[i + 14:] if i >= 0 else os.path.basename(path)
+            func = getattr(code, "co_qualname", code.co_name)
+            name = self._names[code] = f"{func} ({short}:{code.co_firstlineno})".replace(";", ":")
+        return name
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None:
+            names.append(self._name(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                items = list(self._active.items())
+            for tid, counts in items:
+                frame = frames.get(tid)
+                if frame is not None:
+                    counts[self._collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = Sampler(INTERVAL)
+
+
+def _slug(rule):
+    return re.sub(r"[^A-Za-z0-9]+", "_", rule).strip("_") or "root"
+
+
+def _wanted():
+    if _token_ok(request.headers.get(HEADER)):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def _token_ok(value):
+    return bool(TOKEN and value) and hmac.compare_digest(value.encode(), TOKEN.encode())
+
+
+def _local_or_token():
+    # remote_addr 在 proxy 後面不可信（全部都是 proxy 的位址），預設只認 token
+    return _token_ok(request.args.get("token")) or (LOCAL_ONLY and request.remote_addr in ("127.0.0.1", "::1"))
+
+
+def write_profile(out_dir, rule, method, counts, elapsed):
+    """寫一份 collapsed stacks，並刪掉同 endpoint 超過 KEEP 份的舊檔；回傳檔案路徑。"""
+    d = os.path.join(out_dir, _slug(rule))
+    os.makedirs(d, exist_ok=True)
+    name = (f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{elapsed * 1000:.0f}ms-"
+            f"{sum(counts.values())}s-{uuid.uuid4().hex[:6]}{SUFFIX}")
+    path = os.path.join(d, name)
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, n in counts.most_common():
+            f.write(f"{stack} {n}\n")
+    files = [os.path.join(d, x) for x in os.listdir(d) if x.endswith(SUFFIX)]
+    files.sort(key=os.path.getmtime)
+    for old in files[:-KEEP] if KEEP > 0 else []:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def read_profile(path):
+    """collapsed stacks 檔 → Counter"""
+    counts = Counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, n = line.rstrip("\n").rpartition(" ")
+            if stack and n.isdigit():
+                counts[stack] += int(n)
+    return counts
+
+
+def summarize(counts, top=30):
+    """self：在 stack 最末端（正在執行）的次數；total：出現在 stack 中的次數（同一 stack 只算一次）。"""
+    self_c, total_c = Counter(), Counter()
+    for stack, n in counts.items():
+        frames = stack.split(";")
+        self_c[frames[-1]] += n
+        for fr in set(frames):
+            total_c[fr] += n
+    return self_c.most_common(top), total_c.most_common(top)
+
+
+_LIST_TMPL = """<!doctype html><meta charset="utf-8"><title>profiles</title>
+<style>body{font:14px system-ui;margin:24px}td,th{padding:2px 10px;text-align:left}h3{margin-top:24px}</style>
+<h2>Profiles <small>({{ out_dir }})</small></h2>
+{% if not groups %}<p>還沒有資料：設 PROFILE_SAMPLE_RATE 或帶 {{ header }} 標頭發請求。</p>{% endif %}
+{% for ep, files in groups %}
+<h3>{{ ep }}</h3>
+<table><tr><th>時間</th><th>方法</th><th>耗時</th><th>樣本數</th><th></th></tr>
+{% for f in files %}<tr><td>{{ f.when }}</td><td>{{ f.method }}</td><td>{{ f.ms }} ms</td><td>{{ f.samples }}</td>
+<td><a href="{{ url_for('profiles_view', ep=ep, name=f.name, token=token) }}">檢視</a> ·
+<a href="{{ url_for('profiles_view', ep=ep, name=f.name, raw=1, token=token) }}">.folded</a></td></tr>{% endfor %}
+</table>{% endfor %}
+"""
+
+_VIEW_TMPL = """<!doctype html><meta charset="utf-8"><title>{{ title }}</title>
+<style>body{font:13px system-ui;margin:24px}td,th{padding:2px 10px;text-align:left;vertical-align:top}
+td.n{text-align:right}code{font-size:12px;word-break:break-all}</style>
+<p><a href="{{ url_for('profiles_index', token=token) }}">← 全部</a></p>
+<h2>{{ title }} <small>{{ name }}（{{ total }} 個樣本）</small></h2>
+<p>完整的火焰圖：下載 <a href="{{ url_for('profiles_view', ep=ep, name=name, raw=1, token=token) }}">.folded</a>
+後丟進 speedscope.app，或 <code>flamegraph.pl file.folded &gt; out.svg</code>。</p>
+<h3>Self（正在執行的函式）</h3>
+<table><tr><th>%</th><th>樣本</th><th>函式</th></tr>
+{% for fn, n in self_top %}<tr><td class="n">{{ '%.1f' % (100 * n / total) }}</td><td class="n">{{ n }}</td><td><code>{{ fn }}</code></td></tr>{% endfor %}
+</table>
+<h3>Total（含呼叫的函式）</h3>
+<table><tr><th>%</th><th>樣本</th><th>函式</th></tr>
+{% for fn, n in total_top %}<tr><td class="n">{{ '%.1f' % (100 * n / total) }}</td><td class="n">{{ n }}</td><td><code>{{ fn }}</code></td></tr>{% endfor %}
+</table>
+<h3>最常見的 stack</h3>
+<table>{% for stack, n in stacks %}<tr><td class="n">{{ n }}</td><td><code>{{ stack | replace(';', ' → ') }}</code></td></tr>{% endfor %}</table>
+"""
+
+
+def init_app(app, path="/_profiles"):
+    if not ENABLED:
+        return
+    out_dir = os.getenv("PROFILE_DIR") or os.path.join(app.root_path, "profiles")
+    skip = {path, f"{path}/<ep>/<name>", "/metrics"}
+
+    @app.before_request
+    def _profile_start():
+        rule = request.url_rule
+        if rule is None or rule.rule in skip or not _wanted():
+            return
+        g._profile = (threading.get_ident(), time.perf_counter())
+        sampler.start(g._profile[0])
+
+    @app.teardown_request
+    def _profile_finish(exc):
+        prof = g.pop("_profile", None)
+        if prof is None:
+            return
+        counts = sampler.stop(prof[0])
+        if counts:
+            try:
+                write_profile(out_dir, request.url_rule.rule, request.method, counts,
+                              time.perf_counter() - prof[1])
+            except OSError as e:
+                app.logger.warning("profile 寫入失敗：%s", e)
+
+    @app.route(path, endpoint="profiles_index")
+    def _profiles_index():
+        if not _local_or_token():
+            abort(404)
+        groups = []
+        if os.path.isdir(out_dir):
+            for ep in sorted(os.listdir(out_dir)):
+                files = []
+                for name in sorted(os.listdir(os.path.join(out_dir, ep)), reverse=True):
+                    m = _NAME_RE.match(name)
+                    if m:
+                        files.append({"name": name, "when": m.group(1), "method": m.group(2),
+                                      "ms": m.group(3), "samples": m.group(4)})
+                if files:
+                    groups.append((ep, files))
+        return render_template_string(_LIST_TMPL, groups=groups, out_dir=out_dir, header=HEADER,
+                                      token=request.args.get("token"))
+
+    @app.route(f"{path}/<ep>/<name>", endpoint="profiles_view")
+    def _profiles_view(ep, name):
+        if not _local_or_token() or not _NAME_RE.match(name) or not re.fullmatch(r"\w+", ep):
+            abort(404)
+        file = os.path.join(out_dir, ep, name)
+        if not os.path.isfile(file):
+            abort(404)
+        if request.args.get("raw"):
+            with open(file, encoding="utf-8") as f:
+                return Response(f.read(), mimetype="text/plain; charset=utf-8",
+                                headers={"Content-Disposition": f"attachment; filename={name}"})
+        counts = read_profile(file)
+        self_top, total_top = summarize(counts)
+        return render_template_string(_VIEW_TMPL, title=f"{_NAME_RE.match(name).group(2)} {ep}", name=name, ep=ep, token=request.args.get("token"),
+                                      total=max(sum(counts.values()), 1), self_top=self_top,
+                                      total_top=total_top, stacks=counts.most_common(15))
@@ -0,0 +1,138 @@
+# shared/serve.py — 各作業 app 的正式環境入口（gunicorn，取代 app.run(debug=True)）
+#
+#   python shared/serve.py 1103test                 # 參數為 app 所在目錄
+#   WEB_WORKERS=4 WEB_THREADS=8 python shared/serve.py HW2
+#
+# 設定（<app>/.env 或環境變數）：
+#   WEB_BIND=0.0.0.0:8000        也接受 PORT（Render 等平台會給）
+#   WEB_WORKERS=2×CPU+1          worker 行程數
+#   WEB_THREADS=4                每個 worker 的執行緒數（gthread；等 DB 時不佔 CPU，可比核心數多）
+#   WEB_TIMEOUT=30               單一請求卡住多久就重啟該 worker
+#   WEB_GRACEFUL_TIMEOUT=20      收到 SIGTERM 後等進行中的請求（含 SSE）最多幾秒
+#   WEB_KEEPALIVE=5
+#   WEB_MAX_REQUESTS=0           每個 worker 處理幾個請求後換新（0＝不換；防記憶體慢慢長）
+#   WEB_ACCESS_LOG=-             access log 輸出位置（- 為 stdout；預設不寫）
+#
+# preload：master 先 import app（templates、路由、pandas 等只載入一次，fork 後共用記憶體頁），
+# 再 fork 出 worker。fork 前建立的 MongoClient / 背景執行緒不能帶進子行程，
+# 所以 app 用 post_fork() 登記「每個 worker 重新建立」的動作，用 on_exit() 登記結束前要做的事
+# （關連線、寫出緩衝）；直接 python app.py 時 post_fork 的函式不會被呼叫，PRELOADING 為 False。
+# SIGTERM：worker 停止接新連線，等進行中的請求做完（最多 WEB_GRACEFUL_TIMEOUT 秒，
+# SSE 這類長連線會等到逾時），再跑 on_exit() 的函式、flush log 與 stdout 後結束。
+#
+# 注意：metrics 在行程記憶體內，多個 worker 時各算各的；HW2 的片段快取雖然每個 worker 各存一份，
+# 版本號在 users.frag_version，任一 worker 的寫入都會讓所有 worker 的片段失效（見 fragment_cache.py）。
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PRELOADING = False
+WORKERS = 1  # run() 在 import app 之前設好；app 可據此決定行程內的東西（例如推播）要不要改走共用的管道
+_post_fork = []
+_on_exit = []
+
+log = logging.getLogger("serve")
+
+
+def post_fork(fn):
+    """登記 fork 之後在每個 worker 內執行的函式（重建連線、啟動背景執行緒）。可當 decorator。"""
+    _post_fork.append(fn)
+    return fn
+
+
+def on_exit(fn):
+    """登記 worker 結束前執行的函式（關連線、flush）。可當 decorator。"""
+    _on_exit.append(fn)
+    return fn
+
+
+def run_post_fork():
+    for fn in _post_fork:
+        fn()
+
+
+def run_on_exit():
+    for fn in _on_exit:
+        try:
+            fn()
+        except Exception as e:
+            log.warning("on_exit %s 失敗：%s", getattr(fn, "__name__", fn), e)
+    logging.shutdown()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def create_app(name):
+    """載入 <repo>/<name>/app.py 並回傳其中的 Flask app（app 目錄加進 sys.path，讓同層模組可以 import）。"""
+    app_dir = os.path.join(ROOT, name)
+    path = os.path.join(app_dir, "app.py")
+    if not os.path.isfile(path):
+        raise SystemExit(f"找不到 {path}")
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+    os.chdir(app_dir)  # 各 app 習慣在自己的目錄下執行（py app.py），相對路徑照舊
+    spec = importlib.util.spec_from_file_location("app", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def options_from_env(name):
+    bind = os.getenv("WEB_BIND") or f"0.0.0.0:{os.getenv('PORT', '8000')}"
+    return {
+        "bind": bind,
+        "workers": int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() * 2 + 1))),
+        "threads": int(os.getenv("WEB_THREADS", "4")),
+        "worker_class": "gthread",
+        "timeout": int(os.getenv("WEB_TIMEOUT", "30")),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "20")),
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS", "0")) // 10,
+        "preload_app": True,
+        "proc_name": f"web-{name}",
+        "accesslog": os.getenv("WEB_ACCESS_LOG") or None,
+        # gunicorn 的 hook：只在 worker 內執行
+        "post_fork": lambda server, worker: run_post_fork(),
+        "worker_exit": lambda server, worker: run_on_exit(),
+    }
+
+
+def run(name, **overrides):
+    from gunicorn.app.base import BaseApplication
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(ROOT, name, ".env"))  # WEB_* 要在 import app 之前就讀到
+    except ImportError:
+        pass
+    options = {**options_from_env(name), **overrides}
+
+    class _Server(BaseApplication):
+        def load_config(self):
+            for k, v in options.items():
+                if v is not None and k in self.cfg.settings:
+                    self.cfg.set(k, v)
+
+        def load(self):
+            global PRELOADING, WORKERS
+            PRELOADING = True  # 在 master 內 import；之後 fork 出的 worker 也保有 True
+            WORKERS = options["workers"]
+            return create_app(name)
+
+    _Server().run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        raise SystemExit("用法：python shared/serve.py <app 目錄，例如 1103test / HW2>")
+    # app 內 import 的是 shared.serve；經由同一個模組執行，post_fork / on_exit 的登記才看得到
+    sys.path.insert(0, ROOT)
+    from shared import serve
+    serve.run(sys.argv[1])